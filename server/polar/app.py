@@ -4,11 +4,17 @@ from fastapi.routing import APIRoute
 from starlette.middleware.cors import CORSMiddleware
 
 from polar import receivers  # noqa
+
+# Registers tasks, so that enqueues from the API see their coalescing options
+from polar import tasks  # noqa
 from polar.api import router
 from polar.config import settings
+from polar.eventstream.hub import hub as eventstream_hub
+from polar.integrations.github.pool import pool as github_pool
 from polar.logging import configure as configure_logging
 from polar.health.endpoints import router as health_router
 from polar.sentry import configure_sentry
+from polar.worker import close_pool
 
 log = structlog.get_logger()
 
@@ -38,6 +44,10 @@ def create_app() -> FastAPI:
     app.include_router(health_router)
 
     app.include_router(router)
+
+    app.add_event_handler("shutdown", close_pool)
+    app.add_event_handler("shutdown", eventstream_hub.close)
+    app.add_event_handler("shutdown", github_pool.close)
     return app
 
 
@@ -0,0 +1,143 @@
+import time
+from dataclasses import dataclass
+from uuid import UUID
+
+import structlog
+
+from polar.enums import Platforms
+from polar.redis import redis
+
+log = structlog.get_logger()
+
+
+@dataclass(frozen=True)
+class Grant:
+    """
+    The organization, and repository, a user was found to have access to by name.
+    """
+
+    organization_id: UUID
+    repository_id: UUID | None = None
+
+    def dumps(self, expires_at: float) -> str:
+        return f"{self.organization_id} {self.repository_id or ''} {expires_at}"
+
+    @classmethod
+    def loads(cls, value: str) -> tuple["Grant", float]:
+        organization_id, repository_id, expires_at = value.split(" ")
+        grant = cls(
+            organization_id=UUID(organization_id),
+            repository_id=UUID(repository_id) if repository_id else None,
+        )
+        return (grant, float(expires_at))
+
+
+class PrincipalCache:
+    """
+    Short lived cache of what requests authenticate and are authorized as.
+
+    Tokens are mapped to the user they were issued for, in process, saving the
+    JWT decoding. Access checks of a user to an organization, and repository, by
+    name are cached as grants, first in process for a few seconds, then in Redis.
+
+    Only IDs are cached. Requests load the user, organization and repository they
+    were granted fresh, in a single query, and fall back to the full access check
+    if that doesn't return them anymore. Only granted access is cached, and grants
+    of a user are dropped whenever its memberships change.
+    """
+
+    def __init__(
+        self, local_ttl: float = 5.0, ttl: float = 60.0, max_local_size: int = 10_000
+    ) -> None:
+        self.local_ttl = local_ttl
+        self.ttl = ttl
+        self.max_local_size = max_local_size
+        self._tokens: dict[str, tuple[UUID, float]] = {}
+        self._grants: dict[UUID, dict[str, tuple[Grant, float]]] = {}
+
+    def grants_key(self, user_id: UUID) -> str:
+        return f"auth:grants:{user_id}"
+
+    def grant_field(
+        self, platform: Platforms, org_name: str, repo_name: str | None = None
+    ) -> str:
+        return f"{platform.value}/{org_name}/{repo_name or ''}"
+
+    def get_user_id(self, token: str) -> UUID | None:
+        cached = self._tokens.get(token)
+        if cached is None:
+            return None
+        user_id, expires_at = cached
+        if expires_at < time.monotonic():
+            del self._tokens[token]
+            return None
+        return user_id
+
+    def set_user_id(self, token: str, user_id: UUID) -> None:
+        if len(self._tokens) >= self.max_local_size:
+            self._tokens.clear()
+        self._tokens[token] = (user_id, time.monotonic() + self.local_ttl)
+
+    async def get_grant(
+        self,
+        user_id: UUID,
+        platform: Platforms,
+        org_name: str,
+        repo_name: str | None = None,
+    ) -> Grant | None:
+        field = self.grant_field(platform, org_name, repo_name)
+
+        local = self._grants.get(user_id, {}).get(field)
+        if local is not None:
+            grant, expires_at = local
+            if expires_at >= time.monotonic():
+                return grant
+
+        value = await redis.hget(self.grants_key(user_id), field)
+        if value is None:
+            return None
+
+        grant, expires_at = Grant.loads(value)
+        if expires_at < time.time():
+            return None
+
+        self._set_local(user_id, field, grant)
+        return grant
+
+    async def set_grant(
+        self,
+        user_id: UUID,
+        platform: Platforms,
+        org_name: str,
+        repo_name: str | None,
+        grant: Grant,
+    ) -> None:
+        field = self.grant_field(platform, org_name, repo_name)
+        self._set_local(user_id, field, grant)
+
+        key = self.grants_key(user_id)
+        async with redis.pipeline(transaction=False) as pipe:
+            # Fields expire on their own, the key goes once the last one did
+            pipe.hset(key, field, grant.dumps(time.time() + self.ttl))
+            pipe.expire(key, int(self.ttl))
+            await pipe.execute()
+
+    async def invalidate_user(self, user_id: UUID) -> None:
+        """
+        Drop the grants of a user. Other processes keep theirs for at most
+        local_ttl.
+        """
+        self._grants.pop(user_id, None)
+        await redis.delete(self.grants_key(user_id))
+        log.debug("auth.cache.invalidated", user_id=user_id)
+
+    def _set_local(self, user_id: UUID, field: str, grant: Grant) -> None:
+        if len(self._grants) >= self.max_local_size:
+            self._grants.clear()
+        self._grants.setdefault(user_id, {})[field] = (
+            grant,
+            time.monotonic() + self.local_ttl,
+        )
+
+
+principal_cache = PrincipalCache()
@@ -81,9 +81,21 @@ class Auth:
         *,
         platform: Platforms,
         org_name: str,
+        request: Request,
         session: AsyncSession = Depends(get_db_session),
-        user: User = Depends(must_current_active_user),
     ) -> "Auth":
+        user_id = AuthService.get_user_id_from_request(request=request)
+        if not user_id:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+
+        granted = await AuthService.get_granted(
+            session, user_id=user_id, platform=platform, org_name=org_name
+        )
+        if granted:
+            user, organization, _ = granted
+            return Auth(user=user, organization=organization)
+
+        user = await must_current_active_user(request, session)
         organization = await organization_service.get_for_user(
             session,
             platform=platform,
@@ -94,6 +106,10 @@ class Auth:
             raise HTTPException(
                 status_code=404, detail="Organization not found for user"
             )
+
+        await AuthService.set_granted(
+            user=user, platform=platform, organization=organization
+        )
         return Auth(user=user, organization=organization)
 
     @classmethod
@@ -103,9 +119,25 @@ class Auth:
         platform: Platforms,
         org_name: str,
         repo_name: str,
+        request: Request,
         session: AsyncSession = Depends(get_db_session),
-        user: User = Depends(must_current_active_user),
     ) -> "Auth":
+        user_id = AuthService.get_user_id_from_request(request=request)
+        if not user_id:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+
+        granted = await AuthService.get_granted(
+            session,
+            user_id=user_id,
+            platform=platform,
+            org_name=org_name,
+            repo_name=repo_name,
+        )
+        if granted:
+            user, org, repo = granted
+            return Auth(user=user, organization=org, repository=repo)
+
+        user = await must_current_active_user(request, session)
         try:
             org, repo = await organization_service.get_with_repo_for_user(
                 session,
@@ -114,13 +146,17 @@ class Auth:
                 repo_name=repo_name,
                 user_id=user.id,
             )
-            return Auth(user=user, organization=org, repository=repo)
         except ResourceNotFound:
             raise HTTPException(
                 status_code=404,
                 detail="Organization/repository combination not found for user",
             )
 
+        await AuthService.set_granted(
+            user=user, platform=platform, organization=org, repository=repo
+        )
+        return Auth(user=user, organization=org, repository=repo)
+
     @classmethod
     async def backoffice_user(
         cls,
@@ -2,14 +2,18 @@ import structlog
 from fastapi import Response, Request
 from pydantic import validator
 from datetime import datetime
+from uuid import UUID
 
 from polar.kit import jwt
 from polar.kit.schemas import Schema
 from polar.config import settings
-from polar.models import User
-from polar.postgres import AsyncSession
+from polar.enums import Platforms
+from polar.models import Organization, Repository, User, UserOrganization
+from polar.postgres import AsyncSession, sql
 from polar.user.service import user as user_service
 
+from .cache import Grant, principal_cache
+
 log = structlog.get_logger()
 
 
@@ -90,18 +94,103 @@ class AuthService:
     async def get_user_from_request(
         cls, session: AsyncSession, *, request: Request
     ) -> User | None:
+        user_id = cls.get_user_id_from_request(request=request)
+        if not user_id:
+            return None
+        return await user_service.get(session, id=user_id)
+
+    @classmethod
+    def get_user_id_from_request(cls, *, request: Request) -> UUID | None:
         token = cls.get_token_from_auth_cookie(request=request)
         if not token:
             token = cls.get_token_from_auth_header(request=request)
             if not token:
                 return None
 
+        user_id = principal_cache.get_user_id(token)
+        if user_id:
+            return user_id
+
         try:
             decoded = jwt.decode(token=token, secret=settings.SECRET)
-            return await user_service.get(session, id=decoded["user_id"])
+            user_id = UUID(decoded["user_id"])
         except jwt.DecodeError:
             return None
 
+        principal_cache.set_user_id(token, user_id)
+        return user_id
+
+    @classmethod
+    async def get_granted(
+        cls,
+        session: AsyncSession,
+        *,
+        user_id: UUID,
+        platform: Platforms,
+        org_name: str,
+        repo_name: str | None = None,
+    ) -> tuple[User, Organization, Repository | None] | None:
+        """
+        Load a user with the organization, and repository, it was last granted
+        access to by name, in a single query. Returns None if the grant isn't
+        cached, or doesn't hold anymore.
+
+        The grant only saves looking the organization and repository up by name,
+        membership is still checked by the query.
+        """
+        grant = await principal_cache.get_grant(user_id, platform, org_name, repo_name)
+        if grant is None:
+            return None
+
+        statement = (
+            sql.select(User, Organization)
+            .join_from(User, UserOrganization, UserOrganization.user_id == User.id)
+            .join(Organization, Organization.id == UserOrganization.organization_id)
+        ).where(
+            User.id == user_id,
+            User.deleted_at.is_(None),
+            Organization.id == grant.organization_id,
+            Organization.platform == platform,
+            Organization.name == org_name,
+            Organization.deleted_at.is_(None),
+        )
+        if repo_name:
+            statement = statement.add_columns(Repository).where(
+                Repository.id == grant.repository_id,
+                Repository.organization_id == Organization.id,
+                Repository.name == repo_name,
+                Repository.deleted_at.is_(None),
+            )
+
+        res = await session.execute(statement)
+        row = res.unique().one_or_none()
+        if row is None:
+            return None
+
+        if repo_name:
+            return (row[0], row[1], row[2])
+        return (row[0], row[1], None)
+
+    @classmethod
+    async def set_granted(
+        cls,
+        *,
+        user: User,
+        platform: Platforms,
+        organization: Organization,
+        repository: Repository | None = None,
+    ) -> None:
+        await principal_cache.set_grant(
+            user.id,
+            platform,
+            organization.name,
+            repository.name if repository else None,
+            Grant(
+                organization_id=organization.id,
+                repository_id=repository.id if repository else None,
+            ),
+        )
+
     @classmethod
     def get_token_from_auth_cookie(cls, *, request: Request) -> str | None:
         return request.cookies.get(settings.AUTH_COOKIE_KEY)
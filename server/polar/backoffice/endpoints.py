@@ -18,6 +18,9 @@ from polar.integrations.github.service.organization import (
 from polar.integrations.github.service.repository import (
     github_repository as github_repository_service,
 )
+from polar.integrations.github.backfill import repository_backfill
+from polar.integrations.github.scheduler import crawl_scheduler
+from polar.integrations.github.schemas import BackfillProgress, CrawlBudget
 
 from .pledge_service import bo_pledges_service
 
@@ -125,3 +128,35 @@ async def organization_sync(
     )
 
     return org
+
+
+@router.get("/organization/crawl/{name}", response_model=CrawlBudget)
+async def organization_crawl(
+    name: str,
+    auth: Auth = Depends(Auth.backoffice_user),
+    session: AsyncSession = Depends(get_db_session),
+) -> CrawlBudget:
+    org = await github_organization_service.get_by_name(session, Platforms.github, name)
+    if not org or not org.installation_id:
+        raise HTTPException(
+            status_code=404,
+            detail="Org not found",
+        )
+
+    return await crawl_scheduler.stats(org.installation_id)
+
+
+@router.get("/organization/backfill/{name}", response_model=BackfillProgress)
+async def organization_backfill(
+    name: str,
+    auth: Auth = Depends(Auth.backoffice_user),
+    session: AsyncSession = Depends(get_db_session),
+) -> BackfillProgress:
+    org = await github_organization_service.get_by_name(session, Platforms.github, name)
+    if not org or not org.installation_id:
+        raise HTTPException(
+            status_code=404,
+            detail="Org not found",
+        )
+
+    return await repository_backfill.progress(org.installation_id)
@@ -52,6 +52,11 @@ class Settings(BaseSettings):
     REDIS_HOST: str = "127.0.0.1"
     REDIS_PORT: int = 6379
 
+    # Keep events in capped Redis Streams, so that reconnecting clients can catch
+    # up on what they missed through Last-Event-ID
+    EVENTSTREAM_DURABLE: bool = False
+    EVENTSTREAM_MAXLEN: int = 1000
+
     # Github App
     GITHUB_APP_IDENTIFIER: str = ""
     GITHUB_APP_WEBHOOK_SECRET: str = ""
@@ -61,6 +66,24 @@ class Settings(BaseSettings):
     GITHUB_REDIRECT_URL: str = "http://127.0.0.1:3000/github/session"
     GITHUB_POLAR_USER_ACCESS_TOKEN: str = ""
 
+    # Connection pool shared by GitHub clients
+    GITHUB_HTTP_MAX_CONNECTIONS: int = 100
+    GITHUB_HTTP_MAX_KEEPALIVE: int = 20
+    GITHUB_HTTP_KEEPALIVE_EXPIRY: float = 60.0
+    # Requires the h2 package
+    GITHUB_HTTP2: bool = False
+
+    # Refresh stale issues with batched GraphQL queries, instead of a REST request
+    # per issue
+    GITHUB_ISSUE_REFRESH_BATCH: bool = True
+
+    # Repositories of an installation backfilled at once
+    GITHUB_BACKFILL_CONCURRENCY: int = 2
+
+    # Webhooks are buffered once the worker queue is this deep, and moved to the
+    # queue as it drains
+    GITHUB_WEBHOOK_MAX_QUEUE_DEPTH: int = 50_000
+
     # Stripe
     STRIPE_SECRET_KEY: str = ""
     # Stripe webhook secret
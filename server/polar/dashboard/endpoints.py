@@ -18,6 +18,7 @@ from polar.dashboard.schemas import (
 )
 from polar.enums import Platforms
 from polar.integrations.github.service.organization import github_organization
+from polar.issue.dependency_graph import issue_dependency_graph
 from polar.issue.schemas import IssueRead, IssueReferenceRead
 from polar.issue.service import issue
 from polar.models.issue import Issue
@@ -181,6 +182,7 @@ async def dashboard(
         if for_user and IssueListType.dependencies
         else None,
         have_pledge=True if only_pledged else None,
+        organization_id=for_org.id if for_org else None,
         load_references=True,
         load_pledges=True,
         include_statuses=status,
@@ -189,33 +191,31 @@ async def dashboard(
         offset=offset,
     )
 
-    issue_organizations = list(
-        (
-            await session.execute(
-                sql.select(Organization).where(
-                    Organization.id.in_(list(set([i.organization_id for i in issues])))
-                )
-            )
-        )
-        .scalars()
-        .unique()
-        .all()
-    )
+    # Organizations and repositories of the issues, by id. Only the ones we don't
+    # have already are loaded.
+    issue_organizations: dict[UUID, Organization] = {}
     if for_org:
-        issue_organizations.append(for_org)
+        issue_organizations[for_org.id] = for_org
+    issue_repositories: dict[UUID, Repository] = {r.id: r for r in in_repos}
 
-    issue_repositories = list(
-        (
-            await session.execute(
-                sql.select(Repository).where(
-                    Repository.id.in_(list(set([i.repository_id for i in issues])))
-                )
-            )
+    async def load_organizations_and_repositories(issues: Sequence[Issue]) -> None:
+        organization_ids = {i.organization_id for i in issues} - set(
+            issue_organizations
         )
-        .scalars()
-        .unique()
-        .all()
-    ) + list(in_repos)
+        if organization_ids:
+            res = await session.execute(
+                sql.select(Organization).where(Organization.id.in_(organization_ids))
+            )
+            issue_organizations.update({o.id: o for o in res.scalars().unique()})
+
+        repository_ids = {i.repository_id for i in issues} - set(issue_repositories)
+        if repository_ids:
+            res = await session.execute(
+                sql.select(Repository).where(Repository.id.in_(repository_ids))
+            )
+            issue_repositories.update({r.id: r for r in res.scalars().unique()})
+
+    await load_organizations_and_repositories(issues)
 
     included: dict[str, Entry[Any]] = {}
 
@@ -236,7 +236,7 @@ async def dashboard(
             id=i.organization_id,
             type="organization",
             attributes=OrganizationPublicRead.from_orm(
-                [o for o in issue_organizations if o.id == i.organization_id][0]
+                issue_organizations[i.organization_id]
             ),
         )
 
@@ -244,9 +244,7 @@ async def dashboard(
         included[str(i.repository_id)] = Entry(
             id=i.repository_id,
             type="repository",
-            attributes=RepositoryRead.from_orm(
-                [r for r in issue_repositories if r.id == i.repository_id][0]
-            ),
+            attributes=RepositoryRead.from_orm(issue_repositories[i.repository_id]),
         )
 
         org_data = RelationshipData(type="organization", id=i.organization_id)
@@ -328,10 +326,13 @@ async def dashboard(
             if isinstance(ir.data, list):  # it always is
                 ir.data.append(RelationshipData(type="reference", id=ref.external_id))
 
-    # get dependents
+    # get dependents, including the ones depending on an issue through other issues
     if issue_list_type == IssueListType.dependencies:
-        issue_deps = await issue.list_issue_dependencies_for_repositories(
-            session, in_repos
+        issue_deps = await issue_dependency_graph.list_dependencies_for_repositories(
+            session, [r.id for r in in_repos]
+        )
+        await load_organizations_and_repositories(
+            [dep.dependent_issue for dep in issue_deps]
         )
 
         for dep in issue_deps:
@@ -342,11 +343,7 @@ async def dashboard(
                 id=dependent_issue.organization_id,
                 type="organization",
                 attributes=OrganizationPublicRead.from_orm(
-                    [
-                        o
-                        for o in issue_organizations
-                        if o.id == dependent_issue.organization_id
-                    ][0]
+                    issue_organizations[dependent_issue.organization_id]
                 ),
             )
 
@@ -355,11 +352,7 @@ async def dashboard(
                 id=dependent_issue.repository_id,
                 type="repository",
                 attributes=RepositoryRead.from_orm(
-                    [
-                        r
-                        for r in issue_repositories
-                        if r.id == dependent_issue.repository_id
-                    ][0]
+                    issue_repositories[dependent_issue.repository_id]
                 ),
             )
 
@@ -1,75 +1,94 @@
-import asyncio
 from typing import Any, AsyncGenerator
 
 import structlog
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header
 from sse_starlette.sse import EventSourceResponse
-from fastapi import Request
 
 
+from polar.config import settings
 from polar.enums import Platforms
 from polar.auth.dependencies import Auth
-from polar.redis import get_redis
-from polar.redis import Redis
-from redis.exceptions import ConnectionError
 
 
-from .service import Receivers
+from .hub import hub
+from .service import (
+    Receivers,
+    format_last_event_id,
+    get_stream_tips,
+    parse_entry_id,
+    parse_last_event_id,
+    parse_message,
+    replay,
+)
 
 router = APIRouter(tags=["stream"])
 
 log = structlog.get_logger()
 
+# Seconds between keepalive comments sent on idle streams
+PING_INTERVAL = 15
+
 
 async def subscribe(
-    redis: Redis,
-    channels: list[str],
-    request: Request,
+    channels: list[str], last_event_id: str | None = None
 ) -> AsyncGenerator[Any, Any]:
-    async with redis.pubsub() as pubsub:
-        await pubsub.subscribe(*channels)
+    # EventSourceResponse cancels the generator when the client disconnects
+    async with hub.subscribe(channels) as queue:
+        if not settings.EVENTSTREAM_DURABLE:
+            while True:
+                _, message = await queue.get()
+                yield parse_message(message)[1]
+
+        # Subscribed before replaying, so that nothing falls in between. Events
+        # received both ways are skipped on the live side.
+        cursors = parse_last_event_id(last_event_id, channels)
+        replayed: dict[str, tuple[int, int]] = {}
+        if cursors is None:
+            cursors = await get_stream_tips(channels)
+        else:
+            events = await replay(cursors)
+            log.info("eventstream.replay", channels=channels, events=len(events))
+            for channel, entry_id, data in events:
+                cursors[channel] = entry_id
+                yield {"id": format_last_event_id(cursors, channels), "data": data}
+            replayed = {c: parse_entry_id(id) for c, id in cursors.items()}
 
         while True:
-            if await request.is_disconnected():
-                await pubsub.close()
-                break
-
-            try:
-                message = await pubsub.get_message(
-                    ignore_subscribe_messages=True,
-                )
-
-                if message is not None:
-                    log.info("redis.pubsub", message=message["data"])
-                    yield message["data"]
-            except asyncio.CancelledError as e:
-                await pubsub.close()
-                raise e
-            except ConnectionError as e:
-                await pubsub.close()
-                raise e
+            channel, message = await queue.get()
+            entry_id, data = parse_message(message)
+            if entry_id is None:
+                yield data
+                continue
+
+            if channel in replayed and parse_entry_id(entry_id) <= replayed[channel]:
+                continue
+
+            cursors[channel] = entry_id
+            yield {"id": format_last_event_id(cursors, channels), "data": data}
 
 
 @router.get("/user/stream")
 async def user_stream(
-    request: Request,
     auth: Auth = Depends(Auth.current_user),
-    redis: Redis = Depends(get_redis),
+    last_event_id: str | None = Header(None),
 ) -> EventSourceResponse:
     receivers = Receivers(user_id=auth.user.id)
-    return EventSourceResponse(subscribe(redis, receivers.get_channels(), request))
+    return EventSourceResponse(
+        subscribe(receivers.get_channels(), last_event_id), ping=PING_INTERVAL
+    )
 
 
 @router.get("/{platform}/{org_name}/stream")
 async def user_org_stream(
     platform: Platforms,
     org_name: str,
-    request: Request,
     auth: Auth = Depends(Auth.user_with_org_access),
-    redis: Redis = Depends(get_redis),
+    last_event_id: str | None = Header(None),
 ) -> EventSourceResponse:
     receivers = Receivers(user_id=auth.user.id, organization_id=auth.organization.id)
-    return EventSourceResponse(subscribe(redis, receivers.get_channels(), request))
+    return EventSourceResponse(
+        subscribe(receivers.get_channels(), last_event_id), ping=PING_INTERVAL
+    )
 
 
 @router.get("/{platform}/{org_name}/{repo_name}/stream")
@@ -77,13 +96,14 @@ async def user_org_repo_stream(
     platform: Platforms,
     org_name: str,
     repo_name: str,
-    request: Request,
     auth: Auth = Depends(Auth.user_with_org_and_repo_access),
-    redis: Redis = Depends(get_redis),
+    last_event_id: str | None = Header(None),
 ) -> EventSourceResponse:
     receivers = Receivers(
         user_id=auth.user.id,
         organization_id=auth.organization.id,
         repository_id=auth.repository.id,
     )
-    return EventSourceResponse(subscribe(redis, receivers.get_channels(), request))
+    return EventSourceResponse(
+        subscribe(receivers.get_channels(), last_event_id), ping=PING_INTERVAL
+    )
@@ -0,0 +1,138 @@
+import asyncio
+from collections import defaultdict
+from collections.abc import AsyncIterator, Sequence
+from contextlib import asynccontextmanager
+
+import structlog
+from redis.asyncio.client import PubSub
+from redis.exceptions import ConnectionError
+
+from polar.redis import Redis, redis
+
+log = structlog.get_logger()
+
+# (channel, data)
+Message = tuple[str, str]
+
+
+class PubSubHub:
+    """
+    Process wide Redis subscriber, shared by every event stream of the process.
+
+    A single pubsub connection holds the subscriptions of all the streams, and a
+    single reader task blocks on it, routing each message to the queues of the
+    streams listening on its channel. Channels are reference counted: Redis is
+    subscribed to a channel when its first stream opens, and unsubscribed when its
+    last stream closes.
+    """
+
+    def __init__(
+        self, redis: Redis, max_queue_size: int = 100, retry_delay: float = 1.0
+    ) -> None:
+        self.redis = redis
+        self.max_queue_size = max_queue_size
+        self.retry_delay = retry_delay
+        self._queues: defaultdict[str, set[asyncio.Queue[Message]]] = defaultdict(set)
+        self._lock = asyncio.Lock()
+        self._pubsub: PubSub | None = None
+        self._reader: asyncio.Task[None] | None = None
+
+    @property
+    def channels(self) -> list[str]:
+        return list(self._queues.keys())
+
+    @asynccontextmanager
+    async def subscribe(
+        self, channels: Sequence[str]
+    ) -> AsyncIterator[asyncio.Queue[Message]]:
+        """
+        Subscribe to channels, yields a queue receiving the (channel, message) pairs
+        published on any of them until the context exits.
+        """
+        queue: asyncio.Queue[Message] = asyncio.Queue(maxsize=self.max_queue_size)
+        await self._add(queue, channels)
+        try:
+            yield queue
+        finally:
+            await self._remove(queue, channels)
+
+    async def _add(
+        self, queue: asyncio.Queue[Message], channels: Sequence[str]
+    ) -> None:
+        async with self._lock:
+            new_channels = [c for c in channels if c not in self._queues]
+            for channel in channels:
+                self._queues[channel].add(queue)
+
+            if self._pubsub is None:
+                self._pubsub = self.redis.pubsub()
+            if new_channels:
+                await self._pubsub.subscribe(*new_channels)
+
+            # The pubsub connection only exists once subscribed to something
+            if self._reader is None or self._reader.done():
+                self._reader = asyncio.create_task(self._read(self._pubsub))
+
+    async def _remove(
+        self, queue: asyncio.Queue[Message], channels: Sequence[str]
+    ) -> None:
+        async with self._lock:
+            unused_channels = []
+            for channel in channels:
+                queues = self._queues.get(channel)
+                if queues is None:
+                    continue
+                queues.discard(queue)
+                if not queues:
+                    del self._queues[channel]
+                    unused_channels.append(channel)
+
+            if unused_channels and self._pubsub is not None:
+                try:
+                    await self._pubsub.unsubscribe(*unused_channels)
+                except ConnectionError:
+                    # Resubscribing on reconnect only covers the remaining channels
+                    log.warning("eventstream.hub.unsubscribe_failed")
+
+    async def _read(self, pubsub: PubSub) -> None:
+        while True:
+            try:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=None
+                )
+                if message is not None:
+                    self._dispatch(message["channel"], message["data"])
+            except ConnectionError as e:
+                # The next read reconnects and subscribes to the channels again
+                log.warning("eventstream.hub.connection_error", error=str(e))
+                await asyncio.sleep(self.retry_delay)
+            except Exception:
+                # Ending the task would hang every stream of the process
+                log.exception("eventstream.hub.read_error")
+                await asyncio.sleep(self.retry_delay)
+
+    def _dispatch(self, channel: str, data: str) -> None:
+        for queue in self._queues.get(channel, ()):
+            try:
+                queue.put_nowait((channel, data))
+            except asyncio.QueueFull:
+                # A stream that far behind is a stalled client, don't buffer for it
+                log.warning("eventstream.hub.queue_full", channel=channel)
+
+    async def close(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+
+        self._queues.clear()
+
+
+hub = PubSubHub(redis)
@@ -1,8 +1,13 @@
+import asyncio
+import time
+from collections.abc import Awaitable, Callable, Iterable
 from uuid import UUID
 from typing import Any
 
+import structlog
 from pydantic import BaseModel
 
+from polar.config import settings
 from polar.kit.utils import generate_uuid
 from polar.postgres import AsyncSession
 from polar.redis import redis
@@ -10,6 +15,8 @@ from polar.user_organization.service import (
     user_organization as user_organization_service,
 )
 
+log = structlog.get_logger()
+
 
 class Receivers(BaseModel):
     user_id: UUID | None = None
@@ -39,10 +46,130 @@ class Event(BaseModel):
     payload: dict[str, Any]
 
 
+# Streams of channels that haven't seen an event for that long are dropped
+STREAM_TTL_SECONDS = 60 * 60 * 24
+
+# Append the event to the channel's stream, and publish it prefixed with its entry
+# ID, so that subscribers can tell where they are in the stream.
+DURABLE_SEND_SCRIPT = """
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[3], '*', 'event', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('PUBLISH', ARGV[1], id .. ' ' .. ARGV[2])
+return id
+"""
+
+durable_send = redis.register_script(DURABLE_SEND_SCRIPT)
+
+
+def stream_key(channel: str) -> str:
+    return f"eventstream:{channel}"
+
+
+def parse_entry_id(entry_id: str) -> tuple[int, int]:
+    ms, seq = entry_id.split("-")
+    return (int(ms), int(seq))
+
+
+def parse_message(message: str) -> tuple[str | None, str]:
+    """
+    Split a published message into its stream entry ID, if sent durably, and the
+    event JSON.
+    """
+    if message.startswith("{"):
+        return (None, message)
+    entry_id, data = message.split(" ", 1)
+    return (entry_id, data)
+
+
+def format_last_event_id(cursors: dict[str, str], channels: list[str]) -> str:
+    return ",".join(cursors[channel] for channel in channels)
+
+
+def parse_last_event_id(
+    last_event_id: str | None, channels: list[str]
+) -> dict[str, str] | None:
+    """
+    Last-Event-ID holds the position of the client in the stream of every channel
+    it listens on, in the order of the channels.
+    """
+    if not last_event_id:
+        return None
+
+    entry_ids = last_event_id.split(",")
+    if len(entry_ids) != len(channels):
+        return None
+    try:
+        for entry_id in entry_ids:
+            parse_entry_id(entry_id)
+    except ValueError:
+        return None
+
+    return dict(zip(channels, entry_ids))
+
+
+async def get_stream_tips(channels: list[str]) -> dict[str, str]:
+    async with redis.pipeline(transaction=False) as pipe:
+        for channel in channels:
+            pipe.xrevrange(stream_key(channel), count=1)
+        results = await pipe.execute()
+
+    return {
+        channel: entries[0][0] if entries else "0-0"
+        for channel, entries in zip(channels, results)
+    }
+
+
+async def replay(cursors: dict[str, str]) -> list[tuple[str, str, str]]:
+    """
+    Events of the channels streams after the given cursors, as (channel, entry ID,
+    event JSON) tuples, in a single round trip.
+    """
+    channels = list(cursors.keys())
+    async with redis.pipeline(transaction=False) as pipe:
+        for channel in channels:
+            pipe.xrange(
+                stream_key(channel),
+                min=f"({cursors[channel]}",
+                count=settings.EVENTSTREAM_MAXLEN,
+            )
+        results = await pipe.execute()
+
+    events = [
+        (channel, entry_id, fields["event"])
+        for channel, entries in zip(channels, results)
+        for entry_id, fields in entries
+    ]
+    return sorted(events, key=lambda e: parse_entry_id(e[1]))
+
+
+async def send_many(events: Iterable[tuple[Event, list[str]]]) -> None:
+    """
+    Send events to their channels in a single round trip, serialising each event
+    once whatever its number of channels.
+    """
+    async with redis.pipeline(transaction=False) as pipe:
+        for event, channels in events:
+            event_json = event.json()
+            for channel in channels:
+                if not settings.EVENTSTREAM_DURABLE:
+                    pipe.publish(channel, event_json)
+                    continue
+
+                await durable_send(
+                    keys=[stream_key(channel)],
+                    args=[
+                        channel,
+                        event_json,
+                        settings.EVENTSTREAM_MAXLEN,
+                        STREAM_TTL_SECONDS,
+                    ],
+                    client=pipe,
+                )
+        await pipe.execute()
+
+
 async def send(event: Event, channels: list[str]) -> None:
-    event_json = event.json()
-    for channel in channels:
-        await redis.publish(channel, event_json)
+    await send_many([(event, channels)])
 
 
 async def publish(
@@ -74,12 +201,71 @@ async def publish_members(
         session, org_id=organization_id
     )
 
-    for m in members:
-        receivers = Receivers(user_id=m.user_id)
-        channels = receivers.get_channels()
-        event = Event(
-            id=generate_uuid(),
-            key=key,
-            payload=payload,
-        )
-        await send(event, channels)
+    channels = [
+        channel
+        for m in members
+        for channel in Receivers(user_id=m.user_id).get_channels()
+    ]
+    event = Event(
+        id=generate_uuid(),
+        key=key,
+        payload=payload,
+    )
+    await send(event, channels)
+
+
+class Throttle:
+    """
+    Sends at most one event per key and interval, for progress events that only
+    matter for their latest value. Events coming in during the interval are held,
+    and the latest of them is sent at its end, so that the last one isn't lost.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._sent_at: dict[str, float] = {}
+        self._pending: dict[str, Callable[[], Awaitable[None]]] = {}
+        self._trailing: dict[str, asyncio.Task[None]] = {}
+
+    async def send(self, key: str, send: Callable[[], Awaitable[None]]) -> None:
+        now = time.monotonic()
+        self._expire(now)
+
+        sent_at = self._sent_at.get(key)
+        if sent_at is None:
+            self._sent_at[key] = now
+            await send()
+            return
+
+        self._pending[key] = send
+        if key not in self._trailing:
+            self._trailing[key] = asyncio.create_task(
+                self._send_trailing(key, sent_at + self.interval - now)
+            )
+
+    def reset(self, key: str) -> None:
+        self._sent_at.pop(key, None)
+        self._pending.pop(key, None)
+        trailing = self._trailing.pop(key, None)
+        if trailing is not None:
+            trailing.cancel()
+
+    async def _send_trailing(self, key: str, delay: float) -> None:
+        await asyncio.sleep(delay)
+        del self._trailing[key]
+        send = self._pending.pop(key)
+        self._sent_at[key] = time.monotonic()
+        try:
+            await send()
+        except Exception:
+            log.exception("eventstream.throttle.send_failed", key=key)
+
+    def _expire(self, now: float) -> None:
+        # Keys that aren't reset, as their sync failed, would stay forever
+        expired = [
+            key
+            for key, sent_at in self._sent_at.items()
+            if now - sent_at >= self.interval and key not in self._trailing
+        ]
+        for key in expired:
+            del self._sent_at[key]
@@ -0,0 +1,333 @@
+import enum
+import time
+from collections.abc import Sequence
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+
+import structlog
+
+from polar.config import settings
+from polar.models import Repository
+from polar.redis import redis
+from polar.worker import enqueue_many
+
+from .schemas import BackfillProgress
+
+log = structlog.get_logger()
+
+
+class BackfillStatus(str, enum.Enum):
+    pending = "pending"
+    in_progress = "in_progress"
+    done = "done"
+    failed = "failed"
+
+
+class BackfillResource(str, enum.Enum):
+    issues = "issues"
+    pull_requests = "pull_requests"
+
+
+# Start the most valuable pending repositories of an installation, up to ARGV[2]
+# running at once, each holding a lease until ARGV[3]. Repositories whose lease
+# expired, as their job died with its worker, are started again first. Queued
+# repositories that are already running are dropped.
+FILL_SCRIPT = """
+local now = tonumber(ARGV[1])
+local concurrency = tonumber(ARGV[2])
+local lease = tonumber(ARGV[3])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)
+for _, member in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], member)
+    redis.call('ZADD', KEYS[1], '+inf', member)
+end
+local started = {}
+local slots = concurrency - redis.call('ZCARD', KEYS[2])
+while slots > 0 do
+    local popped = redis.call('ZPOPMAX', KEYS[1])
+    if #popped == 0 then
+        break
+    end
+    if not redis.call('ZSCORE', KEYS[2], popped[1]) then
+        redis.call('ZADD', KEYS[2], lease, popped[1])
+        table.insert(started, popped[1])
+        slots = slots - 1
+    end
+end
+return started
+"""
+
+
+def repository_backfill_value(
+    repository: Repository, now: float | None = None
+) -> float:
+    """
+    How soon a repository should be backfilled. Recently pushed repositories come
+    first, then those with the most open issues. Archived ones come last.
+    """
+    if repository.is_archived:
+        return 0.0
+
+    now = now or time.time()
+    value = 1.0 + min(repository.open_issues or 0, 10_000) / 10
+    if repository.repository_pushed_at:
+        age_days = max(now - repository.repository_pushed_at.timestamp(), 0) / 86400
+        value += 1000 / (1 + age_days)
+    return value
+
+
+class RepositoryBackfill:
+    """
+    Backfill of the issues and pull requests of an installation's repositories.
+
+    Every installation has a state record and a queue of repositories ordered by
+    value, and every repository a state record holding its status and the page to
+    resume from. At most concurrency repositories of an installation are synced at
+    once, so that a large installation doesn't flood the worker queue. Running
+    repositories hold a lease, renewed at every page, and are resumed from their
+    saved page if their job dies without completing them. A repository that's
+    started max_attempts times in a row without storing a page is given up on.
+    """
+
+    installations_key = "github:backfill:installations"
+
+    def __init__(
+        self,
+        concurrency: int | None = None,
+        lease: timedelta = timedelta(hours=2),
+        max_attempts: int = 5,
+    ) -> None:
+        self.concurrency = concurrency or settings.GITHUB_BACKFILL_CONCURRENCY
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._fill = redis.register_script(FILL_SCRIPT)
+
+    def state_key(self, installation_id: int) -> str:
+        return f"github:backfill:{installation_id}"
+
+    def queue_key(self, installation_id: int) -> str:
+        return f"github:backfill:{installation_id}:queue"
+
+    def running_key(self, installation_id: int) -> str:
+        return f"github:backfill:{installation_id}:running"
+
+    def repository_key(self, repository_id: UUID) -> str:
+        return f"github:backfill:repository:{repository_id}"
+
+    async def start(
+        self,
+        installation_id: int,
+        organization_id: UUID,
+        repositories: Sequence[Repository],
+    ) -> None:
+        """
+        Queue the backfill of repositories. Repositories already being backfilled
+        carry on from where they are, the others start over.
+        """
+        if not repositories:
+            return
+
+        async with redis.pipeline(transaction=False) as pipe:
+            for repository in repositories:
+                pipe.hget(self.repository_key(repository.id), "status")
+            statuses = await pipe.execute()
+
+        now = time.time()
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hset(
+                self.state_key(installation_id),
+                mapping={
+                    "status": BackfillStatus.in_progress.value,
+                    "organization_id": str(organization_id),
+                    "started_at": int(now),
+                },
+            )
+            pipe.sadd(self.installations_key, installation_id)
+
+            queued: dict[str, float] = {}
+            resumed: dict[str, float] = {}
+            for repository, status in zip(repositories, statuses):
+                if status == BackfillStatus.in_progress.value:
+                    # Resumed first, unless it's running
+                    resumed[str(repository.id)] = float("inf")
+                    continue
+                pipe.hset(
+                    self.repository_key(repository.id),
+                    mapping={
+                        "status": BackfillStatus.pending.value,
+                        "resource": BackfillResource.issues.value,
+                        "page": 1,
+                        "attempts": 0,
+                    },
+                )
+                queued[str(repository.id)] = repository_backfill_value(repository, now)
+            if queued:
+                pipe.zadd(self.queue_key(installation_id), queued)
+            if resumed:
+                pipe.zadd(self.queue_key(installation_id), resumed, nx=True)
+            await pipe.execute()
+
+        log.info(
+            "github.backfill.started",
+            installation_id=installation_id,
+            queued=len(queued),
+            repositories=len(repositories),
+        )
+        await self.fill(installation_id)
+
+    async def fill(self, installation_id: int) -> list[UUID]:
+        """
+        Enqueue backfill jobs for as many queued repositories as the concurrency
+        allows, returns their IDs.
+        """
+        organization_id = await redis.hget(
+            self.state_key(installation_id), "organization_id"
+        )
+        if organization_id is None:
+            await redis.srem(self.installations_key, installation_id)
+            return []
+
+        now = time.time()
+        started = await self._fill(
+            keys=[self.queue_key(installation_id), self.running_key(installation_id)],
+            args=[now, self.concurrency, now + self.lease.total_seconds()],
+        )
+        repository_ids = [UUID(id) for id in started]
+
+        if repository_ids:
+            async with redis.pipeline(transaction=False) as pipe:
+                for repository_id in repository_ids:
+                    pipe.hincrby(self.repository_key(repository_id), "attempts", 1)
+                attempts = await pipe.execute()
+
+            failed = [
+                repository_id
+                for repository_id, count in zip(repository_ids, attempts)
+                if count > self.max_attempts
+            ]
+            repository_ids = [id for id in repository_ids if id not in failed]
+            if repository_ids:
+                await enqueue_many(
+                    "github.repo.backfill",
+                    [
+                        (installation_id, UUID(organization_id), repository_id)
+                        for repository_id in repository_ids
+                    ],
+                )
+            if failed:
+                # Start others in their place
+                await self._fail(installation_id, failed)
+                return repository_ids + await self.fill(installation_id)
+            return repository_ids
+
+        progress = await self.progress(installation_id)
+        if progress.queued == 0 and progress.running == 0:
+            await self._finish(installation_id)
+        return repository_ids
+
+    async def get_cursor(self, repository_id: UUID) -> tuple[BackfillResource, int]:
+        """
+        The resource and page to resume the backfill of a repository from.
+        """
+        state = await redis.hgetall(self.repository_key(repository_id))
+        try:
+            return (BackfillResource(state["resource"]), int(state["page"]))
+        except (KeyError, ValueError):
+            return (BackfillResource.issues, 1)
+
+    async def checkpoint(
+        self,
+        installation_id: int,
+        repository_id: UUID,
+        resource: BackfillResource,
+        page: int,
+    ) -> None:
+        """
+        Save the page to resume from, and renew the lease of the repository. Its
+        attempts are reset, as it's making progress.
+        """
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hset(
+                self.repository_key(repository_id),
+                mapping={
+                    "status": BackfillStatus.in_progress.value,
+                    "resource": resource.value,
+                    "page": page,
+                    "attempts": 0,
+                },
+            )
+            pipe.zadd(
+                self.running_key(installation_id),
+                {str(repository_id): time.time() + self.lease.total_seconds()},
+                xx=True,
+            )
+            await pipe.execute()
+
+    async def complete(self, installation_id: int, repository_id: UUID) -> None:
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hset(
+                self.repository_key(repository_id),
+                "status",
+                BackfillStatus.done.value,
+            )
+            pipe.zrem(self.running_key(installation_id), str(repository_id))
+            await pipe.execute()
+
+        log.info(
+            "github.backfill.repository_done",
+            installation_id=installation_id,
+            repository_id=repository_id,
+        )
+        await self.fill(installation_id)
+
+    async def installations(self) -> list[int]:
+        return [int(id) for id in await redis.smembers(self.installations_key)]
+
+    async def progress(self, installation_id: int) -> BackfillProgress:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self.state_key(installation_id))
+            pipe.zcard(self.queue_key(installation_id))
+            pipe.zcard(self.running_key(installation_id))
+            state, queued, running = await pipe.execute()
+
+        started_at = state.get("started_at")
+        return BackfillProgress(
+            installation_id=installation_id,
+            status=state.get("status"),
+            queued=queued,
+            running=running,
+            concurrency=self.concurrency,
+            started_at=datetime.fromtimestamp(int(started_at), timezone.utc)
+            if started_at
+            else None,
+        )
+
+    async def _fail(self, installation_id: int, repository_ids: list[UUID]) -> None:
+        async with redis.pipeline(transaction=True) as pipe:
+            for repository_id in repository_ids:
+                pipe.hset(
+                    self.repository_key(repository_id),
+                    "status",
+                    BackfillStatus.failed.value,
+                )
+            pipe.zrem(self.running_key(installation_id), *map(str, repository_ids))
+            await pipe.execute()
+
+        log.warning(
+            "github.backfill.repositories_failed",
+            installation_id=installation_id,
+            repository_ids=repository_ids,
+            attempts=self.max_attempts,
+        )
+
+    async def _finish(self, installation_id: int) -> None:
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hset(
+                self.state_key(installation_id), "status", BackfillStatus.done.value
+            )
+            pipe.srem(self.installations_key, installation_id)
+            await pipe.execute()
+        log.info("github.backfill.done", installation_id=installation_id)
+
+
+repository_backfill = RepositoryBackfill()
@@ -0,0 +1,76 @@
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+import structlog
+
+from polar.redis import redis
+
+log = structlog.get_logger()
+
+# (org, repo, number)
+BadgeKey = tuple[str, str, int]
+
+
+class BadgeAmountCache:
+    """
+    Pledged amounts shown on issue badges, keyed by (org, repo, number), in Redis
+    with a small in-process tier in front.
+
+    Badges are fetched through GitHub's image proxy every time an issue is viewed.
+    The pledge hooks write the new amount as soon as the pledges of an issue
+    change, so entries are kept in Redis for long. Other processes aren't told
+    about changes, so entries are kept in process for a few seconds only.
+    """
+
+    prefix = "github:badge:amount:"
+
+    def __init__(
+        self,
+        ttl: timedelta = timedelta(days=7),
+        local_ttl: float = 5.0,
+        max_size: int = 10_000,
+    ) -> None:
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.max_size = max_size
+        self._local: OrderedDict[str, tuple[int, float]] = OrderedDict()
+
+    def key(self, badge: BadgeKey) -> str:
+        org, repo, number = badge
+        return f"{self.prefix}{org.lower()}/{repo.lower()}#{number}"
+
+    async def get(self, badge: BadgeKey) -> int | None:
+        key = self.key(badge)
+        item = self._local.get(key)
+        if item is not None:
+            amount, expires_at = item
+            if expires_at > time.monotonic():
+                return amount
+            del self._local[key]
+
+        value = await redis.get(key)
+        if value is None:
+            return None
+
+        try:
+            amount = int(value)
+        except ValueError:
+            log.warning("github.badge_cache.invalid", key=key)
+            return None
+        self._set_local(key, amount)
+        return amount
+
+    async def set(self, badge: BadgeKey, amount: int) -> None:
+        key = self.key(badge)
+        await redis.setex(key, self.ttl, amount)
+        self._set_local(key, amount)
+
+    def _set_local(self, key: str, amount: int) -> None:
+        self._local[key] = (amount, time.monotonic() + self.local_ttl)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+
+
+badge_amount_cache = BadgeAmountCache()
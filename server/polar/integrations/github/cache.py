@@ -1,26 +1,167 @@
 import datetime
+import time
+from collections import OrderedDict
+from collections.abc import Iterable, Mapping
 from typing import Optional
+
+import structlog
 from githubkit.cache.base import BaseCache
-from polar.redis import sync_redis
+
+from polar.redis import redis, sync_redis
+
+log = structlog.get_logger()
+
+
+class CacheStats:
+    """
+    In-process hit and miss counters, flushed to the log once per interval.
+    """
+
+    def __init__(self, interval: float = 60.0) -> None:
+        self.interval = interval
+        self._reset(time.monotonic())
+
+    def _reset(self, now: float) -> None:
+        self._started_at = now
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def record(
+        self, *, local_hits: int = 0, redis_hits: int = 0, misses: int = 0
+    ) -> None:
+        self.local_hits += local_hits
+        self.redis_hits += redis_hits
+        self.misses += misses
+        self._maybe_flush()
+
+    @property
+    def lookups(self) -> int:
+        return self.local_hits + self.redis_hits + self.misses
+
+    def _maybe_flush(self) -> None:
+        now = time.monotonic()
+        if now - self._started_at < self.interval:
+            return
+
+        lookups = max(self.lookups, 1)
+        log.info(
+            "github.cache.stats",
+            lookups=self.lookups,
+            local_hit_rate=round(self.local_hits / lookups, 3),
+            redis_hit_rate=round(self.redis_hits / lookups, 3),
+            miss_rate=round(self.misses / lookups, 3),
+        )
+        self._reset(now)
 
 
 class RedisCache(BaseCache):
-    """Redis Backed Cache"""
+    """
+    Redis Backed Cache, with an in-process LRU tier in front.
+
+    Cached values (app JWTs, installation tokens) are valid until they expire
+    whichever process created them, so the in-process tier keeps them for their
+    whole lifetime and most lookups never leave the process. The async methods use
+    the async Redis client, so that a lookup never blocks the event loop, the sync
+    ones are only there for the sync githubkit methods.
+    """
+
+    prefix = "githubkit:"
 
-    def __init__(self) -> None:
-        pass
+    def __init__(self, max_size: int = 10_000) -> None:
+        self.max_size = max_size
+        self.stats = CacheStats()
+        self._local: OrderedDict[str, tuple[str, float]] = OrderedDict()
+
+    def _get_local(self, key: str) -> Optional[str]:
+        item = self._local.get(key)
+        if item is None:
+            return None
+
+        value, expires_at = item
+        if expires_at <= time.time():
+            del self._local[key]
+            return None
+
+        self._local.move_to_end(key)
+        return value
+
+    def _set_local(self, key: str, value: str, ex: datetime.timedelta) -> None:
+        self._local[key] = (value, time.time() + ex.total_seconds())
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
 
     def get(self, key: str) -> Optional[str]:
-        val = sync_redis.get("githubkit:" + key)
+        if (value := self._get_local(key)) is not None:
+            self.stats.record(local_hits=1)
+            return value
+
+        val = sync_redis.get(self.prefix + key)
         if val:
+            self.stats.record(redis_hits=1)
             return str(val)
+        self.stats.record(misses=1)
         return None
 
     async def aget(self, key: str) -> Optional[str]:
-        return self.get(key)
+        return (await self.aget_many([key]))[key]
+
+    async def aget_many(self, keys: Iterable[str]) -> dict[str, Optional[str]]:
+        """
+        Look up keys, those missing from the in-process tier in a single Redis
+        round trip. Values fetched from Redis are kept in process for what remains
+        of their TTL.
+        """
+        values: dict[str, Optional[str]] = {}
+        missing: list[str] = []
+        for key in keys:
+            values[key] = self._get_local(key)
+            if values[key] is None:
+                missing.append(key)
+
+        local_hits = len(values) - len(missing)
+        if not missing:
+            self.stats.record(local_hits=local_hits)
+            return values
+
+        async with redis.pipeline(transaction=False) as pipe:
+            for key in missing:
+                pipe.get(self.prefix + key)
+                pipe.pttl(self.prefix + key)
+            results = await pipe.execute()
+
+        redis_hits = 0
+        for i, key in enumerate(missing):
+            value, pttl = results[2 * i], results[2 * i + 1]
+            if not value:
+                continue
+            redis_hits += 1
+            values[key] = str(value)
+            if pttl > 0:
+                self._set_local(key, values[key], datetime.timedelta(milliseconds=pttl))
+
+        self.stats.record(
+            local_hits=local_hits,
+            redis_hits=redis_hits,
+            misses=len(missing) - redis_hits,
+        )
+        return values
 
     def set(self, key: str, value: str, ex: datetime.timedelta) -> None:
-        sync_redis.setex("githubkit:" + key, time=ex, value=value)
+        self._set_local(key, value, ex)
+        sync_redis.setex(self.prefix + key, time=ex, value=value)
 
     async def aset(self, key: str, value: str, ex: datetime.timedelta) -> None:
-        return self.set(key, value, ex)
+        await self.aset_many({key: value}, ex)
+
+    async def aset_many(self, items: Mapping[str, str], ex: datetime.timedelta) -> None:
+        async with redis.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                self._set_local(key, value, ex)
+                pipe.setex(self.prefix + key, ex, value)
+            await pipe.execute()
+
+
+# Shared by every client, so that they share the in-process tier
+redis_cache = RedisCache()
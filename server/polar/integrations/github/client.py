@@ -1,7 +1,6 @@
-import time
-from typing import Any, Union
-from pydantic import Field
+from typing import Any
 
+import httpx
 import structlog
 from fastapi.encoders import jsonable_encoder
 from githubkit import (
@@ -18,7 +17,10 @@ from githubkit import (
 
 from polar.config import settings
 from polar.enums import Platforms
-from polar.integrations.github.cache import RedisCache
+from polar.integrations.github.cache import redis_cache
+from polar.integrations.github.pool import PooledGitHub, pool
+from polar.integrations.github.scheduler import crawl_scheduler
+from polar.integrations.github.token_refresh import token_refresher
 from polar.models.user import User
 from polar.postgres import AsyncSession
 
@@ -101,19 +103,6 @@ def ensure_expected_response(
 ###############################################################################
 
 
-class RefreshAccessToken(rest.GitHubRestModel):
-    access_token: str = Field(default=...)  # The new access token
-    expires_in: int = Field(
-        default=...
-    )  # The number of seconds until access_token expires (will always be 28800)
-    refresh_token: Union[str, None] = Field(
-        default=...
-    )  # A new refres token (is only set if the app is using expiring refresh tokens)
-    refresh_token_expires_in: Union[int, None] = Field(default=...)
-    scope: str = Field(default=...)  # Always an empty string
-    token_type: str = Field(default=...)  # Always "bearer"
-
-
 async def get_user_client(
     session: AsyncSession, user: User
 ) -> GitHub[TokenAuthStrategy]:
@@ -121,43 +110,21 @@ async def get_user_client(
     if not oauth:
         raise Exception("no github oauth account found")
 
-    # if token expires within 30 minutes, refresh it
-    if (
-        oauth.expires_at
-        and oauth.refresh_token
-        and oauth.expires_at <= (time.time() + 60 * 30)
+    if token_refresher.expires_within(oauth, token_refresher.refresh_before):
+        await token_refresher.refresh(session, oauth)
+    elif token_refresher.expires_within(
+        oauth, token_refresher.background_refresh_before
     ):
-        refresh = await GitHub().arequest(
-            method="POST",
-            url="https://github.com/login/oauth/access_token",
-            params={
-                "client_id": settings.GITHUB_CLIENT_ID,
-                "client_secret": settings.GITHUB_CLIENT_SECRET,
-                "refresh_token": oauth.refresh_token,
-                "grant_type": "refresh_token",
-            },
-            headers={"Accept": "application/json"},
-            response_model=RefreshAccessToken,
-        )
-
-        if refresh:
-            r = refresh.parsed_data
-            # update
-            oauth.access_token = r.access_token
-            oauth.expires_at = int(time.time()) + r.expires_in
-            if r.refresh_token:
-                oauth.refresh_token = r.refresh_token
-
-            log.info("github.auth.refresh.succeeded", user=user.id)
-            await oauth.save(session)
-        else:
-            log.error("github.auth.refresh.failed", user=user.id)
+        await token_refresher.schedule([oauth.id])
 
     return get_client(oauth.access_token)
 
 
 def get_client(access_token: str) -> GitHub[TokenAuthStrategy]:
-    return GitHub(access_token)
+    return pool.get(
+        ("token", access_token),
+        lambda: PooledGitHub[TokenAuthStrategy](TokenAuthStrategy(access_token)),
+    )
 
 
 def get_polar_client() -> GitHub[TokenAuthStrategy]:
@@ -168,35 +135,57 @@ def get_polar_client() -> GitHub[TokenAuthStrategy]:
 
 
 def get_app_client() -> GitHub[AppAuthStrategy]:
-    return GitHub(
-        AppAuthStrategy(
-            app_id=settings.GITHUB_APP_IDENTIFIER,
-            private_key=settings.GITHUB_APP_PRIVATE_KEY,
-            client_id=settings.GITHUB_CLIENT_ID,
-            client_secret=settings.GITHUB_CLIENT_SECRET,
-            cache=RedisCache(),
-        )
+    return pool.get(
+        ("app",),
+        lambda: PooledGitHub[AppAuthStrategy](
+            AppAuthStrategy(
+                app_id=settings.GITHUB_APP_IDENTIFIER,
+                private_key=settings.GITHUB_APP_PRIVATE_KEY,
+                client_id=settings.GITHUB_CLIENT_ID,
+                client_secret=settings.GITHUB_CLIENT_SECRET,
+                cache=redis_cache,
+            )
+        ),
     )
 
 
+class InstallationGitHub(PooledGitHub[AppInstallationAuthStrategy]):
+    """
+    Installation client feeding the rate limit headers of every response to the
+    crawl scheduler, so that crawls know the installation's remaining budget.
+    """
+
+    def __init__(self, installation_id: int) -> None:
+        # Using the shared redis_cache below to cache generated JWTs and
+        # installation tokens, as they can be reused across restarts of the python
+        # process and by multiple workers.
+        super().__init__(
+            AppInstallationAuthStrategy(
+                app_id=settings.GITHUB_APP_IDENTIFIER,
+                private_key=settings.GITHUB_APP_PRIVATE_KEY,
+                installation_id=installation_id,
+                client_id=settings.GITHUB_CLIENT_ID,
+                client_secret=settings.GITHUB_CLIENT_SECRET,
+                cache=redis_cache,
+            )
+        )
+        self.installation_id = installation_id
+
+    async def _arequest(self, *args: Any, **kwargs: Any) -> httpx.Response:
+        response = await super()._arequest(*args, **kwargs)
+        await crawl_scheduler.record(self.installation_id, response.headers)
+        return response
+
+
 def get_app_installation_client(
     installation_id: int,
 ) -> GitHub[AppInstallationAuthStrategy]:
     if not installation_id:
         raise Exception("unable to create github client: no installation_id provided")
 
-    # Using the RedisCache() below to cache generated JWTs
-    # This improves ETag/If-None-Match cache hits over the default in-memory cache, as
-    # they can be reused across restarts of the python process and by multiple workers.
-    return GitHub(
-        AppInstallationAuthStrategy(
-            app_id=settings.GITHUB_APP_IDENTIFIER,
-            private_key=settings.GITHUB_APP_PRIVATE_KEY,
-            installation_id=installation_id,
-            client_id=settings.GITHUB_CLIENT_ID,
-            client_secret=settings.GITHUB_CLIENT_SECRET,
-            cache=RedisCache(),
-        )
+    return pool.get(
+        ("installation", installation_id),
+        lambda: InstallationGitHub(installation_id),
     )
 
 
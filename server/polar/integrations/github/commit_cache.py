@@ -0,0 +1,93 @@
+import json
+from collections.abc import Iterable, Mapping
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+
+import structlog
+
+from polar.redis import redis
+
+log = structlog.get_logger()
+
+# (owner, repo, sha)
+CommitKey = tuple[str, str, str]
+
+
+@dataclass(frozen=True)
+class CommitMetadata:
+    message: str | None = None
+    # The branch the commit was the head of, when first seen
+    branch_name: str | None = None
+
+    @property
+    def is_complete(self) -> bool:
+        return self.message is not None and self.branch_name is not None
+
+
+class CommitCache:
+    """
+    Metadata of GitHub commits, in Redis, keyed by (owner, repo, sha).
+
+    A commit never changes once pushed, so metadata is kept for a long time and the
+    same commit referenced from many issues is fetched from GitHub once. Metadata
+    with blanks, as the commit had no single branch or its message failed to
+    parse, is kept for a short time only, so that it's fetched again soon.
+    """
+
+    prefix = "github:commit:"
+
+    def __init__(
+        self,
+        ttl: timedelta = timedelta(days=30),
+        incomplete_ttl: timedelta = timedelta(hours=1),
+    ) -> None:
+        self.ttl = ttl
+        self.incomplete_ttl = incomplete_ttl
+
+    def key(self, commit: CommitKey) -> str:
+        owner, repo, sha = commit
+        return f"{self.prefix}{owner.lower()}/{repo.lower()}/{sha}"
+
+    async def get_many(
+        self, commits: Iterable[CommitKey]
+    ) -> dict[CommitKey, CommitMetadata]:
+        """
+        Look up commits in a single round trip, returns those that are cached.
+        """
+        commits = list(dict.fromkeys(commits))
+        if not commits:
+            return {}
+
+        values = await redis.mget([self.key(commit) for commit in commits])
+
+        cached: dict[CommitKey, CommitMetadata] = {}
+        for commit, value in zip(commits, values):
+            if value is None:
+                continue
+            try:
+                cached[commit] = CommitMetadata(**json.loads(value))
+            except (TypeError, ValueError):
+                log.warning("github.commit_cache.invalid", key=self.key(commit))
+
+        log.debug(
+            "github.commit_cache.get_many",
+            lookups=len(commits),
+            hits=len(cached),
+        )
+        return cached
+
+    async def set_many(self, commits: Mapping[CommitKey, CommitMetadata]) -> None:
+        if not commits:
+            return
+
+        async with redis.pipeline(transaction=False) as pipe:
+            for commit, metadata in commits.items():
+                pipe.setex(
+                    self.key(commit),
+                    self.ttl if metadata.is_complete else self.incomplete_ttl,
+                    json.dumps(asdict(metadata)),
+                )
+            await pipe.execute()
+
+
+commit_cache = CommitCache()
@@ -1,3 +1,4 @@
+import time
 from typing import Any, Literal, Optional, Tuple
 from uuid import UUID
 
@@ -28,6 +29,13 @@ from polar.postgres import AsyncSession, get_db_session
 from polar.posthog.service import posthog_service
 from polar.worker import enqueue_job
 
+from .badge_cache import badge_amount_cache
+from .ingestion import (
+    ingestion_stats,
+    queue_depth,
+    read_verified_body,
+    webhook_overflow,
+)
 from .schemas import (
     AuthorizationResponse,
     GithubBadgeRead,
@@ -35,7 +43,6 @@ from .schemas import (
 )
 from .service.issue import github_issue
 from .service.organization import github_organization
-from .service.repository import github_repository
 from .service.user import github_user
 
 log = structlog.get_logger()
@@ -128,6 +135,26 @@ async def github_callback(
 ###############################################################################
 
 
+# Badges are fetched through GitHub's image proxy, and pledges can't purge it
+BADGE_MAX_AGE = 60
+BADGE_STALE_WHILE_REVALIDATE = 600
+
+
+def badge_etag(badge_type: str, amount: int) -> str:
+    # The response only depends on both, so it's a strong ETag
+    return f'"{badge_type}-{amount}"'
+
+
+def etag_matches(etag: str, if_none_match: str | None) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(",")
+    )
+
+
 @router.get(
     "/{org}/{repo}/issues/{number}/badges/{badge_type}", response_model=GithubBadgeRead
 )
@@ -136,33 +163,32 @@ async def get_badge_settings(
     repo: str,
     number: int,
     badge_type: Literal["pledge"],
+    request: Request,
+    response: Response,
     session: AsyncSession = Depends(get_db_session),
-) -> GithubBadgeRead:
-    organization = await github_organization.get_by_name(session, Platforms.github, org)
-    if organization is None:
-        raise HTTPException(status_code=404, detail="Organization not found")
-
-    repository = await github_repository.get_by_org_and_name(
-        session, organization.id, repo
-    )
-    if repository is None:
-        raise HTTPException(status_code=404, detail="Repository not found")
-
-    issue = await github_issue.get_by(
-        session,
-        organization_id=organization.id,
-        repository_id=repository.id,
-        number=number,
-    )
-
-    if not issue:
-        raise HTTPException(status_code=404, detail="Issue not found")
+) -> GithubBadgeRead | Response:
+    amount = await badge_amount_cache.get((org, repo, number))
+    if amount is None:
+        amount = await github_issue.get_badge_amount(
+            session, org_name=org, repo_name=repo, number=number
+        )
+        if amount is None:
+            raise HTTPException(status_code=404, detail="Issue not found")
+        await badge_amount_cache.set((org, repo, number), amount)
 
-    pledges = await pledge_service.get_by_issue_ids(session, [issue.id])
-    amount = sum([p.amount for p in pledges]) or 0
+    etag = badge_etag(badge_type, amount)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": (
+            f"public, max-age={BADGE_MAX_AGE}, "
+            f"stale-while-revalidate={BADGE_STALE_WHILE_REVALIDATE}"
+        ),
+    }
+    if etag_matches(etag, request.headers.get("If-None-Match")):
+        return Response(status_code=304, headers=headers)
 
-    badge = GithubBadgeRead(badge_type=badge_type, amount=amount)
-    return badge
+    response.headers.update(headers)
+    return GithubBadgeRead(badge_type=badge_type, amount=amount)
 
 
 ###############################################################################
@@ -229,38 +255,57 @@ IMPLEMENTED_WEBHOOKS = {
 }
 
 
+IMPLEMENTED_SCOPES = {event.split(".")[0] for event in IMPLEMENTED_WEBHOOKS}
+
+
 def not_implemented() -> WebhookResponse:
     return WebhookResponse(success=False, message="Not implemented")
 
 
-async def enqueue(request: Request) -> WebhookResponse:
-    json_body = await request.json()
-    event_scope = request.headers["X-GitHub-Event"]
-    event_action = json_body["action"] if "action" in json_body else None
-    event_name = f"{event_scope}.{event_action}" if event_action else event_scope
+@router.post("/webhook", response_model=WebhookResponse, status_code=202)
+async def webhook(request: Request, response: Response) -> WebhookResponse:
+    """
+    Verify and enqueue a GitHub delivery as-is.
 
-    if event_name not in IMPLEMENTED_WEBHOOKS:
+    The payload is never parsed here: github.webhook.dispatch decodes it in the
+    worker and routes it to the handler matching its action.
+    """
+    payload = await read_verified_body(request, settings.GITHUB_APP_WEBHOOK_SECRET)
+    if payload is None:
+        # Should be 403 Forbidden, but...
+        # Throwing unsophisticated hackers/scrapers/bots off the scent
+        raise HTTPException(status_code=404)
+
+    event_scope = request.headers.get("X-GitHub-Event", "")
+    if event_scope not in IMPLEMENTED_SCOPES:
         return not_implemented()
 
-    task_name = f"github.webhook.{event_name}"
-    enqueued = await enqueue_job(task_name, event_scope, event_action, json_body)
+    delivery_id = request.headers.get("X-GitHub-Delivery")
+
+    # Once the queue has room again, deliveries still go behind the buffered ones
+    # until they're drained, so that those of an issue are dispatched in order
+    overloaded = await queue_depth.is_overloaded()
+    if await webhook_overflow.push(
+        event_scope, delivery_id, payload, if_not_empty=not overloaded
+    ):
+        ingestion_stats.record_buffered()
+        log.warning(
+            "github.webhook.buffered",
+            event_scope=event_scope,
+            delivery_id=delivery_id,
+            queue_depth=queue_depth.depth,
+        )
+        return WebhookResponse(success=True, message="Buffered")
+
+    start = time.monotonic()
+    enqueued = await enqueue_job(
+        "github.webhook.dispatch", event_scope, delivery_id, payload
+    )
+    ingestion_stats.record_enqueue(time.monotonic() - start)
+
     if not enqueued:
+        response.status_code = 500
         return WebhookResponse(success=False, message="Failed to enqueue task")
 
-    log.info("github.webhook.queued", task_name=task_name)
+    log.info("github.webhook.queued", event_scope=event_scope, delivery_id=delivery_id)
     return WebhookResponse(success=True, job_id=enqueued.job_id)
-
-
-@router.post("/webhook", response_model=WebhookResponse)
-async def webhook(request: Request) -> WebhookResponse:
-    valid_signature = github.webhooks.verify(
-        settings.GITHUB_APP_WEBHOOK_SECRET,
-        await request.body(),
-        request.headers["X-Hub-Signature-256"],
-    )
-    if valid_signature:
-        return await enqueue(request)
-
-    # Should be 403 Forbidden, but...
-    # Throwing unsophisticated hackers/scrapers/bots off the scent
-    raise HTTPException(status_code=404)
@@ -0,0 +1,204 @@
+from collections.abc import Mapping, Sequence
+from typing import Any
+from uuid import UUID
+
+from polar.enums import Platforms
+from polar.issue.schemas import IssueCreate
+from polar.models import Issue
+
+# Most issues GitHub lets us fetch in a single query, see
+# https://docs.github.com/en/graphql/overview/resource-limitations
+MAX_ISSUES_PER_QUERY = 100
+
+ISSUE_FRAGMENTS = """
+fragment ActorFields on Actor {
+  __typename
+  login
+  avatarUrl
+  url
+  ... on User { databaseId }
+  ... on Bot { databaseId }
+  ... on Organization { databaseId }
+  ... on Mannequin { databaseId }
+}
+
+fragment IssueFields on Issue {
+  databaseId
+  number
+  title
+  body
+  state
+  stateReason
+  authorAssociation
+  createdAt
+  updatedAt
+  closedAt
+  author { ...ActorFields }
+  assignees(first: 10) { nodes { ...ActorFields } }
+  labels(first: 50) { nodes { id name color description isDefault url } }
+  milestone { number title description state dueOn url }
+  comments { totalCount }
+  reactionGroups { content reactors { totalCount } }
+  timelineItems(itemTypes: [CLOSED_EVENT], last: 1) {
+    nodes { ... on ClosedEvent { actor { ...ActorFields } } }
+  }
+}
+"""
+
+# GraphQL reaction contents, by the name of their REST reactions rollup field
+REACTIONS = {
+    "plus_one": "THUMBS_UP",
+    "minus_one": "THUMBS_DOWN",
+    "laugh": "LAUGH",
+    "confused": "CONFUSED",
+    "heart": "HEART",
+    "hooray": "HOORAY",
+    "eyes": "EYES",
+    "rocket": "ROCKET",
+}
+
+
+def build_issues_query(
+    issues: Sequence[tuple[str, str, int]]
+) -> tuple[str, dict[str, Any], dict[tuple[str, str, int], tuple[str, str]]]:
+    """
+    Build a query fetching the given (owner, repo, number) issues, each under an
+    aliased issue(number:) node of an aliased repository node.
+
+    Returns the query, its variables, and the (repository alias, issue alias) of
+    every issue.
+    """
+    repositories: dict[tuple[str, str], list[int]] = {}
+    for owner, repo, number in issues:
+        repositories.setdefault((owner, repo), []).append(number)
+
+    parameters: list[str] = []
+    selections: list[str] = []
+    variables: dict[str, Any] = {}
+    aliases: dict[tuple[str, str, int], tuple[str, str]] = {}
+    for r, ((owner, repo), numbers) in enumerate(repositories.items()):
+        parameters.append(f"$owner{r}: String!, $name{r}: String!")
+        variables[f"owner{r}"] = owner
+        variables[f"name{r}"] = repo
+
+        nodes = []
+        for i, number in enumerate(numbers):
+            nodes.append(f"i{i}: issue(number: {int(number)}) {{ ...IssueFields }}")
+            aliases[(owner, repo, number)] = (f"r{r}", f"i{i}")
+
+        selections.append(
+            f"r{r}: repository(owner: $owner{r}, name: $name{r}) "
+            f"{{ {' '.join(nodes)} }}"
+        )
+
+    query = (
+        f"query({', '.join(parameters)}) {{ {' '.join(selections)} }}" + ISSUE_FRAGMENTS
+    )
+    return (query, variables, aliases)
+
+
+def failed_issues(
+    errors: Sequence[dict[str, Any]],
+    aliases: Mapping[tuple[str, str, int], tuple[str, str]],
+) -> set[tuple[str, str, int]]:
+    """
+    Issues of a query built by build_issues_query() that couldn't be resolved for
+    another reason than not existing, like a rate limit or a timeout, from the raw
+    errors of its response. An error without a path fails them all.
+    """
+    failed_paths: set[tuple[str, ...]] = set()
+    for error in errors:
+        if error.get("type") == "NOT_FOUND":
+            continue
+        path = error.get("path")
+        if not path:
+            return set(aliases)
+        failed_paths.add(tuple(path[:2]))
+
+    return {
+        key
+        for key, (repository_alias, issue_alias) in aliases.items()
+        if (repository_alias,) in failed_paths
+        or (repository_alias, issue_alias) in failed_paths
+    }
+
+
+def _actor(node: dict[str, Any] | None) -> dict[str, Any] | None:
+    if not node:
+        return None
+    return {
+        "login": node["login"],
+        "id": node.get("databaseId"),
+        "avatar_url": node["avatarUrl"],
+        "html_url": node["url"],
+        "type": node["__typename"],
+    }
+
+
+def _lower(value: str | None) -> str | None:
+    return value.lower() if value else None
+
+
+def issue_from_graphql(
+    node: dict[str, Any], organization_id: UUID, repository_id: UUID
+) -> IssueCreate:
+    """
+    Normalize an issue fetched with IssueFields like REST issues are.
+    """
+    reaction_counts = {
+        group["content"]: group["reactors"]["totalCount"]
+        for group in node["reactionGroups"] or []
+    }
+    reactions = {
+        name: reaction_counts.get(content, 0) for name, content in REACTIONS.items()
+    }
+    reactions["total_count"] = sum(reactions.values())
+
+    assignees = [_actor(a) for a in node["assignees"]["nodes"]]
+    closed_events = node["timelineItems"]["nodes"]
+    milestone = node["milestone"]
+
+    ret = IssueCreate(
+        platform=Platforms.github,
+        external_id=node["databaseId"],
+        organization_id=organization_id,
+        repository_id=repository_id,
+        number=node["number"],
+        title=node["title"],
+        body=node["body"] or "",
+        comments=node["comments"]["totalCount"],
+        author=_actor(node["author"]),
+        author_association=node["authorAssociation"],
+        labels=[
+            {
+                "node_id": label["id"],
+                "name": label["name"],
+                "color": label["color"],
+                "description": label["description"],
+                "default": label["isDefault"],
+                "url": label["url"],
+            }
+            for label in node["labels"]["nodes"]
+        ],
+        assignee=assignees[0] if assignees else None,
+        assignees=assignees,
+        milestone={
+            "number": milestone["number"],
+            "title": milestone["title"],
+            "description": milestone["description"],
+            "state": _lower(milestone["state"]),
+            "due_on": milestone["dueOn"],
+            "html_url": milestone["url"],
+        }
+        if milestone
+        else None,
+        closed_by=_actor(closed_events[0]["actor"]) if closed_events else None,
+        reactions=reactions,
+        state=Issue.State(node["state"].lower()),
+        state_reason=_lower(node["stateReason"]),
+        issue_closed_at=node["closedAt"],
+        issue_created_at=node["createdAt"],
+        issue_modified_at=node["updatedAt"],
+    )
+    ret.set_derived_fields()
+    return ret
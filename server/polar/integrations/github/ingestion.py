@@ -0,0 +1,179 @@
+import hashlib
+import hmac
+import json
+import time
+
+import structlog
+from fastapi import Request
+
+from polar.config import settings
+from polar.worker import enqueue_many, get_pool
+
+log = structlog.get_logger()
+
+
+async def read_verified_body(request: Request, secret: str) -> bytes | None:
+    """
+    Read the request body chunk by chunk while computing its HMAC, so that
+    verification costs no extra pass over the payload.
+
+    Returns the raw body if the X-Hub-Signature-256 header matches, None otherwise.
+    """
+    signature = request.headers.get("X-Hub-Signature-256")
+    if not signature or not signature.startswith("sha256="):
+        return None
+
+    mac = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+    body = bytearray()
+    async for chunk in request.stream():
+        mac.update(chunk)
+        body.extend(chunk)
+
+    if not hmac.compare_digest(f"sha256={mac.hexdigest()}", signature):
+        return None
+
+    return bytes(body)
+
+
+class QueueDepth:
+    """
+    Sampled depth of the arq queue.
+
+    Looking up the depth on every delivery would add a Redis round trip to the hot
+    path, so it's refreshed at most once per interval.
+    """
+
+    def __init__(self, interval: float = 1.0) -> None:
+        self.interval = interval
+        self.depth = 0
+        self._sampled_at = 0.0
+
+    async def get(self) -> int:
+        now = time.monotonic()
+        if now - self._sampled_at < self.interval:
+            return self.depth
+
+        self._sampled_at = now
+        redis = await get_pool()
+        self.depth = await redis.zcard(redis.default_queue_name)
+        return self.depth
+
+    async def is_overloaded(self) -> bool:
+        return await self.get() >= settings.GITHUB_WEBHOOK_MAX_QUEUE_DEPTH
+
+
+class WebhookOverflow:
+    """
+    Deliveries received while the queue is overloaded, in a Redis list.
+
+    GitHub doesn't redeliver failed webhooks, so deliveries are buffered rather
+    than rejected, and moved to the queue by the worker as it drains. Deliveries
+    keep being buffered until the buffer is empty, so that they're dispatched in
+    the order they were received.
+    """
+
+    key = "github:webhook:overflow"
+
+    async def push(
+        self,
+        scope: str,
+        delivery_id: str | None,
+        payload: bytes,
+        *,
+        if_not_empty: bool = False,
+    ) -> bool:
+        """
+        Buffer a delivery, returns whether it was. With if_not_empty, it's only
+        buffered behind deliveries that still are.
+        """
+        redis = await get_pool()
+        value = json.dumps(
+            {
+                "scope": scope,
+                "delivery_id": delivery_id,
+                "payload": payload.decode(),
+            }
+        )
+        if if_not_empty:
+            # Atomic, the buffer can't be drained between the check and the push
+            return await redis.rpushx(self.key, value) > 0
+        await redis.rpush(self.key, value)
+        return True
+
+    async def drain(self, limit: int) -> int:
+        """
+        Enqueue up to limit buffered deliveries, oldest first, returns how many.
+
+        Deliveries are only removed from the buffer once enqueued, so that they're
+        enqueued again rather than lost if this is interrupted.
+        """
+        if limit <= 0:
+            return 0
+
+        redis = await get_pool()
+        items = await redis.lrange(self.key, 0, limit - 1)
+        if not items:
+            return 0
+
+        deliveries = [json.loads(item) for item in items]
+        await enqueue_many(
+            "github.webhook.dispatch",
+            [(d["scope"], d["delivery_id"], d["payload"].encode()) for d in deliveries],
+        )
+        await redis.ltrim(self.key, len(items), -1)
+        return len(items)
+
+    async def size(self) -> int:
+        redis = await get_pool()
+        return await redis.llen(self.key)
+
+
+class IngestionStats:
+    """
+    In-process delivery counters, flushed to the log once per interval.
+    """
+
+    def __init__(self, interval: float = 60.0) -> None:
+        self.interval = interval
+        self._reset(time.monotonic())
+
+    def _reset(self, now: float) -> None:
+        self._started_at = now
+        self.deliveries = 0
+        self.buffered = 0
+        self.enqueue_latency_total = 0.0
+        self.enqueue_latency_max = 0.0
+
+    def record_enqueue(self, latency: float) -> None:
+        self.deliveries += 1
+        self.enqueue_latency_total += latency
+        self.enqueue_latency_max = max(self.enqueue_latency_max, latency)
+        self._maybe_flush()
+
+    def record_buffered(self) -> None:
+        self.buffered += 1
+        self._maybe_flush()
+
+    def _maybe_flush(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._started_at
+        if elapsed < self.interval:
+            return
+
+        log.info(
+            "github.webhook.ingestion.stats",
+            deliveries=self.deliveries,
+            deliveries_per_second=round(self.deliveries / elapsed, 2),
+            buffered=self.buffered,
+            enqueue_latency_avg_ms=round(
+                self.enqueue_latency_total / max(self.deliveries, 1) * 1000, 2
+            ),
+            enqueue_latency_max_ms=round(self.enqueue_latency_max * 1000, 2),
+            queue_depth=queue_depth.depth,
+        )
+        self._reset(now)
+
+
+queue_depth = QueueDepth()
+webhook_overflow = WebhookOverflow()
+ingestion_stats = IngestionStats()
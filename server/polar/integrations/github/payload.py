@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+from datetime import datetime
+from functools import cached_property
+from typing import Any, TypeVar, cast
+
+import structlog
+from githubkit.webhooks.models import Label as WebhookLabel
+from githubkit.webhooks.models import User as WebhookUser
+from pydantic import BaseModel, ValidationError, parse_obj_as
+
+log = structlog.get_logger()
+
+EventT = TypeVar("EventT", bound=BaseModel)
+
+
+class WebhookPayload:
+    """
+    A webhook delivery, decoded once and validated lazily.
+
+    Validating a full event model dominates handler CPU on large payloads, yet many
+    handlers only touch a couple of fields. Those are exposed as lazily validated
+    properties, and handlers that do need the whole event get it through event(),
+    validated against the model they expect and cached for the delivery.
+    """
+
+    def __init__(self, scope: str, data: dict[str, Any]) -> None:
+        self.scope = scope
+        self.data = data
+        self._events: dict[type[BaseModel], BaseModel] = {}
+
+    @classmethod
+    def of(cls, scope: str, payload: dict[str, Any] | WebhookPayload) -> WebhookPayload:
+        if isinstance(payload, WebhookPayload):
+            return payload
+        return cls(scope, payload)
+
+    @property
+    def action(self) -> str | None:
+        return self.data.get("action")
+
+    def event(self, model: type[EventT]) -> EventT:
+        cached = self._events.get(model)
+        if cached is None:
+            try:
+                cached = model.parse_obj(self.data)
+            except ValidationError as e:
+                log.error(
+                    "github.webhook.unexpected_type",
+                    scope=self.scope,
+                    action=self.action,
+                    expected=model.__name__,
+                )
+                raise Exception("unexpected webhook payload") from e
+            self._events[model] = cached
+        return cast(EventT, cached)
+
+    @cached_property
+    def issue_id(self) -> int:
+        return int(self.data["issue"]["id"])
+
+    @cached_property
+    def issue_labels(self) -> list[WebhookLabel]:
+        return parse_obj_as(list[WebhookLabel], self.data["issue"].get("labels") or [])
+
+    @cached_property
+    def issue_assignee(self) -> WebhookUser | None:
+        assignee = self.data["issue"].get("assignee")
+        return WebhookUser.parse_obj(assignee) if assignee else None
+
+    @cached_property
+    def issue_assignees(self) -> list[WebhookUser]:
+        return parse_obj_as(list[WebhookUser], self.data["issue"]["assignees"])
+
+    @cached_property
+    def issue_updated_at(self) -> datetime:
+        return parse_obj_as(datetime, self.data["issue"]["updated_at"])
+
+    @cached_property
+    def label_name(self) -> str | None:
+        label = self.data.get("label")
+        return label.get("name") if label else None
+
+    @cached_property
+    def repository_id(self) -> int:
+        return int(self.data["repository"]["id"])
+
+    @cached_property
+    def owner_id(self) -> int:
+        return int(self.data["repository"]["owner"]["id"])
@@ -0,0 +1,172 @@
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Any, AsyncGenerator, TypeVar
+
+import httpx
+import structlog
+from contextlib import asynccontextmanager
+from githubkit import GitHub
+from githubkit.auth import BaseAuthStrategy
+
+from polar.config import settings
+
+log = structlog.get_logger()
+
+A = TypeVar("A", bound=BaseAuthStrategy)
+GitHubT = TypeVar("GitHubT", bound="PooledGitHub[Any]")
+
+
+class ConnectionStats:
+    """
+    Requests sent and connections opened through the pool, flushed to the log once
+    per interval. Requests that didn't open a connection reused a kept-alive one.
+    """
+
+    def __init__(self, interval: float = 60.0) -> None:
+        self.interval = interval
+        self._reset(time.monotonic())
+
+    def _reset(self, now: float) -> None:
+        self._started_at = now
+        self.requests = 0
+        self.connections = 0
+
+    async def trace(self, event_name: str, info: dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            self.connections += 1
+
+    def record_request(self) -> None:
+        self.requests += 1
+        self._maybe_flush()
+
+    def _maybe_flush(self) -> None:
+        now = time.monotonic()
+        if now - self._started_at < self.interval:
+            return
+
+        log.info(
+            "github.http.stats",
+            requests=self.requests,
+            connections=self.connections,
+            reuse_rate=round(1 - self.connections / max(self.requests, 1), 3),
+        )
+        self._reset(now)
+
+
+class ClientPool:
+    """
+    Long lived GitHub clients, keyed by what they authenticate as, sharing a single
+    keep-alive connection pool.
+
+    githubkit opens, and closes, an HTTP client per request unless used as a context
+    manager, so that every sync job paid for a TLS handshake. Clients from the pool
+    send all their requests through one transport, whose connections are kept
+    alive across clients and jobs. Clients idle for longer than idle_timeout are
+    dropped from the registry.
+    """
+
+    def __init__(
+        self,
+        max_clients: int = 1000,
+        idle_timeout: float = 300.0,
+    ) -> None:
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.stats = ConnectionStats()
+        self._clients: OrderedDict[
+            Hashable, tuple["PooledGitHub[Any]", float]
+        ] = OrderedDict()
+        self._transport: httpx.AsyncHTTPTransport | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._swept_at = time.monotonic()
+
+    def get(self, key: Hashable, factory: Callable[[], GitHubT]) -> GitHubT:
+        now = time.monotonic()
+        self._sweep(now)
+
+        cached = self._clients.get(key)
+        if cached is not None:
+            client = cached[0]
+        else:
+            client = factory()
+            while len(self._clients) >= self.max_clients:
+                self._clients.popitem(last=False)
+
+        self._clients[key] = (client, now)
+        self._clients.move_to_end(key)
+        return client  # type: ignore
+
+    @property
+    def transport(self) -> httpx.AsyncHTTPTransport:
+        # Connections belong to the event loop they were opened in
+        loop = asyncio.get_running_loop()
+        if self._transport is None or self._loop is not loop:
+            self._transport = self._create_transport()
+            self._loop = loop
+        return self._transport
+
+    def _create_transport(self) -> httpx.AsyncHTTPTransport:
+        http2 = settings.GITHUB_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                log.warning("github.http.http2_unavailable")
+                http2 = False
+
+        return httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.GITHUB_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.GITHUB_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=settings.GITHUB_HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+
+    def _sweep(self, now: float) -> None:
+        if now - self._swept_at < self.idle_timeout / 10:
+            return
+        self._swept_at = now
+        for key, (_, used_at) in list(self._clients.items()):
+            if now - used_at > self.idle_timeout:
+                del self._clients[key]
+
+    async def close(self) -> None:
+        self._clients.clear()
+        if self._transport is not None:
+            await self._transport.aclose()
+            self._transport = None
+
+
+pool = ClientPool()
+
+
+class PooledGitHub(GitHub[A]):
+    """
+    GitHub client sending its requests through the shared connection pool.
+    """
+
+    _pooled_client: httpx.AsyncClient | None = None
+    _pooled_transport: httpx.AsyncHTTPTransport | None = None
+
+    def _create_async_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            **self._get_client_defaults(),
+            transport=pool.transport,
+            event_hooks={"request": [self._trace_request]},
+        )
+
+    async def _trace_request(self, request: httpx.Request) -> None:
+        pool.stats.record_request()
+        request.extensions["trace"] = pool.stats.trace
+
+    @asynccontextmanager
+    async def get_async_client(self) -> AsyncGenerator[httpx.AsyncClient, None]:
+        # Never closed, closing it would close the shared transport
+        transport = pool.transport
+        if self._pooled_client is None or self._pooled_transport is not transport:
+            self._pooled_client = self._create_async_client()
+            self._pooled_transport = transport
+        yield self._pooled_client
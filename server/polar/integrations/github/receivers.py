@@ -1,11 +1,14 @@
 import structlog
 from polar.issue.hooks import IssueHook, issue_upserted
 from polar.organization.service import organization as organization_service
+from polar.pledge.hooks import PledgeHook, pledge_created, pledge_updated
 from polar.repository.service import repository as repository_service
 from polar.worker import enqueue_job
 
 
 from .badge import GithubBadge
+from .badge_cache import badge_amount_cache
+from .service.issue import github_issue
 
 log = structlog.get_logger()
 
@@ -42,3 +45,19 @@ async def schedule_fetch_references_and_dependencies(
 
 issue_upserted.add(schedule_fetch_references_and_dependencies)
 issue_upserted.add(schedule_embed_badge_task)
+
+
+async def update_badge_amount(hook: PledgeHook) -> None:
+    # Registered after polar.receivers.pledges, which sums the pledges first
+    badge = await github_issue.get_badge_key_and_amount(
+        hook.session, hook.pledge.issue_id
+    )
+    if badge is None:
+        return
+
+    key, amount = badge
+    await badge_amount_cache.set(key, amount)
+
+
+pledge_created.add(update_badge_amount)
+pledge_updated.add(update_badge_amount)
@@ -0,0 +1,281 @@
+import time
+from collections import defaultdict
+from collections.abc import Mapping
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Sequence, TypeVar
+from uuid import UUID
+
+import structlog
+
+from polar.models import Issue
+from polar.redis import redis
+from polar.worker import enqueue_many
+
+from .schemas import CrawlBudget
+
+log = structlog.get_logger()
+
+T = TypeVar("T")
+
+
+# Atomically take up to ARGV[2] requests from an installation's bucket, leaving
+# ARGV[3] requests untouched for webhooks and user facing calls. A bucket we haven't
+# seen headers for yet, or whose window has reset, grants everything: the next
+# response will tell us where we stand.
+TAKE_SCRIPT = """
+local remaining = tonumber(redis.call('HGET', KEYS[1], 'remaining'))
+local reset = tonumber(redis.call('HGET', KEYS[1], 'reset'))
+local now = tonumber(ARGV[1])
+local wanted = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+if remaining == nil or reset == nil or now >= reset then
+    return wanted
+end
+local granted = math.min(wanted, math.max(remaining - reserve, 0))
+if granted > 0 then
+    redis.call('HINCRBY', KEYS[1], 'remaining', -granted)
+end
+return granted
+"""
+
+# Only overwrite the bucket with headers that are at least as recent as what it
+# holds, so that a slow response doesn't hand back budget we already spent.
+RECORD_SCRIPT = """
+local reset = tonumber(redis.call('HGET', KEYS[1], 'reset'))
+local remaining = tonumber(redis.call('HGET', KEYS[1], 'remaining'))
+local new_remaining = tonumber(ARGV[2])
+local new_reset = tonumber(ARGV[3])
+if reset ~= nil and reset > new_reset then
+    return 0
+end
+if reset == new_reset and remaining ~= nil and remaining < new_remaining then
+    new_remaining = remaining
+end
+redis.call('HSET', KEYS[1], 'limit', ARGV[1], 'remaining', new_remaining,
+    'reset', new_reset)
+redis.call('EXPIREAT', KEYS[1], new_reset + 60)
+return 1
+"""
+
+
+class BudgetExhausted(Exception):
+    """
+    The crawl budget of an installation is exhausted, until the rate limit window
+    resets in defer seconds.
+    """
+
+    def __init__(self, installation_id: int, defer: int) -> None:
+        super().__init__(
+            f"crawl budget of installation {installation_id} exhausted, "
+            f"resets in {defer}s"
+        )
+        self.installation_id = installation_id
+        self.defer = defer
+
+
+def issue_crawl_value(issue: Issue, now: float | None = None) -> float:
+    """
+    How much refreshing an issue is worth. Pledged issues come first, then issues
+    with engagement, then the most recently modified.
+    """
+    now = now or time.time()
+    value = 1.0
+    if issue.pledged_amount_sum:
+        value += 10_000 + issue.pledged_amount_sum / 100
+    value += issue.total_engagement_count or 0
+    if issue.issue_modified_at:
+        age_days = max(now - issue.issue_modified_at.timestamp(), 0) / 86400
+        value += 100 / (1 + age_days)
+    return value
+
+
+class CrawlScheduler:
+    """
+    Per installation GitHub rate limit budget and queue of pending crawl work.
+
+    The budget is a token bucket kept in Redis, refilled from the X-RateLimit-*
+    headers of every installation client response. Crawl work waits in a sorted set
+    scored by value, and drain() enqueues the most valuable work the budget allows.
+    """
+
+    queue_ttl = timedelta(days=1)
+
+    def __init__(self, reserve: int = 1000) -> None:
+        self.reserve = reserve
+        self._take = redis.register_script(TAKE_SCRIPT)
+        self._record = redis.register_script(RECORD_SCRIPT)
+        self._batch_sizes: dict[str, int] = {}
+
+    def budget_key(self, installation_id: int) -> str:
+        return f"github:crawl:budget:{installation_id}"
+
+    def queue_key(self, installation_id: int) -> str:
+        return f"github:crawl:queue:{installation_id}"
+
+    async def record(self, installation_id: int, headers: Mapping[str, str]) -> None:
+        # GraphQL, search and others have budgets of their own, the bucket is the
+        # REST one crawling spends.
+        if headers.get("X-RateLimit-Resource", "core") != "core":
+            return
+
+        try:
+            limit = int(headers["X-RateLimit-Limit"])
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset = int(headers["X-RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return
+
+        await self._record(
+            keys=[self.budget_key(installation_id)],
+            args=[limit, remaining, reset],
+        )
+
+    async def take(self, installation_id: int, cost: int = 1) -> int:
+        """
+        Take up to cost requests from the budget, returns how many were granted.
+        """
+        granted = await self._take(
+            keys=[self.budget_key(installation_id)],
+            args=[int(time.time()), cost, self.reserve],
+        )
+        return int(granted)
+
+    async def require(self, installation_id: int, cost: int = 1) -> None:
+        """
+        Take cost requests from the budget, or raise BudgetExhausted.
+        """
+        if await self.take(installation_id, cost) >= cost:
+            return
+
+        reset = await redis.hget(self.budget_key(installation_id), "reset")
+        defer = max(int(reset or 0) - int(time.time()), 0) + 1
+        log.info(
+            "github.crawl.budget_exhausted",
+            installation_id=installation_id,
+            defer=defer,
+        )
+        raise BudgetExhausted(installation_id, defer)
+
+    async def paginate(
+        self, installation_id: int, items: AsyncIterator[T], per_page: int
+    ) -> AsyncIterator[T]:
+        """
+        Iterate over a githubkit paginator, requiring budget before every page.
+        """
+        await self.require(installation_id)
+        count = 0
+        async for item in items:
+            yield item
+            count += 1
+            if count % per_page == 0:
+                await self.require(installation_id)
+
+    async def schedule(
+        self,
+        installation_id: int,
+        task: str,
+        work: Mapping[UUID, float],
+    ) -> None:
+        """
+        Queue crawl work, a task to run per id scored by its value. Work already
+        queued is kept once, with its latest value.
+        """
+        if not work:
+            return
+
+        queue_key = self.queue_key(installation_id)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(queue_key, {f"{task}:{id}": value for id, value in work.items()})
+            # Don't keep work around for installations that are gone
+            pipe.expire(queue_key, self.queue_ttl)
+            await pipe.execute()
+
+    def batch(self, task: str, size: int) -> None:
+        """
+        Have drain() enqueue task with the ids of up to size queued works at a time,
+        for tasks fetching many items in a single request.
+        """
+        self._batch_sizes[task] = size
+
+    async def drain(self, installation_id: int, limit: int = 100) -> int:
+        """
+        Enqueue the most valuable queued work that fits in the budget, returns the
+        number of jobs enqueued. A job of a batched task costs a single request.
+        """
+        queue_key = self.queue_key(installation_id)
+        peek = limit * max(self._batch_sizes.values(), default=1)
+        members: Sequence[str] = await redis.zrevrange(queue_key, 0, peek - 1)
+        if not members:
+            return 0
+
+        # Group the work into jobs, ordered by their most valuable work
+        jobs: list[tuple[str, list[str]]] = []
+        open_batches: dict[str, list[str]] = {}
+        for member in members:
+            task, _ = member.rsplit(":", 1)
+            size = self._batch_sizes.get(task)
+            if size is None:
+                jobs.append((task, [member]))
+                continue
+
+            batch = open_batches.get(task)
+            if batch is None or len(batch) >= size:
+                batch = open_batches[task] = []
+                jobs.append((task, batch))
+            batch.append(member)
+        jobs = jobs[:limit]
+
+        granted = await self.take(installation_id, len(jobs))
+        if not granted:
+            return 0
+        jobs = jobs[:granted]
+
+        # Only enqueue work we removed, another drain may have raced us to it
+        async with redis.pipeline(transaction=False) as pipe:
+            for _, job_members in jobs:
+                for member in job_members:
+                    pipe.zrem(queue_key, member)
+            removed = iter(await pipe.execute())
+
+        by_task: dict[str, list[tuple[Any]]] = defaultdict(list)
+        enqueued = 0
+        for task, job_members in jobs:
+            ids = [
+                UUID(member.rsplit(":", 1)[1])
+                for member in job_members
+                if next(removed)
+            ]
+            if not ids:
+                continue
+            by_task[task].append((ids,) if task in self._batch_sizes else (ids[0],))
+            enqueued += 1
+
+        for task, args_list in by_task.items():
+            await enqueue_many(task, args_list)
+
+        log.info(
+            "github.crawl.drained",
+            installation_id=installation_id,
+            enqueued=enqueued,
+            wanted=len(jobs),
+        )
+        return enqueued
+
+    async def stats(self, installation_id: int) -> CrawlBudget:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zcard(self.queue_key(installation_id))
+            pipe.hgetall(self.budget_key(installation_id))
+            queue_depth, budget = await pipe.execute()
+
+        reset = budget.get("reset")
+        return CrawlBudget(
+            installation_id=installation_id,
+            queue_depth=queue_depth,
+            limit=budget.get("limit"),
+            remaining=budget.get("remaining"),
+            reserve=self.reserve,
+            reset=datetime.fromtimestamp(int(reset), timezone.utc) if reset else None,
+        )
+
+
+crawl_scheduler = CrawlScheduler()
@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import Literal
 from polar.kit.schemas import Schema
 
@@ -36,3 +37,21 @@ class GitHubIssue(Schema):
             return f"{self.owner.lower()}/{self.repo.lower()}#{self.number}"
         else:
             return f"#{self.number}"
+
+
+class CrawlBudget(Schema):
+    installation_id: int
+    queue_depth: int
+    limit: int | None = None
+    remaining: int | None = None
+    reserve: int
+    reset: datetime | None = None
+
+
+class BackfillProgress(Schema):
+    installation_id: int
+    status: Literal["pending", "in_progress", "done"] | None = None
+    queued: int
+    running: int
+    concurrency: int
+    started_at: datetime | None = None
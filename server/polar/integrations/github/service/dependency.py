@@ -1,8 +1,9 @@
 from __future__ import annotations
 
+from typing import Sequence
+
 import structlog
 import re
-from polar.exceptions import IntegrityError, ResourceNotFound
 from githubkit.exception import RequestFailed
 from polar.integrations.github.client import (
     get_app_installation_client,
@@ -10,14 +11,16 @@ from polar.integrations.github.client import (
     AppInstallationAuthStrategy,
 )
 from polar.integrations.github import service
+from polar.integrations.github.service.issue import github_issue
 from polar.integrations.github.service.organization import github_organization
-from polar.issue.schemas import IssueCreate
+from polar.issue.dependency_graph import issue_dependency_graph
+from polar.issue.schemas import IssueCreate, IssueDependencyCreate
 from polar.models.issue_dependency import IssueDependency
 from polar.organization.schemas import OrganizationCreate
 from polar.enums import Platforms
 
 from polar.models import Organization, Repository, Issue
-from polar.postgres import AsyncSession, sql
+from polar.postgres import AsyncSession
 from polar.repository.schemas import RepositoryCreate
 
 from .url import github_url
@@ -52,6 +55,8 @@ class GitHubIssueDependenciesService:
             issue=issue.number,
         )
 
+        # Issues of other organizations, by (org name, repo name)
+        references: dict[tuple[str, str], list[int]] = {}
         for dependency in github_url.parse_urls(issue.body):
             if (
                 dependency.owner is None
@@ -61,62 +66,68 @@ class GitHubIssueDependenciesService:
                 # this is a reference to an issue in the same org, we don't need to
                 # sync it
                 continue
+            references.setdefault((dependency.owner, dependency.repo), []).append(
+                dependency.number
+            )
 
-            try:
-                (
-                    _,
-                    _,
-                    dependency_issue,
-                ) = await github_organization.sync_external_org_with_repo_and_issue(
-                    session,
-                    client=client,
-                    org_name=dependency.owner,
-                    repo_name=dependency.repo,
-                    issue_number=dependency.number,
-                )
-            except ResourceNotFound as e:
-                continue
+        # Each repository is looked up once, however many of its issues are
+        # referenced, and all missing issues are fetched together
+        repositories = await github_organization.sync_external_orgs_with_repos(
+            session, client=client, names=references.keys()
+        )
+        dependency_issues = await github_issue.sync_external_issues(
+            session,
+            client,
+            [
+                (dependency_org, dependency_repo, references[name])
+                for name, (dependency_org, dependency_repo) in repositories.items()
+            ],
+        )
 
-            issue_dependency = IssueDependency(
+        dependencies = [
+            IssueDependencyCreate(
                 organization_id=org.id,
                 repository_id=repo.id,
                 dependent_issue_id=issue.id,
                 dependency_issue_id=dependency_issue.id,
             )
-            await self.create_dependency(session, issue_dependency)
+            for dependency_issue in dependency_issues
+        ]
+        await self.upsert_dependencies(session, dependencies)
+
+    async def upsert_dependencies(
+        self, session: AsyncSession, dependencies: list[IssueDependencyCreate]
+    ) -> Sequence[IssueDependency]:
+        # A statement can't update the same row twice
+        unique = {
+            (d.dependent_issue_id, d.dependency_issue_id): d for d in dependencies
+        }
+        if not unique:
+            return []
+
+        records = await IssueDependency.upsert_many(
+            session,
+            list(unique.values()),
+            constraints=[
+                IssueDependency.dependent_issue_id,
+                IssueDependency.dependency_issue_id,
+            ],
+            # There's nothing to update, but ON CONFLICT DO UPDATE needs a column
+            mutable_keys={"organization_id", "repository_id"},
+            # Committed along with the closure
+            autocommit=False,
+        )
 
-    async def create_dependency(
-        self, session: AsyncSession, ref: IssueDependency
-    ) -> None:
-        nested = await session.begin_nested()
-        try:
-            session.add(ref)
-            await nested.commit()
-            await session.commit()
-            log.info(
-                "issue.create_dependency.created",
-                ref=ref,
-            )
-            return
-        except IntegrityError:
-            log.info(
-                "issue.create_dependency.already_exists",
-                ref=ref,
-            )
-            await nested.rollback()
-
-        # Update (there are no columns to update, though)
-        stmt = (
-            sql.Update(IssueDependency)
-            .where(
-                IssueDependency.dependent_issue_id == ref.dependent_issue_id,
-                IssueDependency.dependency_issue_id == ref.dependency_issue_id,
-            )
-            .values()
+        log.info(
+            "issue.upsert_dependencies",
+            created=sum(1 for r in records if r.was_created),
+            updated=sum(1 for r in records if r.was_updated),
         )
 
-        await session.execute(stmt)
-        await session.commit()
+        await issue_dependency_graph.add_dependencies(
+            session, [r for r in records if r.was_created]
+        )
+        return records
 
 
 github_dependency = GitHubIssueDependenciesService()
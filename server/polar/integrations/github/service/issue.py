@@ -6,15 +6,23 @@ from uuid import UUID
 
 import structlog
 from githubkit import GitHub, Response
-from githubkit.exception import RequestFailed
+from githubkit.exception import GraphQLFailed, RequestFailed
+from githubkit.graphql import GraphQLResponse, build_graphql_request
 from githubkit.rest.models import Issue as GitHubIssue
 from githubkit.rest.models import Label
 from githubkit.webhooks.models import Label as WebhookLabel
 from sqlalchemy import asc, or_
+from sqlalchemy.orm import InstrumentedAttribute, contains_eager
 
 from polar.dashboard.schemas import IssueListType, IssueSortBy
 from polar.enums import Platforms
 from polar.integrations.github import client as github
+from polar.integrations.github.graphql import (
+    MAX_ISSUES_PER_QUERY,
+    build_issues_query,
+    failed_issues,
+    issue_from_graphql,
+)
 from polar.integrations.github.service.api import github_api
 from polar.issue.hooks import IssueHook, issue_upserted
 from polar.issue.schemas import IssueCreate
@@ -26,6 +34,7 @@ from polar.models.user import User
 from polar.postgres import AsyncSession
 
 from ..badge import GithubBadge
+from ..badge_cache import BadgeKey
 
 log = structlog.get_logger()
 
@@ -231,17 +240,19 @@ class GithubIssueService(IssueService):
         issue: Issue,
         crawl_with_installation_id: int
         | None = None,  # Override which installation to use when crawling
+        client: GitHub[Any] | None = None,  # Crawl with this client instead
     ) -> None:
-        installation_id = (
-            crawl_with_installation_id
-            if crawl_with_installation_id
-            else org.installation_id
-        )
+        if client is None:
+            installation_id = (
+                crawl_with_installation_id
+                if crawl_with_installation_id
+                else org.installation_id
+            )
 
-        if not installation_id:
-            raise Exception("no github installation id found")
+            if not installation_id:
+                raise Exception("no github installation id found")
 
-        client = github.get_app_installation_client(installation_id)
+            client = github.get_app_installation_client(installation_id)
 
         log.info("github.sync_issue", issue_id=issue.id)
 
@@ -284,62 +295,302 @@ class GithubIssueService(IssueService):
             issue.github_issue_etag = res.headers.get("etag", None)
             await issue.save(session)
 
-    async def list_issues_to_crawl_issue(
-        self,
-        session: AsyncSession,
-        organization: Organization,
-    ) -> Sequence[Issue]:
-        current_time = datetime.datetime.utcnow()
-        one_hour_ago = current_time - datetime.timedelta(hours=1)
+    async def get_badge_amount(
+        self, session: AsyncSession, *, org_name: str, repo_name: str, number: int
+    ) -> int | None:
+        """
+        The pledged amount shown on the badge of an issue, as summed by the pledge
+        hooks, in a single query.
+        """
+        stmt = (
+            sql.select(Issue.pledged_amount_sum)
+            .join(Issue.organization)
+            .join(Issue.repository)
+            .where(
+                Organization.platform == Platforms.github,
+                Organization.name == org_name,
+                Repository.name == repo_name,
+                Repository.deleted_at.is_(None),
+                Issue.number == number,
+            )
+        )
+        res = await session.execute(stmt)
+        return res.scalar_one_or_none()
+
+    async def get_badge_key_and_amount(
+        self, session: AsyncSession, issue_id: UUID
+    ) -> tuple[BadgeKey, int] | None:
+        # Columns rather than the issue, so that the amount isn't one an issue
+        # already in the session holds
+        stmt = (
+            sql.select(
+                Organization.name,
+                Repository.name,
+                Issue.number,
+                Issue.pledged_amount_sum,
+            )
+            .join(Issue.organization)
+            .join(Issue.repository)
+            .where(Issue.id == issue_id)
+        )
+        row = (await session.execute(stmt)).one_or_none()
+        if row is None:
+            return None
 
+        org_name, repo_name, number, amount = row
+        return ((org_name, repo_name, number), amount)
+
+    async def list_with_organization_and_repository(
+        self, session: AsyncSession, issue_ids: Sequence[UUID]
+    ) -> Sequence[Issue]:
         stmt = (
             sql.select(Issue)
             .join(Issue.organization)
             .join(Issue.repository)
             .where(
-                or_(
-                    Issue.github_issue_fetched_at.is_(None),
-                    Issue.github_issue_fetched_at < one_hour_ago,
-                ),
+                Issue.id.in_(issue_ids),
                 Issue.deleted_at.is_(None),
                 Organization.deleted_at.is_(None),
                 Repository.deleted_at.is_(None),
-                Organization.installation_id.is_not(None),
-                Organization.id == organization.id,
             )
-            .order_by(asc(Issue.github_issue_fetched_at))
-            .limit(100)
+            .options(
+                contains_eager(Issue.organization),
+                contains_eager(Issue.repository),
+            )
         )
-
         res = await session.execute(stmt)
-
         return res.scalars().unique().all()
 
+    async def sync_issues(
+        self,
+        session: AsyncSession,
+        issues: Sequence[Issue],
+        installation_id: int,
+    ) -> None:
+        """
+        Refresh issues of the installation's repositories, up to
+        MAX_ISSUES_PER_QUERY of them per GraphQL query.
+
+        Unlike sync_issue(), there's no ETag to revalidate with, but a query costs
+        as much as a single REST request. Issues must be loaded with their
+        organization and repository.
+        """
+        client = github.get_app_installation_client(installation_id)
+        for offset in range(0, len(issues), MAX_ISSUES_PER_QUERY):
+            await self._sync_issues_query(
+                session, client, issues[offset : offset + MAX_ISSUES_PER_QUERY]
+            )
+
+    async def _sync_issues_query(
+        self,
+        session: AsyncSession,
+        client: GitHub[Any],
+        issues: Sequence[Issue],
+    ) -> None:
+        by_key = {
+            (issue.organization.name, issue.repository.name, issue.number): issue
+            for issue in issues
+        }
+        nodes, failed = await self._query_issues(client, list(by_key.keys()))
+
+        fetched: list[Issue] = []
+        schemas: list[IssueCreate] = []
+        for key, issue in by_key.items():
+            if key in failed:
+                # Rate limited or timed out, retried on the next tick
+                continue
+            fetched.append(issue)
+
+            node = nodes.get(key)
+            if node is None:
+                # Not found, or not accessible anymore, don't retry it every tick
+                log.info("github.sync_issues.not_found", issue_id=issue.id)
+                continue
+
+            schema = issue_from_graphql(
+                node,
+                organization_id=issue.organization_id,
+                repository_id=issue.repository_id,
+            )
+            # Unchanged issues aren't upserted, nor go through the hooks again
+            if (
+                issue.issue_modified_at is not None
+                and schema.issue_modified_at == issue.issue_modified_at
+            ):
+                continue
+            schemas.append(schema)
+
+        log.info(
+            "github.sync_issues",
+            issues=len(issues),
+            failed=len(failed),
+            changed=len(schemas),
+        )
+
+        if schemas:
+            records = await self.upsert_many(
+                session, schemas, constraints=[Issue.external_id]
+            )
+            for record in records:
+                await issue_upserted.call(IssueHook(session, record))
+
+        if fetched:
+            stmt = (
+                sql.update(Issue)
+                .where(Issue.id.in_([issue.id for issue in fetched]))
+                .values(github_issue_fetched_at=datetime.datetime.utcnow())
+            )
+            await session.execute(stmt)
+        await session.commit()
+
+    async def sync_external_issues(
+        self,
+        session: AsyncSession,
+        client: GitHub[Any],
+        references: Sequence[tuple[Organization, Repository, Sequence[int]]],
+    ) -> list[Issue]:
+        """
+        The issues with the given numbers of other organizations' repositories,
+        creating those we don't have yet. Those are fetched up to
+        MAX_ISSUES_PER_QUERY per GraphQL query, and created in a single statement
+        per query. Issues that don't exist on GitHub are left out.
+        """
+        ret: list[Issue] = []
+        missing: dict[tuple[str, str, int], Repository] = {}
+        for organization, repository, numbers in references:
+            numbers = list(dict.fromkeys(numbers))
+            stored = await self.list_by_repository_and_numbers(
+                session, repository.id, numbers
+            )
+            ret.extend(stored)
+
+            found = {issue.number for issue in stored}
+            for number in numbers:
+                if number not in found:
+                    missing[(organization.name, repository.name, number)] = repository
+
+        keys = list(missing.keys())
+        for offset in range(0, len(keys), MAX_ISSUES_PER_QUERY):
+            query_keys = keys[offset : offset + MAX_ISSUES_PER_QUERY]
+            nodes, _ = await self._query_issues(client, query_keys)
+
+            schemas = [
+                issue_from_graphql(
+                    node,
+                    organization_id=missing[key].organization_id,
+                    repository_id=missing[key].id,
+                )
+                for key, node in nodes.items()
+            ]
+            log.info(
+                "github.sync_external_issues",
+                issues=len(query_keys),
+                found=len(schemas),
+            )
+            if schemas:
+                ret.extend(
+                    await self.upsert_many(
+                        session, schemas, constraints=[Issue.external_id]
+                    )
+                )
+
+        return ret
+
+    async def _query_issues(
+        self, client: GitHub[Any], keys: Sequence[tuple[str, str, int]]
+    ) -> tuple[dict[tuple[str, str, int], dict[str, Any]], set[tuple[str, str, int]]]:
+        """
+        Fetch (owner, repo, number) issues in a single GraphQL query, returns the
+        nodes of those that were found, and the keys of those that failed to resolve
+        for another reason than not existing.
+        """
+        query, variables, aliases = build_issues_query(keys)
+
+        res = await client.arequest(
+            "POST",
+            "/graphql",
+            json=build_graphql_request(query, variables),
+            response_model=GraphQLResponse,
+        )
+        data = res.parsed_data.data
+        if data is None:
+            raise GraphQLFailed(res.parsed_data)
+        failed: set[tuple[str, str, int]] = set()
+        if res.parsed_data.errors:
+            log.debug("github.query_issues.errors", errors=len(res.parsed_data.errors))
+            # The parsed errors leave out their type
+            failed = failed_issues(res.json().get("errors") or [], aliases)
+
+        nodes: dict[tuple[str, str, int], dict[str, Any]] = {}
+        for key in keys:
+            repository_alias, issue_alias = aliases[key]
+            node = (data.get(repository_alias) or {}).get(issue_alias)
+            if node is not None:
+                nodes[key] = node
+        return (nodes, failed)
+
+    async def list_issues_to_crawl_issue(
+        self,
+        session: AsyncSession,
+        per_organization: int = 100,
+    ) -> Sequence[Issue]:
+        """
+        Issues that are due for a refresh, at most per_organization of them for each
+        installed organization, in a single query.
+        """
+        return await self._list_issues_to_crawl(
+            session, Issue.github_issue_fetched_at, per_organization
+        )
+
     async def list_issues_to_crawl_timeline(
         self,
         session: AsyncSession,
-        organization: Organization,
+        per_organization: int = 100,
+    ) -> Sequence[Issue]:
+        """
+        Issues whose timeline is due for a refresh, at most per_organization of them
+        for each installed organization, in a single query.
+        """
+        return await self._list_issues_to_crawl(
+            session, Issue.github_timeline_fetched_at, per_organization
+        )
+
+    async def _list_issues_to_crawl(
+        self,
+        session: AsyncSession,
+        fetched_at: InstrumentedAttribute[datetime.datetime | None],
+        per_organization: int,
     ) -> Sequence[Issue]:
         current_time = datetime.datetime.utcnow()
         one_hour_ago = current_time - datetime.timedelta(hours=1)
 
-        stmt = (
-            sql.select(Issue)
+        ranked = (
+            sql.select(
+                Issue.id,
+                sql.func.row_number()
+                .over(partition_by=Issue.organization_id, order_by=asc(fetched_at))
+                .label("rank"),
+            )
             .join(Issue.organization)
             .join(Issue.repository)
             .where(
                 or_(
-                    Issue.github_timeline_fetched_at.is_(None),
-                    Issue.github_timeline_fetched_at < one_hour_ago,
+                    fetched_at.is_(None),
+                    fetched_at < one_hour_ago,
                 ),
                 Issue.deleted_at.is_(None),
                 Organization.deleted_at.is_(None),
                 Repository.deleted_at.is_(None),
                 Organization.installation_id.is_not(None),
-                Organization.id == organization.id,
             )
-            .order_by(asc(Issue.github_timeline_fetched_at))
-            .limit(100)
+            .subquery()
+        )
+
+        stmt = (
+            sql.select(Issue)
+            .join(ranked, ranked.c.id == Issue.id)
+            .where(ranked.c.rank <= per_organization)
+            .order_by(Issue.organization_id, ranked.c.rank)
         )
 
         res = await session.execute(stmt)
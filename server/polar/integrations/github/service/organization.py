@@ -1,10 +1,13 @@
-from datetime import datetime
+import asyncio
+from collections.abc import Iterable, Sequence
+from datetime import datetime, timedelta
 from typing import Any, Tuple, Union
 from uuid import UUID
 
 import structlog
 from githubkit import GitHub
 from githubkit.exception import RequestFailed
+from githubkit.rest import FullRepository
 
 from polar.enums import Platforms
 from polar.exceptions import ResourceNotFound
@@ -16,6 +19,7 @@ from polar.models.repository import Repository
 from polar.organization.schemas import OrganizationCreate
 from polar.organization.service import OrganizationService
 from polar.postgres import AsyncSession
+from polar.redis import redis
 from polar.repository.schemas import RepositoryCreate
 
 from .. import client as github
@@ -24,6 +28,11 @@ from .repository import github_repository
 
 log = structlog.get_logger(service="GithubOrganizationService")
 
+# Most repositories of other organizations fetched from GitHub at once
+EXTERNAL_FETCH_CONCURRENCY = 10
+# How long repositories GitHub didn't find aren't fetched again
+EXTERNAL_NOT_FOUND_TTL = timedelta(hours=1)
+
 
 class GithubOrganizationService(OrganizationService):
     async def get_by_external_id(
@@ -187,6 +196,34 @@ class GithubOrganizationService(OrganizationService):
 
         return org
 
+    async def get_external_org_with_repo_and_issue(
+        self,
+        session: AsyncSession,
+        *,
+        org_name: str,
+        repo_name: str,
+        issue_number: int,
+    ) -> Tuple[Organization, Repository, Issue] | None:
+        """
+        The stored organization, repository and issue, without calling GitHub.
+        """
+        stored = await self._get_external_org_with_repo(session, org_name, repo_name)
+        if not stored:
+            return None
+
+        organization, repository = stored
+        issue = await github_issue.get_by_number(
+            session,
+            platform=Platforms.github,
+            organization_id=organization.id,
+            repository_id=repository.id,
+            number=issue_number,
+        )
+        if not issue:
+            return None
+
+        return (organization, repository, issue)
+
     async def sync_external_org_with_repo_and_issue(
         self,
         session: AsyncSession,
@@ -203,30 +240,149 @@ class GithubOrganizationService(OrganizationService):
             issue_number=issue_number,
         )
 
-        organization = await self.get_by_name(session, Platforms.github, org_name)
+        synced = await self.sync_external_orgs_with_repos(
+            session, client=client, names=[(org_name, repo_name)]
+        )
+        if (org_name, repo_name) not in synced:
+            raise ResourceNotFound()
+        organization, repository = synced[(org_name, repo_name)]
 
-        if not organization:
-            log.info("organization not found by name", org_name=org_name)
+        issue = await github_issue.get_by_number(
+            session,
+            platform=Platforms.github,
+            organization_id=organization.id,
+            repository_id=repository.id,
+            number=issue_number,
+        )
+
+        if not issue:
+            log.info(
+                "issue not found, creating it",
+                organization_id=organization.id,
+                repository_id=repository.id,
+                number=issue_number,
+            )
 
             try:
-                repo_response = await client.rest.repos.async_get(org_name, repo_name)
-                github_repo = repo_response.parsed_data
-                owner = github_repo.owner
-                is_personal = owner.type.lower() == "user"
+                issue_response = await client.rest.issues.async_get(
+                    organization.name, repository.name, issue_number
+                )
             except RequestFailed as e:
                 if e.response.status_code == 404:
                     raise ResourceNotFound()
                 # re-raise other status codes
                 raise e
 
-            # check if we have org with same external_id
-            organization = await self.get_by_external_id(session, owner.id)
+            github_issue_data = issue_response.parsed_data
+            issue_schema = IssueCreate.from_github(
+                github_issue_data,
+                organization_id=organization.id,
+                repository_id=repository.id,
+            )
+            issue = await github_issue.create(session, issue_schema)
+
+        return (organization, repository, issue)
+
+    async def sync_external_orgs_with_repos(
+        self,
+        session: AsyncSession,
+        *,
+        client: GitHub[Any],
+        names: Iterable[Tuple[str, str]],
+    ) -> dict[Tuple[str, str], Tuple[Organization, Repository]]:
+        """
+        The organizations and repositories of (org name, repo name) pairs, creating
+        those we don't have yet. Pairs we don't have are fetched from GitHub
+        concurrently, pairs that don't exist there are left out.
+        """
+        ret: dict[Tuple[str, str], Tuple[Organization, Repository]] = {}
+        missing: list[Tuple[str, str]] = []
+        for org_name, repo_name in dict.fromkeys(names):
+            stored = await self._get_external_org_with_repo(
+                session, org_name, repo_name
+            )
+            if stored:
+                ret[(org_name, repo_name)] = stored
+            else:
+                missing.append((org_name, repo_name))
+
+        if not missing:
+            return ret
+
+        log.info("organizations or repositories not found by name", missing=missing)
+        github_repos = await self.fetch_external_repositories(client, missing)
+        for name, github_repo in github_repos.items():
+            ret[name] = await self._get_or_create_external_org_with_repo(
+                session, github_repo
+            )
+        return ret
+
+    async def fetch_external_repositories(
+        self, client: GitHub[Any], names: Sequence[Tuple[str, str]]
+    ) -> dict[Tuple[str, str], FullRepository]:
+        """
+        Fetch (org name, repo name) repositories from GitHub, a few at a time.
+        Repositories that weren't found are remembered for a while and not fetched
+        again, as most of them are false positives of issue reference parsing.
+        """
+        not_found = await redis.mget([self._not_found_key(*name) for name in names])
+        names = [name for name, cached in zip(names, not_found) if cached is None]
+
+        semaphore = asyncio.Semaphore(EXTERNAL_FETCH_CONCURRENCY)
+
+        async def fetch(name: Tuple[str, str]) -> FullRepository | None:
+            async with semaphore:
+                try:
+                    response = await client.rest.repos.async_get(*name)
+                except RequestFailed as e:
+                    if e.response.status_code == 404:
+                        return None
+                    # re-raise other status codes
+                    raise e
+                return response.parsed_data
+
+        fetched = dict(zip(names, await asyncio.gather(*map(fetch, names))))
+
+        missing = [name for name, repo in fetched.items() if repo is None]
+        if missing:
+            async with redis.pipeline(transaction=False) as pipe:
+                for name in missing:
+                    pipe.setex(self._not_found_key(*name), EXTERNAL_NOT_FOUND_TTL, 1)
+                await pipe.execute()
+
+        return {name: repo for name, repo in fetched.items() if repo is not None}
+
+    def _not_found_key(self, org_name: str, repo_name: str) -> str:
+        return f"github:repository:not_found:{org_name.lower()}/{repo_name.lower()}"
+
+    async def _get_external_org_with_repo(
+        self, session: AsyncSession, org_name: str, repo_name: str
+    ) -> Tuple[Organization, Repository] | None:
+        organization = await self.get_by_name(session, Platforms.github, org_name)
+        if not organization:
+            return None
+
+        repository = await github_repository.get_by_org_and_name(
+            session, organization.id, repo_name
+        )
+        if not repository:
+            return None
+
+        return (organization, repository)
+
+    async def _get_or_create_external_org_with_repo(
+        self, session: AsyncSession, github_repo: FullRepository
+    ) -> Tuple[Organization, Repository]:
+        owner = github_repo.owner
+
+        # check if we have org with same external_id
+        organization = await self.get_by_external_id(session, owner.id)
 
         # still no organization, create it
         if not organization:
             log.info(
                 "organization not found by external_id, creating it",
-                org_name=org_name,
+                org_name=owner.login,
                 external_id=owner.id,
             )
 
@@ -237,41 +393,19 @@ class GithubOrganizationService(OrganizationService):
                     name=owner.login,
                     external_id=owner.id,
                     avatar_url=owner.avatar_url,
-                    is_personal=is_personal,
+                    is_personal=owner.type.lower() == "user",
                 ),
             )
 
-        repository = await github_repository.get_by_org_and_name(
-            session, organization.id, repo_name
-        )
-
-        if not repository:
-            log.info(
-                "repository not found by name",
-                organization_id=organization.id,
-                repo_name=repo_name,
-            )
-
-            try:
-                repo_response = await client.rest.repos.async_get(org_name, repo_name)
-                github_repo = repo_response.parsed_data
-            except RequestFailed as e:
-                if e.response.status_code == 404:
-                    raise ResourceNotFound()
-                # re-raise other status codes
-                raise e
-
-            # check if we have repo with same external_id
-            repository = await github_repository.get_by_external_id(
-                session, github_repo.id
-            )
+        # check if we have repo with same external_id
+        repository = await github_repository.get_by_external_id(session, github_repo.id)
 
         # still no repository
         if not repository:
             log.info(
                 "repository not found by external_id, creating it",
                 organization_id=organization.id,
-                repo_name=repo_name,
+                repo_name=github_repo.name,
                 external_id=github_repo.id,
             )
 
@@ -286,41 +420,7 @@ class GithubOrganizationService(OrganizationService):
                 ),
             )
 
-        issue = await github_issue.get_by_number(
-            session,
-            platform=Platforms.github,
-            organization_id=organization.id,
-            repository_id=repository.id,
-            number=issue_number,
-        )
-
-        if not issue:
-            log.info(
-                "issue not found, creating it",
-                organization_id=organization.id,
-                repository_id=repository.id,
-                number=issue_number,
-            )
-
-            try:
-                issue_response = await client.rest.issues.async_get(
-                    organization.name, repository.name, issue_number
-                )
-            except RequestFailed as e:
-                if e.response.status_code == 404:
-                    raise ResourceNotFound()
-                # re-raise other status codes
-                raise e
-
-            github_issue_data = issue_response.parsed_data
-            issue_schema = IssueCreate.from_github(
-                github_issue_data,
-                organization_id=organization.id,
-                repository_id=repository.id,
-            )
-            issue = await github_issue.create(session, issue_schema)
-
-        return (organization, repository, issue)
+        return (organization, repository)
 
     async def populate_org_metadata(
         self, session: AsyncSession, org: Organization
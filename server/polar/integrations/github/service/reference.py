@@ -1,5 +1,6 @@
 from __future__ import annotations
-from typing import Any, List, Set, Union
+import asyncio
+from typing import Any, List, Sequence, Set, Union
 from uuid import UUID
 from githubkit import GitHub, Response
 from githubkit.exception import RequestFailed
@@ -7,16 +8,22 @@ from pydantic import ValidationError, parse_obj_as
 
 import structlog
 from polar.context import PolarContext
-from polar.exceptions import IntegrityError
 import polar.integrations.github.client as github
+from polar.integrations.github.commit_cache import (
+    CommitKey,
+    CommitMetadata,
+    commit_cache,
+)
 from polar.integrations.github.service.pull_request import github_pull_request
 from polar.integrations.github.service.issue import github_issue
 from polar.integrations.github.service.api import github_api
+from polar.integrations.github.scheduler import crawl_scheduler
 from polar.issue.hooks import (
     IssueReferenceHook,
     issue_reference_created,
     issue_reference_updated,
 )
+from polar.issue.schemas import IssueReferenceCreate
 from polar.kit import utils
 
 from polar.models import Organization, Repository
@@ -28,7 +35,7 @@ from polar.models.issue_reference import (
     ReferenceType,
 )
 from polar.postgres import AsyncSession, sql
-from polar.worker import enqueue_job
+from polar.worker import enqueue_many
 from fastapi.encoders import jsonable_encoder
 
 from datetime import datetime
@@ -102,6 +109,10 @@ class GitHubIssueReferencesService:
         sync_repo_references lists repository events to find issues that have been
         mentioned. When we know which issues that have been mentioned, a job to fetch
         and parse timeline events will be triggered.
+
+        The repository keeps a cursor over its events: the ETag of the first page,
+        so that an unchanged repository costs a single 304, and the id of the newest
+        event seen, so that the crawl stops at the first event it has already seen.
         """
 
         installation_id = (
@@ -115,59 +126,72 @@ class GitHubIssueReferencesService:
 
         client = github.get_app_installation_client(installation_id)
 
-        if (
-            repo.issues_references_synced_at
-            and (utils.utc_now() - repo.issues_references_synced_at).seconds < 60
-        ):
-            # Crawled within the last minute, skip
-            log.info(
-                "github.sync_repo_references.skip",
-                owner=org.name,
-                repo=repo.name,
-            )
-            return
-
-        pre_sync_timestamp = repo.issues_references_synced_at
-
-        # Set sync timestamp
-        stmt = (
-            sql.Update(Repository)
-            .where(Repository.id == repo.id)
-            .values(issues_references_synced_at=utils.utc_now())
-        )
-        await session.execute(stmt)
-        await session.commit()
-
         log.info(
             "github.sync_repo_references",
             id=repo.id,
             name=repo.name,
         )
 
+        # Repositories synced before we kept a cursor fall back to the timestamp
+        pre_sync_timestamp = (
+            repo.issues_references_synced_at
+            if repo.github_events_last_id is None
+            else None
+        )
+
+        etag: str | None = None
+        last_id: int | None = None
         triggered_ids: Set[int] = set()
 
         for page in range(1, 100):  # Maximum 100 pages
-            res = await client.rest.issues.async_list_events_for_repo(
-                owner=org.name, repo=repo.name, per_page=100, page=page
+            first_page = page == 1
+
+            await crawl_scheduler.require(installation_id)
+
+            res = await github_api.async_request_with_headers(
+                client,
+                url=f"/repos/{org.name}/{repo.name}/issues/events",
+                params={"per_page": 100, "page": page},
+                etag=repo.github_events_etag if first_page else None,
+                response_model=List[github.rest.IssueEvent],
             )
 
+            # Cache hit, nothing new
+            if first_page and res.status_code == 304:
+                log.info(
+                    "github.sync_repo_references.etag_cache_hit",
+                    id=repo.id,
+                    name=repo.name,
+                )
+                return
+
             events = res.parsed_data
 
-            # Process events that are newer than the newest event we have
-            if pre_sync_timestamp:
+            # Events are listed newest first, remember where this crawl started
+            if first_page:
+                etag = res.headers.get("etag", None)
+                last_id = events[0].id if events else repo.github_events_last_id
+
+            # Stop at the first event that a previous crawl has already seen
+            seen_previous = False
+            if repo.github_events_last_id is not None:
+                for i, event in enumerate(events):
+                    if event.id <= repo.github_events_last_id:
+                        events = events[:i]
+                        seen_previous = True
+                        break
+            elif pre_sync_timestamp:
                 events = [e for e in events if e.created_at >= pre_sync_timestamp]
 
-            # No events, stop pagination
-            if len(events) == 0:
-                break
-
-            log.info(
-                "references.repo.page",
-                name=repo.name,
-                page=page,
-                num=len(events),
-            )
+            if events:
+                log.info(
+                    "references.repo.page",
+                    name=repo.name,
+                    page=page,
+                    num=len(events),
+                )
 
+            to_sync: List[UUID] = []
             for external_issue_id in self.external_issue_ids_to_sync(events):
                 if external_issue_id in triggered_ids:
                     continue
@@ -183,12 +207,32 @@ class GitHubIssueReferencesService:
                         external_issue_id=external_issue_id,
                     )
                     continue
-                # Trigger issue references sync job
-                await enqueue_job(
-                    "github.issue.sync.issue_references",
-                    issue.id,
-                    crawl_with_installation_id=installation_id,
-                )
+                to_sync.append(issue.id)
+
+            # Trigger issue references sync jobs for the whole page at once
+            await enqueue_many(
+                "github.issue.sync.issue_references",
+                [(issue_id,) for issue_id in to_sync],
+                crawl_with_installation_id=installation_id,
+            )
+
+            # No more new events
+            if seen_previous or len(events) == 0 or len(res.parsed_data) < 100:
+                break
+
+        # Only move the cursor once all new events have been handled, so that an
+        # interrupted crawl starts over from the same place
+        stmt = (
+            sql.Update(Repository)
+            .where(Repository.id == repo.id)
+            .values(
+                issues_references_synced_at=utils.utc_now(),
+                github_events_etag=etag,
+                github_events_last_id=last_id,
+            )
+        )
+        await session.execute(stmt)
+        await session.commit()
 
         return None
 
@@ -293,6 +337,11 @@ class GitHubIssueReferencesService:
         """
         sync_issue_references uses the GitHub Timeline API to find CrossReference events
         and creates IssueReferences
+
+        Progress is checkpointed on the issue as the number of timeline events
+        processed, the last of them, and the ETag of the page the next crawl resumes
+        from. As events before the checkpoint aren't parsed again, the pull requests
+        of other organizations they reference are refreshed separately.
         """
 
         installation_id = (
@@ -308,10 +357,22 @@ class GitHubIssueReferencesService:
 
         log.info("github.sync_issue_references", issue_id=issue.id)
 
-        # TODO: if the first page is a cache miss, we're currently re-crawling all pages
-        # A nice improvement would be to figure out if we can stop crawling early.
-        for page in range(1, 100):
-            first_page = page == 1
+        # The timeline is listed oldest first and mostly grows at the end, so we
+        # resume from the page holding the last processed event. If that event
+        # isn't where we left it, e.g. as comments were deleted, the timeline is
+        # crawled in full, as are issues crawled before we kept a checkpoint.
+        per_page = 100
+        offset = issue.github_timeline_offset or 0
+        last_event_id = issue.github_timeline_last_event_id
+        if not last_event_id:
+            offset = 0
+        etag = issue.github_timeline_etag if offset else None
+        first_page = (offset - 1) // per_page + 1 if offset else 1
+        offset_at_start = offset
+
+        page = first_page
+        for _ in range(100):
+            await crawl_scheduler.require(installation_id)
 
             try:
                 res = await self.async_list_events_for_timeline_with_headers(
@@ -320,8 +381,8 @@ class GitHubIssueReferencesService:
                     repo=repo.name,
                     issue_number=issue.number,
                     page=page,
-                    per_page=100,
-                    etag=issue.github_timeline_etag if first_page else None,
+                    per_page=per_page,
+                    etag=etag if page == first_page else None,
                 )
             except RequestFailed as e:
                 if e.response.status_code == 404:
@@ -332,38 +393,153 @@ class GitHubIssueReferencesService:
                 else:
                     raise e
 
-            # Cache hit, nothing new
-            if first_page and res.status_code == 304:
+            # Cache hit, nothing new since the checkpoint
+            if page == first_page and res.status_code == 304:
                 log.info(
                     "github.sync_issue_references.etag_cache_hit", issue_id=issue.id
                 )
+                await self.refresh_external_pull_request_references(
+                    session, client, installation_id, issue
+                )
+                issue.github_timeline_fetched_at = datetime.utcnow()
+                await issue.save(session)
                 return
 
-            # Save ETag of the first page
-            if first_page and res.status_code == 200:
+            if page == first_page:
                 log.info(
-                    "github.sync_issue_references.etag_cache_miss", issue_id=issue.id
+                    "github.sync_issue_references.etag_cache_miss",
+                    issue_id=issue.id,
+                    page=page,
                 )
 
-                issue.github_timeline_fetched_at = datetime.utcnow()
-                issue.github_timeline_etag = res.headers.get("etag", None)
-                await issue.save(session)
+            events = res.parsed_data
+            processed = max(offset - (page - 1) * per_page, 0)
+            if (
+                page == first_page
+                and processed
+                and (
+                    processed > len(events)
+                    or self.timeline_event_id(events[processed - 1]) != last_event_id
+                )
+            ):
+                log.info(
+                    "github.sync_issue_references.timeline_changed",
+                    issue_id=issue.id,
+                    offset=offset,
+                )
+                offset, etag, page, first_page = 0, None, 1, 1
+                offset_at_start = 0
+                continue
 
-            for event in res.parsed_data:
+            refs: List[IssueReference] = []
+            for event in events[processed:]:
                 ref = await self.parse_issue_timeline_event(
                     session, org, repo, issue, event, client=client
                 )
                 if ref:
-                    # add data missing from github api
-                    ref = await self.annotate(session, org, ref, client=client)
-
-                    # persist
-                    await self.create_reference(session, ref)
+                    refs.append(ref)
+
+            # add data missing from github api
+            refs = await self.annotate_many(session, refs, client=client)
+
+            # persist the whole page at once
+            await self.upsert_references(session, refs)
+
+            # Checkpoint after every page. The next crawl resumes from the page
+            # holding the last processed event. Its ETag is only kept if the page
+            # isn't full, as events added after it would be on the next page.
+            last_page = len(events) < per_page
+            if events:
+                offset = (page - 1) * per_page + len(events)
+                issue.github_timeline_offset = offset
+                issue.github_timeline_last_event_id = self.timeline_event_id(events[-1])
+            issue.github_timeline_etag = (
+                res.headers.get("etag", None) if last_page and events else None
+            )
+            issue.github_timeline_fetched_at = datetime.utcnow()
+            await issue.save(session)
 
-            # No more pages
-            if len(res.parsed_data) < 100:
+            if last_page:
+                if offset_at_start:
+                    await self.refresh_external_pull_request_references(
+                        session, client, installation_id, issue
+                    )
                 return
 
+            page += 1
+
+    async def refresh_external_pull_request_references(
+        self,
+        session: AsyncSession,
+        client: GitHub[Any],
+        installation_id: int,
+        issue: Issue,
+    ) -> None:
+        """
+        Refresh the state of the open pull requests of other organizations that
+        reference the issue, which is only known from the timeline event of the
+        reference.
+        """
+        stmt = sql.select(IssueReference).where(
+            IssueReference.issue_id == issue.id,
+            IssueReference.reference_type == ReferenceType.EXTERNAL_GITHUB_PULL_REQUEST,
+        )
+        res = await session.execute(stmt)
+
+        refreshed = 0
+        for ref in res.scalars().all():
+            r = parse_obj_as(ExternalGitHubPullRequestReference, ref.external_source)
+            if r.state != "open":
+                continue
+
+            await crawl_scheduler.require(installation_id)
+            try:
+                pr = await client.rest.pulls.async_get(
+                    owner=r.organization_name,
+                    repo=r.repository_name,
+                    pull_number=r.number,
+                )
+            except RequestFailed as e:
+                if e.response.status_code in (403, 404):
+                    continue
+                raise e
+
+            updated = r.copy(
+                update={
+                    "title": pr.parsed_data.title,
+                    "state": pr.parsed_data.state,
+                    "is_draft": bool(pr.parsed_data.draft),
+                    "is_merged": bool(pr.parsed_data.merged_at),
+                }
+            )
+            if updated != r:
+                ref.external_source = jsonable_encoder(updated)
+                session.add(ref)
+                refreshed += 1
+
+        if refreshed:
+            await session.commit()
+            log.info(
+                "github.sync_issue_references.external_pull_requests_refreshed",
+                issue_id=issue.id,
+                refreshed=refreshed,
+            )
+
+    def timeline_event_id(self, event: TimelineEventType) -> str | None:
+        """
+        Identifies a timeline event. Not all events have an id, cross-references
+        only have the time they were made.
+        """
+        for name in ("node_id", "sha"):
+            if github.is_set(event, name):
+                return str(getattr(event, name))
+
+        if github.is_set(event, "created_at"):
+            created_at: datetime = getattr(event, "created_at")
+            return f"{getattr(event, 'event', '')}@{created_at.isoformat()}"
+
+        return None
+
     async def parse_issue_timeline_event(
         self,
         session: AsyncSession,
@@ -526,85 +702,128 @@ class GitHubIssueReferencesService:
 
         return ref
 
-    async def annotate(
+    async def annotate_many(
         self,
         session: AsyncSession,
-        org: Organization,
-        ref: IssueReference,
+        refs: Sequence[IssueReference],
         client: GitHub[Any],
-    ) -> IssueReference:
-        if ref.reference_type == ReferenceType.EXTERNAL_GITHUB_COMMIT:
-            r = parse_obj_as(ExternalGitHubCommitReference, ref.external_source)
+    ) -> list[IssueReference]:
+        """
+        Fill in the blanks in commit references, which timeline events leave
+        without a branch nor message.
 
-            # use fields from existing db entry if set
-            existing = await self.get(
-                session, ref.issue_id, ref.reference_type, ref.external_id
-            )
-            existingRef = (
-                parse_obj_as(ExternalGitHubCommitReference, existing.external_source)
-                if existing
-                else None
+        Blanks are filled from the stored references first, then from the commit
+        cache, and only then from the GitHub API, fetching each unseen commit once.
+        """
+        commit_refs = [
+            (ref, parse_obj_as(ExternalGitHubCommitReference, ref.external_source))
+            for ref in refs
+            if ref.reference_type == ReferenceType.EXTERNAL_GITHUB_COMMIT
+        ]
+        if not commit_refs:
+            return list(refs)
+
+        # use fields from existing db entries if set
+        existing = await self.list_existing(session, [ref for ref, _ in commit_refs])
+        for ref, r in commit_refs:
+            existing_ref = existing.get((ref.issue_id, ref.external_id))
+            if existing_ref is None:
+                continue
+            e = parse_obj_as(
+                ExternalGitHubCommitReference, existing_ref.external_source
             )
+            r.branch_name = r.branch_name or e.branch_name
+            r.message = r.message or e.message
 
-            ref.external_source = jsonable_encoder(
-                await self.annotate_issue_commit_reference(org, r, existingRef, client)
-            )
+        missing = {
+            (r.organization_name, r.repository_name, r.commit_id)
+            for _, r in commit_refs
+            if not r.branch_name or not r.message
+        }
+        metadata = await commit_cache.get_many(missing)
 
-        return ref
+        unseen = [commit for commit in missing if commit not in metadata]
+        if unseen:
+            semaphore = asyncio.Semaphore(10)
 
-    async def annotate_issue_commit_reference(
-        self,
-        org: Organization,
-        ref: ExternalGitHubCommitReference,
-        existingRef: ExternalGitHubCommitReference | None,
-        client: GitHub[Any],
-    ) -> ExternalGitHubCommitReference:
-        """
-        annotate_issue_commit_reference attempts to fetch data from the GitHub API
-        and fill in the blanks in ref
-        """
+            async def fetch(commit: CommitKey) -> CommitMetadata:
+                async with semaphore:
+                    return await self.fetch_commit_metadata(client, commit)
 
-        # New ref has all fields
-        if ref.branch_name and ref.branch_name:
-            return ref
-
-        # Populate from existingRef
-        if existingRef and existingRef.branch_name and not ref.branch_name:
-            ref.branch_name = existingRef.branch_name
-        if existingRef and existingRef.message and not ref.message:
-            ref.message = existingRef.message
-
-        # If still not there, fetch from GitHub
-        if not ref.branch_name or not ref.message:
-            # Fetch branches where the commit is currently the HEAD commit
-            # GitHub has no API to find branches that _contain_ a commit, so if that's
-            # what we want to do long term, we'll probably have to clone the repo and
-            # analyze it ourselves.
-            branches = await client.rest.repos.async_list_branches_for_head_commit(
-                owner=ref.organization_name,
-                repo=ref.repository_name,
-                commit_sha=ref.commit_id,
-            )
+            fetched = dict(zip(unseen, await asyncio.gather(*map(fetch, unseen))))
+            await commit_cache.set_many(fetched)
+            metadata.update(fetched)
 
-            if branches and branches.parsed_data:
-                b = branches.parsed_data
-                if len(b) == 1:
-                    ref.branch_name = b[0].name
+        for ref, r in commit_refs:
+            m = metadata.get((r.organization_name, r.repository_name, r.commit_id))
+            if m is not None:
+                r.branch_name = r.branch_name or m.branch_name
+                r.message = r.message or m.message
+            ref.external_source = jsonable_encoder(r)
 
-            # Get commit message
-            commit = await client.rest.repos.async_get_commit(
-                owner=ref.organization_name,
-                repo=ref.repository_name,
-                ref=ref.commit_id,
-            )
-            try:
-                if commit and commit.parsed_data.commit.message:
-                    ref.message = commit.parsed_data.commit.message
-            except ValidationError:
-                # githubkit can crash with a validation error inside commit.parsed_data
-                pass
+        log.info(
+            "github.annotate_commit_references",
+            refs=len(commit_refs),
+            missing=len(missing),
+            fetched=len(unseen),
+        )
+        return list(refs)
+
+    async def fetch_commit_metadata(
+        self, client: GitHub[Any], commit: CommitKey
+    ) -> CommitMetadata:
+        owner, repo, sha = commit
+
+        # Fetch branches where the commit is currently the HEAD commit
+        # GitHub has no API to find branches that _contain_ a commit, so if that's
+        # what we want to do long term, we'll probably have to clone the repo and
+        # analyze it ourselves.
+        branches, commit_res = await asyncio.gather(
+            client.rest.repos.async_list_branches_for_head_commit(
+                owner=owner, repo=repo, commit_sha=sha
+            ),
+            client.rest.repos.async_get_commit(owner=owner, repo=repo, ref=sha),
+        )
 
-        return ref
+        branch_name = None
+        if branches and branches.parsed_data:
+            b = branches.parsed_data
+            if len(b) == 1:
+                branch_name = b[0].name
+
+        # Get commit message
+        message = None
+        try:
+            if commit_res and commit_res.parsed_data.commit.message:
+                message = commit_res.parsed_data.commit.message
+        except ValidationError:
+            # githubkit can crash with a validation error inside commit.parsed_data
+            pass
+
+        return CommitMetadata(message=message, branch_name=branch_name)
+
+    async def list_existing(
+        self, session: AsyncSession, refs: Sequence[IssueReference]
+    ) -> dict[tuple[UUID, str], IssueReference]:
+        """
+        Stored references of the same type, issue and external id as refs, by
+        (issue_id, external_id).
+        """
+        keys = {(ref.issue_id, ref.external_id) for ref in refs}
+        if not keys:
+            return {}
+
+        stmt = sql.select(IssueReference).where(
+            IssueReference.reference_type == refs[0].reference_type,
+            IssueReference.issue_id.in_({issue_id for issue_id, _ in keys}),
+            IssueReference.external_id.in_({external_id for _, external_id in keys}),
+        )
+        res = await session.execute(stmt)
+        return {
+            (r.issue_id, r.external_id): r
+            for r in res.scalars().all()
+            if (r.issue_id, r.external_id) in keys
+        }
 
     async def get(
         self,
@@ -621,43 +840,46 @@ class GitHubIssueReferencesService:
         res = await session.execute(stmt)
         return res.scalars().first()
 
-    async def create_reference(
-        self, session: AsyncSession, ref: IssueReference
-    ) -> None:
-        nested = await session.begin_nested()
-        try:
-            session.add(ref)
-            await nested.commit()
-            await session.commit()
-            log.info(
-                "issue.create_reference.created",
-                ref=ref,
-            )
+    async def upsert_references(
+        self, session: AsyncSession, refs: List[IssueReference]
+    ) -> Sequence[IssueReference]:
+        """
+        Insert or update references in a single statement, and then call the created
+        and updated hooks for them.
+        """
+        # A statement can't update the same row twice, last one wins
+        unique = {
+            (ref.issue_id, ref.reference_type, ref.external_id): ref for ref in refs
+        }
+        if not unique:
+            return []
 
-            await issue_reference_created.call(IssueReferenceHook(session, ref))
-            return
-        except IntegrityError:
-            log.info(
-                "issue.create_reference.already_exists",
-                ref=ref,
-            )
-            await nested.rollback()
+        records = await IssueReference.upsert_many(
+            session,
+            [IssueReferenceCreate.from_model(ref) for ref in unique.values()],
+            constraints=[
+                IssueReference.issue_id,
+                IssueReference.reference_type,
+                IssueReference.external_id,
+            ],
+            mutable_keys={"external_source"},
+        )
 
-        # Update external_source
-        stmt = (
-            sql.Update(IssueReference)
-            .where(
-                IssueReference.issue_id == ref.issue_id,
-                IssueReference.reference_type == ref.reference_type,
-                IssueReference.external_id == ref.external_id,
-            )
-            .values(external_source=ref.external_source)
+        log.info(
+            "issue.upsert_references",
+            created=sum(1 for r in records if r.was_created),
+            updated=sum(1 for r in records if r.was_updated),
         )
 
-        await session.execute(stmt)
-        await session.commit()
+        for record in records:
+            hook = (
+                issue_reference_created
+                if record.was_created
+                else issue_reference_updated
+            )
+            await hook.call(IssueReferenceHook(session, record))
 
-        await issue_reference_updated.call(IssueReferenceHook(session, ref))
+        return records
 
 
 github_reference = GitHubIssueReferencesService()
@@ -1,7 +1,17 @@
-from typing import List, Literal, Callable, Any, Coroutine, Sequence
+import asyncio
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    List,
+    Literal,
+    Callable,
+    Any,
+    Coroutine,
+    Sequence,
+)
 
 import structlog
-from githubkit import Paginator, Response
+from githubkit import Response
 from githubkit.rest import (
     InstallationRepositoriesGetResponse200,
     Repository as GitHubKitRepository,
@@ -21,6 +31,8 @@ from polar.repository.hooks import (
 )
 
 from .. import client as github
+from ..backfill import repository_backfill
+from ..scheduler import crawl_scheduler
 from .issue import github_issue
 from .pull_request import github_pull_request
 
@@ -44,58 +56,102 @@ class GithubRepositoryService(RepositoryService):
         self,
         session: AsyncSession,
         *,
-        paginator: Paginator[github.rest.Issue]
-        | Paginator[github.rest.PullRequestSimple],
-        store_resource_method: Callable[
-            ..., Coroutine[Any, Any, Issue | PullRequest | None]
+        paginator: AsyncIterator[github.rest.Issue]
+        | AsyncIterator[github.rest.PullRequestSimple],
+        store_many_method: Callable[
+            ..., Coroutine[Any, Any, Sequence[Issue] | Sequence[PullRequest]]
         ],
         organization: Organization,
         repository: Repository,
         resource_type: Literal["issue", "pull_request"],
+        per_page: int,
+        first_page: int = 1,
         skip_condition: Callable[..., bool] | None = None,
         on_sync_signal: Hook[SyncedHook] | None = None,
         on_completed_signal: Hook[SyncCompletedHook] | None = None,
+        on_page_stored: Callable[[int], Awaitable[None]] | None = None,
     ) -> tuple[SyncedCount, ErrorCount]:
-        synced, errors = 0, 0
-        async for data in paginator:
-            synced += 1
+        """
+        Store the resources a page at a time, each page in a single statement, while
+        the next page is fetched from GitHub. on_sync_signal is called once per page,
+        on_page_stored with the page to resume from once a page is stored.
+        """
+
+        async def paginate_pages() -> AsyncIterator[list[Any]]:
+            page: list[Any] = []
+            async for data in paginator:
+                page.append(data)
+                if len(page) >= per_page:
+                    yield page
+                    page = []
+            if page:
+                yield page
+
+        pages = paginate_pages()
+        next_page = asyncio.ensure_future(pages.__anext__())
 
-            if skip_condition and skip_condition(data):
-                continue
+        synced, errors = 0, 0
+        page_number = first_page
+        try:
+            while True:
+                try:
+                    page = await next_page
+                except StopAsyncIteration:
+                    break
+                # Fetch the next page from GitHub while this one is written
+                next_page = asyncio.ensure_future(pages.__anext__())
+
+                synced += len(page)
+                page_number += 1
+
+                items = [
+                    data
+                    for data in page
+                    if not (skip_condition and skip_condition(data))
+                ]
+                if not items:
+                    if on_page_stored:
+                        await on_page_stored(page_number)
+                    continue
+
+                records = await store_many_method(
+                    session,
+                    data=items,
+                    organization=organization,
+                    repository=repository,
+                )
 
-            record = await store_resource_method(
-                session,
-                data=data,
-                organization=organization,
-                repository=repository,
-            )
+                if len(records) < len(items):
+                    log.warning(
+                        f"{resource_type}.sync.failed",
+                        error="save was unsuccessful",
+                        received=len(items),
+                        saved=len(records),
+                    )
+                    errors += len(items) - len(records)
 
-            if not record:
-                log.warning(
-                    f"{resource_type}.sync.failed",
-                    error="save was unsuccessful",
-                    received=data.dict(),
+                log.debug(
+                    f"{resource_type}.synced",
+                    organization_id=organization.id,
+                    repository_id=repository.id,
+                    count=len(records),
                 )
-                errors += 1
-                continue
-
-            log.debug(
-                f"{resource_type}.synced",
-                organization_id=organization.id,
-                repository_id=repository.id,
-                id=record.id,
-                title=record.title,
-            )
 
-            if on_sync_signal:
-                await on_sync_signal.call(
-                    SyncedHook(
-                        repository=repository,
-                        organization=organization,
-                        record=record,
-                        synced=synced,
+                if on_sync_signal and records:
+                    await on_sync_signal.call(
+                        SyncedHook(
+                            repository=repository,
+                            organization=organization,
+                            record=records[-1],
+                            synced=synced,
+                        )
                     )
-                )
+
+                if on_page_stored:
+                    await on_page_stored(page_number)
+        finally:
+            if not next_page.done():
+                next_page.cancel()
 
         log.info(
             f"{resource_type}.sync.completed",
@@ -125,9 +181,11 @@ class GithubRepositoryService(RepositoryService):
         state: Literal["open", "closed", "all"] = "open",
         sort: Literal["created", "updated", "comments"] = "updated",
         direction: Literal["asc", "desc"] = "desc",
-        per_page: int = 30,
+        per_page: int = 100,
+        page: int = 1,
         crawl_with_installation_id: int
         | None = None,  # Override which installation to use when crawling
+        on_page_stored: Callable[[int], Awaitable[None]] | None = None,
     ) -> tuple[SyncedCount, ErrorCount]:
         # We get PRs in the issues list too, but super slim versions of them.
         # Since we sync PRs separately, we therefore skip them here.
@@ -147,25 +205,33 @@ class GithubRepositoryService(RepositoryService):
 
         client = github.get_app_installation_client(installation_id)
 
-        paginator = client.paginate(
-            client.rest.issues.async_list_for_repo,
-            owner=organization.name,
-            repo=repository.name,
-            state=state,
-            sort=sort,
-            direction=direction,
-            per_page=per_page,
+        paginator = crawl_scheduler.paginate(
+            installation_id,
+            client.paginate(
+                client.rest.issues.async_list_for_repo,
+                owner=organization.name,
+                repo=repository.name,
+                state=state,
+                sort=sort,
+                direction=direction,
+                page=page,
+                per_page=per_page,
+            ),
+            per_page,
         )
         synced, errors = await self.store_paginated_resource(
             session,
             paginator=paginator,
-            store_resource_method=github_issue.store,
+            store_many_method=github_issue.store_many,
             organization=organization,
             repository=repository,
             skip_condition=skip_if_pr,
             on_sync_signal=repository_issue_synced,
             on_completed_signal=repository_issues_sync_completed,
             resource_type="issue",
+            per_page=per_page,
+            first_page=page,
+            on_page_stored=on_page_stored,
         )
         return (synced, errors)
 
@@ -177,9 +243,11 @@ class GithubRepositoryService(RepositoryService):
         state: Literal["open", "closed", "all"] = "open",
         sort: Literal["created", "updated", "popularity", "long-running"] = "updated",
         direction: Literal["asc", "desc"] = "desc",
-        per_page: int = 30,
+        per_page: int = 100,
+        page: int = 1,
         crawl_with_installation_id: int
         | None = None,  # Override which installation to use when crawling
+        on_page_stored: Callable[[int], Awaitable[None]] | None = None,
     ) -> tuple[SyncedCount, ErrorCount]:
         installation_id = (
             crawl_with_installation_id
@@ -192,22 +260,30 @@ class GithubRepositoryService(RepositoryService):
 
         client = github.get_app_installation_client(installation_id)
 
-        paginator = client.paginate(
-            client.rest.pulls.async_list,
-            owner=organization.name,
-            repo=repository.name,
-            state=state,
-            sort=sort,
-            direction=direction,
-            per_page=per_page,
+        paginator = crawl_scheduler.paginate(
+            installation_id,
+            client.paginate(
+                client.rest.pulls.async_list,
+                owner=organization.name,
+                repo=repository.name,
+                state=state,
+                sort=sort,
+                direction=direction,
+                page=page,
+                per_page=per_page,
+            ),
+            per_page,
         )
         synced, errors = await self.store_paginated_resource(
             session,
             paginator=paginator,
-            store_resource_method=github_pull_request.store_simple,
+            store_many_method=github_pull_request.store_many_simple,
             organization=organization,
             repository=repository,
             resource_type="pull_request",
+            per_page=per_page,
+            first_page=page,
+            on_page_stored=on_page_stored,
         )
         return (synced, errors)
 
@@ -260,8 +336,7 @@ class GithubRepositoryService(RepositoryService):
             instances.append(inst)
 
         await session.commit()
-        for installation in instances:
-            await self.enqueue_sync(installation)
+        await repository_backfill.start(installation_id, organization.id, instances)
         return instances
 
 
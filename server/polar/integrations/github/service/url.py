@@ -7,13 +7,16 @@ class GitHubUrlService:
     # "org/repo#14"
     # "repo#14"
     # "#14"
-    org_repo_number_re = re.compile(
-        r"(?P<owner>[a-z0-9][a-z0-9-]*)?(?:/(?P<repo>[a-z0-9_\.-]+))?#(?P<number>\d++)(?![a-z])",
-        re.IGNORECASE,
-    )
-
-    href_re = re.compile(
-        r"(?:https?://(?:www\.)?github\.com/)(?P<owner>[a-z0-9][a-z0-9-]*)?(?:/(?P<repo>[a-z0-9_\.-]+))?(?:#|/issues/)(?P<number>\d++)(?![a-z])",
+    # "https://github.com/org/repo/issues/14"
+    #
+    # Both forms in a single pattern, so that a body is scanned once. The
+    # "/issues/" separator is only accepted after a github.com URL.
+    issue_re = re.compile(
+        r"(?P<url>https?://(?:www\.)?github\.com/)?"
+        r"(?P<owner>[a-z0-9][a-z0-9-]*)?"
+        r"(?:/(?P<repo>[a-z0-9_\.-]+))?"
+        r"(?(url)(?:#|/issues/)|#)"
+        r"(?P<number>\d++)(?![a-z])",
         re.IGNORECASE,
     )
 
@@ -22,30 +25,16 @@ class GitHubUrlService:
         given a body of text, parse out the dependencies (i.e. issues in other repos
         that this body references)
         """
-        patterns = [
-            self.org_repo_number_re,
-            self.href_re,
-        ]
-
-        for pattern in patterns:
-            for m in pattern.finditer(body):
-                print(m)
-
-        dependencies = [
-            GitHubIssue(
+        seen_dependencies: set[str] = set()
+        ret = []
+        for m in self.issue_re.finditer(body):
+            dependency = GitHubIssue(
                 raw=m.group(0),
                 owner=m.group("owner"),
                 repo=m.group("repo"),
                 number=int(m.group("number")),
             )
-            for pattern in patterns
-            for m in pattern.finditer(body)
-        ]
-
-        # Deduplicate the dependencies
-        seen_dependencies = set()
-        ret = []
-        for dependency in dependencies:
+            # Deduplicate the dependencies
             if dependency.canonical in seen_dependencies:
                 continue
             seen_dependencies.add(dependency.canonical)
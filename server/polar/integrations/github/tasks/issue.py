@@ -1,12 +1,33 @@
+import asyncio
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import AsyncIterator, Sequence
 from uuid import UUID
+
 import structlog
+from redis.exceptions import LockError
+
 from polar.integrations.github import service
-from polar.integrations.github.client import get_app_installation_client
+from polar.config import settings
+from polar.integrations.github.client import (
+    get_app_installation_client,
+    get_polar_client,
+)
+from polar.integrations.github.graphql import MAX_ISSUES_PER_QUERY
+from polar.integrations.github.scheduler import crawl_scheduler, issue_crawl_value
 
-from polar.worker import JobContext, PolarWorkerContext, enqueue_job, interval, task
+from polar.worker import JobContext, PolarWorkerContext, interval, task
+from polar.models import Issue, Organization
 from polar.postgres import AsyncSessionLocal
+from polar.redis import redis
 
-from .utils import get_organization_and_repo
+from .utils import (
+    CRAWL_MAX_TRIES,
+    get_organization_and_repo,
+    retry_when_budget_exhausted,
+)
 from ..service.issue import github_issue
 from ..service.api import github_api
 from polar.organization.service import organization as organization_service
@@ -14,7 +35,7 @@ from polar.organization.service import organization as organization_service
 log = structlog.get_logger()
 
 
-@task("github.issue.sync")
+@task("github.issue.sync", coalesce_key=lambda issue_id, **kw: str(issue_id))
 async def issue_sync(
     ctx: JobContext,
     issue_id: UUID,
@@ -46,7 +67,72 @@ async def issue_sync(
             )
 
 
-@task("github.issue.sync.issue_references")
+@task("github.issue.sync.external", coalesce_key=lambda issue_id, **kw: str(issue_id))
+async def issue_sync_external(
+    ctx: JobContext,
+    issue_id: UUID,
+    polar_context: PolarWorkerContext,
+) -> None:
+    """
+    Refresh an issue shown on its public page, with the installation client if
+    there's one, else with the Polar user token.
+    """
+    with polar_context.to_execution_context():
+        async with AsyncSessionLocal() as session:
+            issue = await github_issue.get(session, issue_id)
+            if not issue or not issue.organization_id or not issue.repository_id:
+                log.warning(
+                    "github.issue.sync.external",
+                    error="issue not found",
+                    issue_id=issue_id,
+                )
+                return
+
+            organization, repository = await get_organization_and_repo(
+                session, issue.organization_id, issue.repository_id
+            )
+
+            await github_issue.sync_issue(
+                session,
+                org=organization,
+                repo=repository,
+                issue=issue,
+                client=None if organization.installation_id else get_polar_client(),
+            )
+
+
+@task("github.issue.sync.batch")
+async def issue_sync_batch(
+    ctx: JobContext,
+    issue_ids: list[UUID],
+    polar_context: PolarWorkerContext,
+) -> None:
+    with polar_context.to_execution_context():
+        async with AsyncSessionLocal() as session:
+            issues = await github_issue.list_with_organization_and_repository(
+                session, issue_ids
+            )
+
+            by_installation: dict[int, list[Issue]] = defaultdict(list)
+            for issue in issues:
+                if issue.organization.installation_id:
+                    by_installation[issue.organization.installation_id].append(issue)
+
+            for installation_id, installation_issues in by_installation.items():
+                await github_issue.sync_issues(
+                    session, installation_issues, installation_id
+                )
+
+
+crawl_scheduler.batch("github.issue.sync.batch", MAX_ISSUES_PER_QUERY)
+
+
+@task(
+    "github.issue.sync.issue_references",
+    coalesce_key=lambda issue_id, **kw: str(issue_id),
+    max_tries=CRAWL_MAX_TRIES,
+)
+@retry_when_budget_exhausted
 async def issue_sync_issue_references(
     ctx: JobContext,
     issue_id: UUID,
@@ -78,7 +164,10 @@ async def issue_sync_issue_references(
             )
 
 
-@task("github.issue.sync.issue_dependencies")
+@task(
+    "github.issue.sync.issue_dependencies",
+    coalesce_key=lambda issue_id, **kw: str(issue_id),
+)
 async def issue_sync_issue_dependencies(
     ctx: JobContext,
     issue_id: UUID,
@@ -107,82 +196,147 @@ async def issue_sync_issue_dependencies(
             )
 
 
-@interval(
-    minute={2, 7, 12, 17, 22, 27, 32, 37, 42, 47, 52, 57},
-    second=0,
-)
-async def cron_refresh_issues(ctx: JobContext) -> None:
-    async with AsyncSessionLocal() as session:
-        orgs = await organization_service.list_installed(session)
-        for org in orgs:
+# Bounds for a single cron tick, so that ticks stay shorter than the interval
+# between them even with thousands of installations.
+CRON_CONCURRENCY = 10
+CRON_TIME_BUDGET = timedelta(minutes=4)
+
+
+@asynccontextmanager
+async def cron_lock(name: str) -> AsyncIterator[bool]:
+    """
+    Yields True if this tick holds the lock, False if a previous tick of the same
+    cron is still running. The lock expires on its own if the worker dies.
+    """
+    lock = redis.lock(
+        f"worker:cron_lock:{name}",
+        timeout=CRON_TIME_BUDGET.total_seconds() + 60,
+    )
+    acquired = await lock.acquire(blocking=False)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                await lock.release()
+            except LockError:
+                pass
+
+
+async def schedule_crawl(
+    cron_name: str,
+    task_name: str,
+    organizations: Sequence[Organization],
+    issues: Sequence[Issue],
+) -> None:
+    """
+    Queue the issues to crawl on their installation's crawl scheduler, then fan out
+    over the organizations, with bounded concurrency and within the tick's time
+    budget, refreshing each rate limit budget and draining the most valuable work.
+    """
+    issues_by_organization: dict[UUID, list[Issue]] = defaultdict(list)
+    for issue in issues:
+        issues_by_organization[issue.organization_id].append(issue)
+
+    deadline = time.monotonic() + CRON_TIME_BUDGET.total_seconds()
+    semaphore = asyncio.Semaphore(CRON_CONCURRENCY)
+    out_of_time: list[Organization] = []
+
+    async def schedule(org: Organization) -> None:
+        now = time.time()
+        await crawl_scheduler.schedule(
+            org.installation_id,
+            task_name,
+            {
+                issue.id: issue_crawl_value(issue, now)
+                for issue in issues_by_organization[org.id]
+            },
+        )
+
+        async with semaphore:
+            remaining_time = deadline - time.monotonic()
+            if remaining_time <= 0:
+                out_of_time.append(org)
+                return
+
+            # The rate limit endpoint is free, and the client records its headers
+            # on the crawl scheduler.
             client = get_app_installation_client(org.installation_id)
             try:
-                rate_limit = await github_api.get_rate_limit(client)
+                await asyncio.wait_for(
+                    github_api.get_rate_limit(client), timeout=remaining_time
+                )
+            except asyncio.TimeoutError:
+                out_of_time.append(org)
+                return
             except Exception as e:
                 log.info(
                     "failed to get rate limit, treating it as no remaining",
                     org_name=org.name,
                     err=e,
                 )
-                continue
-
-            if rate_limit.remaining < 1000:
-                log.info(
-                    "github.issue.sync.cron_refresh_issues.rate_limit_almost_exhausted",
-                    org_name=org.name,
-                    rate_limit_remaining=rate_limit.remaining,
-                )
-                continue
-
-            issues = await github_issue.list_issues_to_crawl_issue(session, org)
+                return
 
+            enqueued = await crawl_scheduler.drain(org.installation_id)
+            stats = await crawl_scheduler.stats(org.installation_id)
             log.info(
-                "github.issue.sync.cron_refresh_issues",
+                cron_name,
                 org_name=org.name,
-                found_count=len(issues),
-                rate_limit_remaining=rate_limit.remaining,
+                found_count=len(issues_by_organization[org.id]),
+                enqueued_count=enqueued,
+                queue_depth=stats.queue_depth,
+                rate_limit_remaining=stats.remaining,
             )
 
-            for issue in issues:
-                await enqueue_job("github.issue.sync", issue.id)
+    await asyncio.gather(
+        *(schedule(org) for org in organizations if issues_by_organization.get(org.id))
+    )
+
+    if out_of_time:
+        log.warning(
+            f"{cron_name}.time_budget_exceeded",
+            skipped_count=len(out_of_time),
+        )
 
 
 @interval(
-    minute={0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55},
+    minute={2, 7, 12, 17, 22, 27, 32, 37, 42, 47, 52, 57},
     second=0,
 )
-async def cron_refresh_issue_timelines(ctx: JobContext) -> None:
-    async with AsyncSessionLocal() as session:
-        orgs = await organization_service.list_installed(session)
-        for org in orgs:
-            client = get_app_installation_client(org.installation_id)
+async def cron_refresh_issues(ctx: JobContext) -> None:
+    cron_name = "github.issue.sync.cron_refresh_issues"
+    async with cron_lock(cron_name) as acquired:
+        if not acquired:
+            log.info(f"{cron_name}.already_running")
+            return
 
-            try:
-                rate_limit = await github_api.get_rate_limit(client)
-            except Exception as e:
-                log.info(
-                    "failed to get rate limit, treating it as no remaining",
-                    org_name=org.name,
-                    err=e,
-                )
-                continue
+        async with AsyncSessionLocal() as session:
+            orgs = await organization_service.list_installed(session)
+            issues = await github_issue.list_issues_to_crawl_issue(session)
 
-            if rate_limit.remaining < 1000:
-                log.info(
-                    "github.issue.sync.cron_refresh_issue_timelines.rate_limit_almost_exhausted",
-                    org_name=org.name,
-                    rate_limit_remaining=rate_limit.remaining,
-                )
-                continue
+        task_name = (
+            "github.issue.sync.batch"
+            if settings.GITHUB_ISSUE_REFRESH_BATCH
+            else "github.issue.sync"
+        )
+        await schedule_crawl(cron_name, task_name, orgs, issues)
 
-            issues = await github_issue.list_issues_to_crawl_timeline(session, org)
 
-            log.info(
-                "github.issue.sync.cron_refresh_issue_timelines",
-                org_name=org.name,
-                found_count=len(issues),
-                rate_limit_remaining=rate_limit.remaining,
-            )
+@interval(
+    minute={0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55},
+    second=0,
+)
+async def cron_refresh_issue_timelines(ctx: JobContext) -> None:
+    cron_name = "github.issue.sync.cron_refresh_issue_timelines"
+    async with cron_lock(cron_name) as acquired:
+        if not acquired:
+            log.info(f"{cron_name}.already_running")
+            return
 
-            for issue in issues:
-                await enqueue_job("github.issue.sync.issue_references", issue.id)
+        async with AsyncSessionLocal() as session:
+            orgs = await organization_service.list_installed(session)
+            issues = await github_issue.list_issues_to_crawl_timeline(session)
+
+        await schedule_crawl(
+            cron_name, "github.issue.sync.issue_references", orgs, issues
+        )
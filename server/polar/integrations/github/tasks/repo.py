@@ -1,11 +1,18 @@
+from datetime import timedelta
+from typing import Awaitable, Callable
 from uuid import UUID
 import structlog
 
 from polar.integrations.github import service
-from polar.worker import JobContext, PolarWorkerContext, enqueue_job, task
+from polar.integrations.github.backfill import BackfillResource, repository_backfill
+from polar.worker import JobContext, PolarWorkerContext, enqueue_job, interval, task
 from polar.postgres import AsyncSessionLocal
 
-from .utils import get_organization_and_repo
+from .utils import (
+    CRAWL_MAX_TRIES,
+    get_organization_and_repo,
+    retry_when_budget_exhausted,
+)
 
 log = structlog.get_logger()
 
@@ -29,7 +36,8 @@ async def sync_repositories(
             )
 
 
-@task("github.repo.sync.issues")
+@task("github.repo.sync.issues", max_tries=CRAWL_MAX_TRIES)
+@retry_when_budget_exhausted
 async def sync_repository_issues(
     ctx: JobContext,
     organization_id: UUID,
@@ -51,7 +59,8 @@ async def sync_repository_issues(
             )
 
 
-@task("github.repo.sync.pull_requests")
+@task("github.repo.sync.pull_requests", max_tries=CRAWL_MAX_TRIES)
+@retry_when_budget_exhausted
 async def sync_repository_pull_requests(
     ctx: JobContext,
     organization_id: UUID,
@@ -78,7 +87,14 @@ async def sync_repository_pull_requests(
             )
 
 
-@task("github.repo.sync.issue_references")
+@task(
+    "github.repo.sync.issue_references",
+    # Webhook bursts trigger this for the same repository in quick succession
+    coalesce_key=lambda organization_id, repository_id, **kw: str(repository_id),
+    debounce=timedelta(seconds=10),
+    max_tries=CRAWL_MAX_TRIES,
+)
+@retry_when_budget_exhausted
 async def repo_sync_issue_references(
     ctx: JobContext,
     organization_id: UUID,
@@ -97,3 +113,99 @@ async def repo_sync_issue_references(
                 repo=repository,
                 crawl_with_installation_id=crawl_with_installation_id,
             )
+
+
+@task("github.repo.backfill", max_tries=CRAWL_MAX_TRIES)
+@retry_when_budget_exhausted
+async def repo_backfill(
+    ctx: JobContext,
+    installation_id: int,
+    organization_id: UUID,
+    repository_id: UUID,
+    polar_context: PolarWorkerContext,
+) -> None:
+    """
+    Backfill the issues, then the pull requests, of a repository from the page it
+    was left at, and start the next repository of the installation once done.
+    """
+    with polar_context.to_execution_context():
+        async with AsyncSessionLocal() as session:
+            organization, repository = await get_organization_and_repo(
+                session, organization_id, repository_id
+            )
+
+            resource, page = await repository_backfill.get_cursor(repository_id)
+            log.info(
+                "github.repo.backfill",
+                repository_id=repository_id,
+                resource=resource,
+                page=page,
+            )
+
+            def checkpoint(
+                resource: BackfillResource,
+            ) -> Callable[[int], Awaitable[None]]:
+                async def on_page_stored(page: int) -> None:
+                    await repository_backfill.checkpoint(
+                        installation_id, repository_id, resource, page
+                    )
+
+                return on_page_stored
+
+            # Open and closed, oldest first, so that new items are only added to
+            # the last page and pages we went through stay put, unless items are
+            # deleted or transferred
+            if resource == BackfillResource.issues:
+                await service.github_repository.sync_issues(
+                    session,
+                    organization=organization,
+                    repository=repository,
+                    state="all",
+                    sort="created",
+                    direction="asc",
+                    page=page,
+                    crawl_with_installation_id=installation_id,
+                    on_page_stored=checkpoint(BackfillResource.issues),
+                )
+                page = 1
+                await repository_backfill.checkpoint(
+                    installation_id, repository_id, BackfillResource.pull_requests, 1
+                )
+
+            await service.github_repository.sync_pull_requests(
+                session,
+                organization=organization,
+                repository=repository,
+                state="all",
+                sort="created",
+                direction="asc",
+                page=page,
+                crawl_with_installation_id=installation_id,
+                on_page_stored=checkpoint(BackfillResource.pull_requests),
+            )
+
+    await enqueue_job(
+        "github.repo.sync.issue_references",
+        organization_id,
+        repository_id,
+        crawl_with_installation_id=installation_id,
+    )
+    await repository_backfill.complete(installation_id, repository_id)
+
+
+@interval(
+    minute={4, 9, 14, 19, 24, 29, 34, 39, 44, 49, 54, 59},
+    second=0,
+)
+async def cron_backfill(ctx: JobContext) -> None:
+    """
+    Resume backfills whose jobs died, once their lease expired.
+    """
+    for installation_id in await repository_backfill.installations():
+        started = await repository_backfill.fill(installation_id)
+        if started:
+            log.info(
+                "github.repo.backfill.resumed",
+                installation_id=installation_id,
+                repositories=len(started),
+            )
@@ -0,0 +1,55 @@
+from uuid import UUID
+
+import structlog
+
+from polar.models.user import OAuthAccount
+from polar.postgres import AsyncSessionLocal
+from polar.worker import JobContext, PolarWorkerContext, interval, task
+
+from ..token_refresh import token_refresher
+
+log = structlog.get_logger()
+
+
+@task(
+    "github.user.refresh_token",
+    coalesce_key=lambda oauth_account_id, **kw: str(oauth_account_id),
+)
+async def refresh_token(
+    ctx: JobContext,
+    oauth_account_id: UUID,
+    polar_context: PolarWorkerContext,
+) -> None:
+    with polar_context.to_execution_context():
+        async with AsyncSessionLocal() as session:
+            oauth = await session.get(OAuthAccount, oauth_account_id)
+            if not oauth:
+                log.warning(
+                    "github.user.refresh_token",
+                    error="oauth account not found",
+                    oauth_account_id=oauth_account_id,
+                )
+                return
+
+            await token_refresher.refresh(
+                session, oauth, within=token_refresher.background_refresh_before
+            )
+
+
+@interval(
+    minute={1, 11, 21, 31, 41, 51},
+    second=0,
+)
+async def cron_refresh_tokens(ctx: JobContext) -> None:
+    """
+    Refresh tokens ahead of expiry, whether or not they're being used.
+    """
+    async with AsyncSessionLocal() as session:
+        expiring = await token_refresher.list_expiring(session)
+
+    scheduled = await token_refresher.schedule(expiring)
+    log.info(
+        "github.user.cron_refresh_tokens",
+        expiring=len(expiring),
+        scheduled=scheduled,
+    )
@@ -1,16 +1,45 @@
-from typing import Sequence, Union
+import functools
+from typing import Awaitable, Callable, ParamSpec, Sequence, TypeVar, Union
 from uuid import UUID
 
 import structlog
+from arq.worker import Retry
 
 from polar.integrations.github import client as github
 from polar.integrations.github import service
+from polar.integrations.github.scheduler import BudgetExhausted
 from polar.models import Issue, Organization, PullRequest, Repository
 from polar.postgres import AsyncSession
 from polar.pull_request.schemas import FullPullRequestCreate
 
 log = structlog.get_logger()
 
+Params = ParamSpec("Params")
+ReturnValue = TypeVar("ReturnValue")
+
+# Tries of crawl tasks, which are retried once per rate limit window they run out of
+# budget in
+CRAWL_MAX_TRIES = 10
+
+
+def retry_when_budget_exhausted(
+    f: Callable[Params, Awaitable[ReturnValue]]
+) -> Callable[Params, Awaitable[ReturnValue]]:
+    """
+    Retry the job once the rate limit window resets if the crawl budget of the
+    installation runs out.
+    """
+
+    @functools.wraps(f)
+    async def wrapper(*args: Params.args, **kwargs: Params.kwargs) -> ReturnValue:
+        try:
+            return await f(*args, **kwargs)
+        except BudgetExhausted as e:
+            raise Retry(defer=e.defer) from e
+
+    return wrapper
+
+
 # ------------------------------------------------------------------------------
 # TODO: Move all of this to service(s) except for true utils
 # ------------------------------------------------------------------------------
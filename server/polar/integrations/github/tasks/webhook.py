@@ -1,7 +1,9 @@
+import json
 from typing import Any, Sequence, Union
 
 import structlog
 
+from polar.config import settings
 from polar.context import ExecutionContext
 from polar.integrations.github import client as github
 from polar.kit.extensions.sqlalchemy import sql
@@ -10,9 +12,18 @@ from polar.models.issue import Issue
 from polar.models.organization import Organization
 from polar.organization.hooks import OrganizationHook, organization_upserted
 from polar.postgres import AsyncSession, AsyncSessionLocal
-from polar.worker import JobContext, PolarWorkerContext, enqueue_job, task
+from polar.worker import (
+    JobContext,
+    PolarWorkerContext,
+    enqueue_job,
+    get_task,
+    interval,
+    task,
+)
 
 from .. import service
+from ..ingestion import queue_depth, webhook_overflow
+from ..payload import WebhookPayload
 from .utils import (
     get_event_issue,
     get_organization_and_repo,
@@ -101,14 +112,13 @@ async def repositories_added(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.InstallationRepositoriesAdded):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(
+            github.webhooks.InstallationRepositoriesAdded
+        )
         async with AsyncSessionLocal() as session:
             await repositories_changed(session, parsed)
 
@@ -118,14 +128,13 @@ async def repositories_removed(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.InstallationRepositoriesRemoved):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(
+            github.webhooks.InstallationRepositoriesRemoved
+        )
         async with AsyncSessionLocal() as session:
             await repositories_changed(session, parsed)
 
@@ -135,14 +144,11 @@ async def repositories_public(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.PublicEvent):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(github.webhooks.PublicEvent)
         async with AsyncSessionLocal() as session:
             await repository_updated(session, parsed)
 
@@ -152,14 +158,13 @@ async def repositories_renamed(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.RepositoryRenamed):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(
+            github.webhooks.RepositoryRenamed
+        )
         async with AsyncSessionLocal() as session:
             await repository_updated(session, parsed)
 
@@ -169,14 +174,13 @@ async def repositories_redited(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.RepositoryEdited):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(
+            github.webhooks.RepositoryEdited
+        )
         async with AsyncSessionLocal() as session:
             await repository_updated(session, parsed)
 
@@ -186,14 +190,13 @@ async def repositories_deleted(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.RepositoryDeleted):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(
+            github.webhooks.RepositoryDeleted
+        )
         async with AsyncSessionLocal() as session:
             await repository_deleted(session, parsed)
 
@@ -203,14 +206,13 @@ async def repositories_archived(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.RepositoryArchived):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(
+            github.webhooks.RepositoryArchived
+        )
         async with AsyncSessionLocal() as session:
             await repository_updated(session, parsed)
 
@@ -299,14 +301,11 @@ async def issue_opened(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.IssuesOpened):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(github.webhooks.IssuesOpened)
 
         async with AsyncSessionLocal() as session:
             issue = await handle_issue(session, scope, action, parsed)
@@ -321,14 +320,11 @@ async def issue_reopened(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.IssuesReopened):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(github.webhooks.IssuesReopened)
 
         async with AsyncSessionLocal() as session:
             issue = await handle_issue(session, scope, action, parsed)
@@ -343,14 +339,11 @@ async def issue_edited(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.IssuesEdited):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(github.webhooks.IssuesEdited)
 
         async with AsyncSessionLocal() as session:
             issue = await handle_issue(session, scope, action, parsed)
@@ -365,14 +358,11 @@ async def issue_closed(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.IssuesClosed):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(github.webhooks.IssuesClosed)
 
         async with AsyncSessionLocal() as session:
             await handle_issue(session, scope, action, parsed)
@@ -383,14 +373,11 @@ async def issue_deleted(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.IssuesDeleted):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(github.webhooks.IssuesDeleted)
 
         async with AsyncSessionLocal() as session:
             # Save last known version
@@ -409,14 +396,12 @@ async def issue_labeled(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.IssuesLabeled):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        # Only the labels are needed, skip validating the full event
+        parsed = WebhookPayload.of(scope, payload)
 
         async with AsyncSessionLocal() as session:
             await issue_labeled_async(session, scope, action, parsed)
@@ -427,14 +412,12 @@ async def issue_unlabeled(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.IssuesUnlabeled):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        # Only the labels are needed, skip validating the full event
+        parsed = WebhookPayload.of(scope, payload)
 
         async with AsyncSessionLocal() as session:
             await issue_labeled_async(session, scope, action, parsed)
@@ -479,24 +462,21 @@ async def issue_labeled_async(
     session: AsyncSession,
     scope: str,
     action: str,
-    event: Union[
-        github.webhooks.IssuesLabeled,
-        github.webhooks.IssuesUnlabeled,
-    ],
+    event: WebhookPayload,
 ) -> None:
-    issue = await service.github_issue.get_by_external_id(session, event.issue.id)
+    issue = await service.github_issue.get_by_external_id(session, event.issue_id)
     if not issue:
         log.warn(
-            "github.webhook.issue_labeled_async.not_found", external_id=event.issue.id
+            "github.webhook.issue_labeled_async.not_found", external_id=event.issue_id
         )
         return
 
-    issue = await service.github_issue.set_labels(session, issue, event.issue.labels)
+    issue = await service.github_issue.set_labels(session, issue, event.issue_labels)
 
-    log.debug("issue_labeled_async", label=event.label, issue_id=issue.id)
+    log.debug("issue_labeled_async", label=event.label_name, issue_id=issue.id)
 
     # Add/remove polar badge if label has changed
-    if event.label.name == "polar":
+    if event.label_name == "polar":
         await update_issue_embed(
             session, issue=issue, embed=issue.has_pledge_badge_label
         )
@@ -507,14 +487,12 @@ async def issue_assigned(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.IssuesAssigned):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        # Only the assignees are needed, skip validating the full event
+        parsed = WebhookPayload.of(scope, payload)
 
         async with AsyncSessionLocal() as session:
             await issue_assigned_async(session, scope, action, parsed)
@@ -525,14 +503,12 @@ async def issue_unassigned(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.IssuesUnassigned):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        # Only the assignees are needed, skip validating the full event
+        parsed = WebhookPayload.of(scope, payload)
 
         async with AsyncSessionLocal() as session:
             await issue_assigned_async(session, scope, action, parsed)
@@ -542,15 +518,12 @@ async def issue_assigned_async(
     session: AsyncSession,
     scope: str,
     action: str,
-    event: Union[
-        github.webhooks.IssuesAssigned,
-        github.webhooks.IssuesUnassigned,
-    ],
+    event: WebhookPayload,
 ) -> None:
-    issue = await service.github_issue.get_by_external_id(session, event.issue.id)
+    issue = await service.github_issue.get_by_external_id(session, event.issue_id)
     if not issue:
         log.warn(
-            "github.webhook.issue_assigned_async.not_found", external_id=event.issue.id
+            "github.webhook.issue_assigned_async.not_found", external_id=event.issue_id
         )
         return
 
@@ -559,9 +532,9 @@ async def issue_assigned_async(
         sql.Update(Issue)
         .where(Issue.id == issue.id)
         .values(
-            assignee=github.jsonify(event.issue.assignee),
-            assignees=github.jsonify(event.issue.assignees),
-            issue_modified_at=event.issue.updated_at,
+            assignee=github.jsonify(event.issue_assignee),
+            assignees=github.jsonify(event.issue_assignees),
+            issue_modified_at=event.issue_updated_at,
         )
     )
     await session.execute(stmt)
@@ -596,14 +569,13 @@ async def pull_request_opened(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.PullRequestOpened):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(
+            github.webhooks.PullRequestOpened
+        )
 
         async with AsyncSessionLocal() as session:
             await handle_pull_request(session, scope, action, parsed)
@@ -614,14 +586,13 @@ async def pull_request_edited(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.PullRequestEdited):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(
+            github.webhooks.PullRequestEdited
+        )
 
         async with AsyncSessionLocal() as session:
             await handle_pull_request(session, scope, action, parsed)
@@ -632,14 +603,13 @@ async def pull_request_closed(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.PullRequestClosed):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(
+            github.webhooks.PullRequestClosed
+        )
 
         async with AsyncSessionLocal() as session:
             await handle_pull_request(session, scope, action, parsed)
@@ -650,14 +620,13 @@ async def pull_request_reopened(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.PullRequestReopened):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(
+            github.webhooks.PullRequestReopened
+        )
 
         async with AsyncSessionLocal() as session:
             await handle_pull_request(session, scope, action, parsed)
@@ -668,14 +637,13 @@ async def pull_request_synchronize(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        parsed = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(parsed, github.webhooks.PullRequestSynchronize):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        parsed = WebhookPayload.of(scope, payload).event(
+            github.webhooks.PullRequestSynchronize
+        )
 
         async with AsyncSessionLocal() as session:
             await handle_pull_request(session, scope, action, parsed)
@@ -691,14 +659,13 @@ async def installation_created(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with ExecutionContext(is_during_installation=True):
-        event = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(event, github.webhooks.InstallationCreated):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        event = WebhookPayload.of(scope, payload).event(
+            github.webhooks.InstallationCreated
+        )
 
         async with AsyncSessionLocal() as session:
             await repositories_changed(session, event)
@@ -709,14 +676,13 @@ async def installation_delete(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        event = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(event, github.webhooks.InstallationDeleted):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        event = WebhookPayload.of(scope, payload).event(
+            github.webhooks.InstallationDeleted
+        )
 
         async with AsyncSessionLocal() as session:
             org = await service.github_organization.get_by_external_id(
@@ -732,14 +698,13 @@ async def installation_suspend(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        event = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(event, github.webhooks.InstallationSuspend):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        event = WebhookPayload.of(scope, payload).event(
+            github.webhooks.InstallationSuspend
+        )
 
         async with AsyncSessionLocal() as session:
             await service.github_organization.suspend(
@@ -756,14 +721,70 @@ async def installation_unsuspend(
     ctx: JobContext,
     scope: str,
     action: str,
-    payload: dict[str, Any],
+    payload: dict[str, Any] | WebhookPayload,
     polar_context: PolarWorkerContext,
 ) -> None:
     with polar_context.to_execution_context():
-        event = github.webhooks.parse_obj(scope, payload)
-        if not isinstance(event, github.webhooks.InstallationUnsuspend):
-            log.error("github.webhook.unexpected_type")
-            raise Exception("unexpected webhook payload")
+        event = WebhookPayload.of(scope, payload).event(
+            github.webhooks.InstallationUnsuspend
+        )
 
         async with AsyncSessionLocal() as session:
             await service.github_organization.unsuspend(session, event.installation.id)
+
+
+# ------------------------------------------------------------------------------
+# DISPATCH
+# ------------------------------------------------------------------------------
+
+
+@task("github.webhook.dispatch")
+async def dispatch(
+    ctx: JobContext,
+    scope: str,
+    delivery_id: str | None,
+    payload: bytes,
+    polar_context: PolarWorkerContext,
+) -> None:
+    """
+    Entrypoint for raw deliveries enqueued by the webhook endpoint.
+
+    Decodes the payload once and runs the handler for its event in this job.
+    """
+    body: dict[str, Any] = json.loads(payload)
+    action = body.get("action")
+    event_name = f"{scope}.{action}" if action else scope
+
+    handler = get_task(f"github.webhook.{event_name}")
+    if not handler:
+        log.info(
+            "github.webhook.dispatch.not_implemented",
+            event_name=event_name,
+            delivery_id=delivery_id,
+        )
+        return
+
+    log.info("github.webhook.dispatch", event_name=event_name, delivery_id=delivery_id)
+    await handler(
+        ctx,
+        scope,
+        action,
+        WebhookPayload(scope, body),
+        polar_context=polar_context,
+    )
+
+
+@interval(second={0, 15, 30, 45})
+async def drain_overflow(ctx: JobContext) -> None:
+    """
+    Move deliveries buffered by the webhook endpoint to the queue, as far as it
+    has room for them.
+    """
+    room = settings.GITHUB_WEBHOOK_MAX_QUEUE_DEPTH - await queue_depth.get()
+    drained = await webhook_overflow.drain(min(room, 1000))
+    if drained:
+        log.info(
+            "github.webhook.overflow.drained",
+            count=drained,
+            remaining=await webhook_overflow.size(),
+        )
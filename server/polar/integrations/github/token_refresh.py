@@ -0,0 +1,219 @@
+import asyncio
+import time
+from collections.abc import Sequence
+from dataclasses import dataclass
+from typing import Union
+from uuid import UUID
+
+import structlog
+from githubkit import GitHub, rest
+from pydantic import Field
+
+from polar.config import settings
+from polar.enums import Platforms
+from polar.models.user import OAuthAccount
+from polar.postgres import AsyncSession, sql
+from polar.redis import redis
+from polar.worker import enqueue_many
+
+log = structlog.get_logger()
+
+
+class RefreshAccessToken(rest.GitHubRestModel):
+    access_token: str = Field(default=...)  # The new access token
+    expires_in: int = Field(
+        default=...
+    )  # The number of seconds until access_token expires (will always be 28800)
+    refresh_token: Union[str, None] = Field(
+        default=...
+    )  # A new refres token (is only set if the app is using expiring refresh tokens)
+    refresh_token_expires_in: Union[int, None] = Field(default=...)
+    scope: str = Field(default=...)  # Always an empty string
+    token_type: str = Field(default=...)  # Always "bearer"
+
+
+@dataclass(frozen=True)
+class Tokens:
+    access_token: str
+    expires_at: int | None
+    refresh_token: str | None
+
+    @classmethod
+    def from_account(cls, oauth: OAuthAccount) -> "Tokens":
+        return cls(
+            access_token=oauth.access_token,
+            expires_at=oauth.expires_at,
+            refresh_token=oauth.refresh_token,
+        )
+
+    def apply(self, oauth: OAuthAccount) -> None:
+        oauth.access_token = self.access_token
+        oauth.expires_at = self.expires_at
+        oauth.refresh_token = self.refresh_token
+
+
+class TokenRefresher:
+    """
+    Refreshes GitHub user OAuth tokens, once per account however many requests and
+    jobs need it at the same time.
+
+    GitHub rotates the refresh token on every refresh, so concurrent refreshes of
+    an account race and all but one fail. Within a process, callers wait for the
+    refresh already in flight and share its result. Across processes, a Redis lock
+    per account serializes refreshes, and the account is read again once the lock
+    is held, so that a refresh another process just made isn't made twice.
+
+    Tokens expiring within refresh_before are refreshed inline, those expiring
+    within background_refresh_before are refreshed by a background job, scheduled
+    by a cron and whenever they're used, so that active users never wait for a
+    refresh. A job is scheduled at most once per schedule_lease per account.
+    """
+
+    def __init__(
+        self,
+        refresh_before: int = 5 * 60,
+        background_refresh_before: int = 2 * 60 * 60,
+        lock_timeout: float = 30.0,
+        schedule_lease: int = 10 * 60,
+    ) -> None:
+        self.refresh_before = refresh_before
+        self.background_refresh_before = background_refresh_before
+        self.lock_timeout = lock_timeout
+        self.schedule_lease = schedule_lease
+        self._in_flight: dict[UUID, asyncio.Future[Tokens | None]] = {}
+
+    def lock_key(self, oauth_account_id: UUID) -> str:
+        return f"github:oauth_refresh:{oauth_account_id}"
+
+    def schedule_key(self, oauth_account_id: UUID) -> str:
+        return f"github:oauth_refresh:scheduled:{oauth_account_id}"
+
+    async def schedule(self, oauth_account_ids: Sequence[UUID]) -> int:
+        """
+        Enqueue background refreshes of the accounts, skipping the ones scheduled
+        within the lease, returns how many were enqueued.
+        """
+        if not oauth_account_ids:
+            return 0
+
+        async with redis.pipeline(transaction=False) as pipe:
+            for oauth_account_id in oauth_account_ids:
+                pipe.set(
+                    self.schedule_key(oauth_account_id),
+                    1,
+                    nx=True,
+                    ex=self.schedule_lease,
+                )
+            acquired = await pipe.execute()
+
+        scheduled = [(i,) for i, ok in zip(oauth_account_ids, acquired) if ok]
+        if scheduled:
+            await enqueue_many("github.user.refresh_token", scheduled)
+        return len(scheduled)
+
+    async def list_expiring(self, session: AsyncSession) -> Sequence[UUID]:
+        """
+        Accounts with tokens to refresh in the background. Tokens that expired
+        already are left to be refreshed inline, as their users may be gone.
+        """
+        now = int(time.time())
+        stmt = sql.select(OAuthAccount.id).where(
+            OAuthAccount.platform == Platforms.github,
+            OAuthAccount.refresh_token.is_not(None),
+            OAuthAccount.expires_at > now,
+            OAuthAccount.expires_at <= now + self.background_refresh_before,
+        )
+        res = await session.execute(stmt)
+        return res.scalars().all()
+
+    def expires_within(self, oauth: OAuthAccount, seconds: int) -> bool:
+        return bool(
+            oauth.expires_at
+            and oauth.refresh_token
+            and oauth.expires_at <= time.time() + seconds
+        )
+
+    async def refresh(
+        self, session: AsyncSession, oauth: OAuthAccount, within: int | None = None
+    ) -> None:
+        """
+        Refresh the tokens of oauth if they expire within the given number of
+        seconds, refresh_before by default, and update oauth with the new ones.
+        """
+        within = self.refresh_before if within is None else within
+
+        in_flight = self._in_flight.get(oauth.id)
+        if in_flight is not None:
+            tokens = await asyncio.shield(in_flight)
+        else:
+            in_flight = asyncio.get_running_loop().create_future()
+            # Don't warn about an exception no one else waited for
+            in_flight.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._in_flight[oauth.id] = in_flight
+            try:
+                tokens = await self._refresh_locked(session, oauth.id, within)
+                in_flight.set_result(tokens)
+            except Exception as e:
+                in_flight.set_exception(e)
+                raise
+            except BaseException:
+                in_flight.cancel()
+                raise
+            finally:
+                del self._in_flight[oauth.id]
+
+        if tokens is not None:
+            tokens.apply(oauth)
+
+    async def _refresh_locked(
+        self, session: AsyncSession, oauth_account_id: UUID, within: int
+    ) -> Tokens | None:
+        async with redis.lock(
+            self.lock_key(oauth_account_id),
+            timeout=self.lock_timeout,
+            blocking_timeout=self.lock_timeout,
+        ):
+            # Another process may have refreshed them while we waited for the lock
+            oauth = await session.get(
+                OAuthAccount, oauth_account_id, populate_existing=True
+            )
+            if oauth is None:
+                return None
+            if not self.expires_within(oauth, within):
+                return Tokens.from_account(oauth)
+
+            tokens = await self._request(oauth)
+            if tokens is None:
+                log.error("github.auth.refresh.failed", user=oauth.user_id)
+                return None
+
+            tokens.apply(oauth)
+            await oauth.save(session)
+            log.info("github.auth.refresh.succeeded", user=oauth.user_id)
+            return tokens
+
+    async def _request(self, oauth: OAuthAccount) -> Tokens | None:
+        refresh = await GitHub().arequest(
+            method="POST",
+            url="https://github.com/login/oauth/access_token",
+            params={
+                "client_id": settings.GITHUB_CLIENT_ID,
+                "client_secret": settings.GITHUB_CLIENT_SECRET,
+                "refresh_token": oauth.refresh_token,
+                "grant_type": "refresh_token",
+            },
+            headers={"Accept": "application/json"},
+            response_model=RefreshAccessToken,
+        )
+        if not refresh:
+            return None
+
+        r = refresh.parsed_data
+        return Tokens(
+            access_token=r.access_token,
+            expires_at=int(time.time()) + r.expires_in,
+            refresh_token=r.refresh_token or oauth.refresh_token,
+        )
+
+
+token_refresher = TokenRefresher()
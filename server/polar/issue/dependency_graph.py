@@ -0,0 +1,287 @@
+from collections.abc import Sequence
+from uuid import UUID
+
+import structlog
+from sqlalchemy import literal, true, union_all
+from sqlalchemy.orm import InstrumentedAttribute, aliased, joinedload
+
+from polar.models.issue import Issue
+from polar.models.issue_dependency import IssueDependency
+from polar.models.issue_dependency_closure import IssueDependencyClosure
+from polar.postgres import AsyncSession, sql
+
+log = structlog.get_logger()
+
+_COLUMNS = [
+    "dependent_issue_id",
+    "dependency_issue_id",
+    "depth",
+    "dependent_repository_id",
+    "dependency_repository_id",
+]
+
+# Key of the transaction-level advisory lock serializing changes to the closure
+_LOCK_KEY = 0x15D3C105
+
+
+class IssueDependencyGraph:
+    """
+    Transitive issue dependencies, kept in the issue_dependency_closure table.
+
+    The closure has a row for every pair of issues connected by a chain of
+    dependencies, with the length of the shortest one, so that all transitive
+    dependencies or dependents of repositories are a single indexed query.
+
+    Adding the dependency of A on B connects A, and everything depending on A, to
+    B and everything B depends on, in a single statement. Issues may depend on
+    each other in cycles, but an issue never depends on itself in the closure.
+
+    That statement reads the closure as it is, so that a concurrent transaction
+    adding B's dependency on C would leave A's dependency on C out. Changes to the
+    closure are therefore serialized by an advisory lock, held until commit.
+    """
+
+    async def add_dependencies(
+        self,
+        session: AsyncSession,
+        dependencies: Sequence[IssueDependency],
+        autocommit: bool = True,
+    ) -> None:
+        edges = [
+            (d.dependent_issue_id, d.dependency_issue_id)
+            for d in dependencies
+            if d.dependent_issue_id != d.dependency_issue_id
+        ]
+        if edges:
+            await self._lock(session)
+
+        for dependent_id, dependency_id in edges:
+            if await self.creates_cycle(session, dependent_id, dependency_id):
+                log.warning(
+                    "issue.dependency_graph.cycle",
+                    dependent_issue_id=dependent_id,
+                    dependency_issue_id=dependency_id,
+                )
+            await session.execute(self._add_statement(dependent_id, dependency_id))
+
+        if autocommit:
+            await session.commit()
+
+    async def _lock(self, session: AsyncSession) -> None:
+        # Statements run after the lock is granted see the rows committed by the
+        # transaction that held it
+        await session.execute(sql.select(sql.func.pg_advisory_xact_lock(_LOCK_KEY)))
+
+    def _add_statement(
+        self, dependent_issue_id: UUID, dependency_issue_id: UUID
+    ) -> sql.Insert:
+        c = IssueDependencyClosure
+
+        # The dependent issue and everything depending on it
+        dependents = union_all(
+            sql.select(
+                Issue.id.label("issue_id"),
+                literal(0).label("depth"),
+                Issue.repository_id.label("repository_id"),
+            ).where(Issue.id == dependent_issue_id),
+            sql.select(c.dependent_issue_id, c.depth, c.dependent_repository_id).where(
+                c.dependency_issue_id == dependent_issue_id
+            ),
+        ).subquery("dependents")
+
+        # The dependency issue and everything it depends on
+        dependencies = union_all(
+            sql.select(
+                Issue.id.label("issue_id"),
+                literal(0).label("depth"),
+                Issue.repository_id.label("repository_id"),
+            ).where(Issue.id == dependency_issue_id),
+            sql.select(
+                c.dependency_issue_id, c.depth, c.dependency_repository_id
+            ).where(c.dependent_issue_id == dependency_issue_id),
+        ).subquery("dependencies")
+
+        paths = (
+            sql.select(
+                dependents.c.issue_id,
+                dependencies.c.issue_id,
+                dependents.c.depth + dependencies.c.depth + 1,
+                dependents.c.repository_id,
+                dependencies.c.repository_id,
+            )
+            .select_from(dependents)
+            .join(dependencies, true())
+            .where(dependents.c.issue_id != dependencies.c.issue_id)
+        )
+
+        stmt = sql.insert(c).from_select(_COLUMNS, paths)
+        return stmt.on_conflict_do_update(
+            index_elements=[c.dependent_issue_id, c.dependency_issue_id],
+            set_={"depth": sql.func.least(c.depth, stmt.excluded.depth)},
+        )
+
+    async def creates_cycle(
+        self, session: AsyncSession, dependent_issue_id: UUID, dependency_issue_id: UUID
+    ) -> bool:
+        """
+        Whether a dependency of dependent on dependency closes a cycle, i.e.
+        dependency already depends on dependent.
+        """
+        if dependent_issue_id == dependency_issue_id:
+            return True
+
+        stmt = sql.select(IssueDependencyClosure.depth).where(
+            IssueDependencyClosure.dependent_issue_id == dependency_issue_id,
+            IssueDependencyClosure.dependency_issue_id == dependent_issue_id,
+        )
+        res = await session.execute(stmt)
+        return res.scalar_one_or_none() is not None
+
+    async def list_dependencies_for_repositories(
+        self,
+        session: AsyncSession,
+        repository_ids: Sequence[UUID],
+        max_depth: int | None = None,
+    ) -> Sequence[IssueDependencyClosure]:
+        """
+        Everything issues of the repositories depend on, nearest first.
+        """
+        return await self._list(
+            session,
+            IssueDependencyClosure.dependent_repository_id,
+            repository_ids,
+            max_depth,
+        )
+
+    async def list_dependents_for_repositories(
+        self,
+        session: AsyncSession,
+        repository_ids: Sequence[UUID],
+        max_depth: int | None = None,
+    ) -> Sequence[IssueDependencyClosure]:
+        """
+        Everything depending on issues of the repositories, nearest first.
+        """
+        return await self._list(
+            session,
+            IssueDependencyClosure.dependency_repository_id,
+            repository_ids,
+            max_depth,
+        )
+
+    async def _list(
+        self,
+        session: AsyncSession,
+        repository_column: InstrumentedAttribute[UUID],
+        repository_ids: Sequence[UUID],
+        max_depth: int | None,
+    ) -> Sequence[IssueDependencyClosure]:
+        stmt = (
+            sql.select(IssueDependencyClosure)
+            .where(repository_column.in_(list(set(repository_ids))))
+            .options(
+                joinedload(IssueDependencyClosure.dependent_issue),
+                joinedload(IssueDependencyClosure.dependency_issue),
+            )
+            .order_by(IssueDependencyClosure.depth)
+        )
+        if max_depth is not None:
+            stmt = stmt.where(IssueDependencyClosure.depth <= max_depth)
+
+        res = await session.execute(stmt)
+        return res.scalars().unique().all()
+
+    async def list_cyclic_issues(
+        self, session: AsyncSession, repository_ids: Sequence[UUID]
+    ) -> Sequence[UUID]:
+        """
+        Issues of the repositories that transitively depend on themselves.
+        """
+        forward = IssueDependencyClosure
+        backward = aliased(IssueDependencyClosure)
+        stmt = (
+            sql.select(forward.dependent_issue_id)
+            .join(
+                backward,
+                (backward.dependent_issue_id == forward.dependency_issue_id)
+                & (backward.dependency_issue_id == forward.dependent_issue_id),
+            )
+            .where(forward.dependent_repository_id.in_(list(set(repository_ids))))
+            .distinct()
+        )
+        res = await session.execute(stmt)
+        return res.scalars().all()
+
+    async def rebuild(self, session: AsyncSession) -> int:
+        """
+        Rebuild the closure from scratch, a level of the dependency chains at a
+        time, returns the number of rows. Every level only extends the rows of the
+        previous one, and pairs already connected by a shorter chain are skipped,
+        so it ends, cycles included.
+        """
+        c = IssueDependencyClosure
+        dependent = aliased(Issue)
+        dependency = aliased(Issue)
+
+        await self._lock(session)
+        await session.execute(sql.delete(c))
+        res = await session.execute(
+            sql.insert(c).from_select(
+                _COLUMNS,
+                sql.select(
+                    IssueDependency.dependent_issue_id,
+                    IssueDependency.dependency_issue_id,
+                    literal(1),
+                    dependent.repository_id,
+                    dependency.repository_id,
+                )
+                .join(dependent, dependent.id == IssueDependency.dependent_issue_id)
+                .join(dependency, dependency.id == IssueDependency.dependency_issue_id)
+                .where(
+                    IssueDependency.dependent_issue_id
+                    != IssueDependency.dependency_issue_id
+                ),
+            )
+        )
+        total: int = res.rowcount
+
+        depth = 1
+        while True:
+            res = await session.execute(
+                sql.insert(c)
+                .from_select(
+                    _COLUMNS,
+                    sql.select(
+                        c.dependent_issue_id,
+                        IssueDependency.dependency_issue_id,
+                        literal(depth + 1),
+                        c.dependent_repository_id,
+                        dependency.repository_id,
+                    )
+                    .select_from(c)
+                    .join(
+                        IssueDependency,
+                        IssueDependency.dependent_issue_id == c.dependency_issue_id,
+                    )
+                    .join(
+                        dependency,
+                        dependency.id == IssueDependency.dependency_issue_id,
+                    )
+                    .where(
+                        c.depth == depth,
+                        c.dependent_issue_id != IssueDependency.dependency_issue_id,
+                    ),
+                )
+                .on_conflict_do_nothing()
+            )
+            if not res.rowcount:
+                break
+            total += res.rowcount
+            depth += 1
+
+        await session.commit()
+        log.info("issue.dependency_graph.rebuilt", rows=total, max_depth=depth)
+        return total
+
+
+issue_dependency_graph = IssueDependencyGraph()
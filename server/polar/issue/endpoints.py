@@ -1,3 +1,4 @@
+from datetime import timedelta
 from typing import List, Sequence
 
 from fastapi import APIRouter, Depends, HTTPException
@@ -12,11 +13,14 @@ from polar.integrations.github.service.organization import (
     github_organization as github_organization_service,
 )
 from polar.kit.schemas import Schema
+from polar.kit.utils import utc_now
 from polar.models import Issue
 from polar.organization.schemas import OrganizationPublicRead
 from polar.organization.service import organization as organization_service
 from polar.postgres import AsyncSession, get_db_session
+from polar.redis import redis
 from polar.repository.schemas import RepositoryRead
+from polar.worker import enqueue_job
 
 from .schemas import (
     IssueRead,
@@ -35,6 +39,26 @@ class IssueResources(Schema):
     repository: RepositoryRead | None
 
 
+# How long the public page serves a stored issue before refreshing it from GitHub
+EXTERNAL_ISSUE_MAX_AGE = timedelta(minutes=10)
+
+
+async def refresh_external_issue_if_stale(issue: Issue) -> None:
+    """
+    Refresh a stale issue in the background. A lease per issue lets a single page
+    view enqueue the refresh, and the others serve the stored issue meanwhile.
+    """
+    fetched_at = issue.github_issue_fetched_at or issue.created_at
+    if utc_now() - fetched_at < EXTERNAL_ISSUE_MAX_AGE:
+        return
+
+    lease = f"issue:external_refresh:{issue.id}"
+    if not await redis.set(lease, 1, nx=True, ex=EXTERNAL_ISSUE_MAX_AGE):
+        return
+
+    await enqueue_job("github.issue.sync.external", issue.id)
+
+
 @router.get(
     "/{platform}/{org_name}/{repo_name}/issues/{number}", response_model=IssueResources
 )
@@ -47,22 +71,31 @@ async def get_or_sync_external(
     session: AsyncSession = Depends(get_db_session),
 ) -> IssueResources:
     includes = include.split(",")
-    client = get_polar_client()
 
-    try:
-        res = await github_organization_service.sync_external_org_with_repo_and_issue(
-            session,
-            client=client,
-            org_name=org_name,
-            repo_name=repo_name,
-            issue_number=number,
-        )
-        org, repo, issue = res
-    except ResourceNotFound:
-        raise HTTPException(
-            status_code=404,
-            detail="Organization, repo and issue combination not found",
-        )
+    stored = await github_organization_service.get_external_org_with_repo_and_issue(
+        session, org_name=org_name, repo_name=repo_name, issue_number=number
+    )
+    if stored:
+        org, repo, issue = stored
+        await refresh_external_issue_if_stale(issue)
+    else:
+        # Only the first view of an issue waits for GitHub
+        try:
+            res = (
+                await github_organization_service.sync_external_org_with_repo_and_issue(
+                    session,
+                    client=get_polar_client(),
+                    org_name=org_name,
+                    repo_name=repo_name,
+                    issue_number=number,
+                )
+            )
+            org, repo, issue = res
+        except ResourceNotFound:
+            raise HTTPException(
+                status_code=404,
+                detail="Organization, repo and issue combination not found",
+            )
 
     included_org = None
     if "organization" in includes:
@@ -163,27 +163,30 @@ class IssueCreate(IssueAndPullRequestBase):
             organization_id=organization_id,
             repository_id=repository_id,
         )
+        ret.set_derived_fields()
+        return ret
 
-        ret.has_pledge_badge_label = Issue.contains_pledge_badge_label(ret.labels)
+    def set_derived_fields(self) -> None:
+        """
+        Set the fields derived from the normalized GitHub issue.
+        """
+        self.has_pledge_badge_label = Issue.contains_pledge_badge_label(self.labels)
 
-        if ret.body:
-            ret.pledge_badge_currently_embedded = GithubBadge.badge_is_embedded(
-                ret.body
+        if self.body:
+            self.pledge_badge_currently_embedded = GithubBadge.badge_is_embedded(
+                self.body
             )
 
+        reactions = self.reactions or {}
         # excluding: confused, minus_one
-        ret.positive_reactions_count = (
-            data.reactions.plus_one
-            + data.reactions.laugh
-            + data.reactions.heart
-            + data.reactions.hooray
-            + data.reactions.eyes
-            + data.reactions.rocket
+        self.positive_reactions_count = sum(
+            reactions.get(reaction, 0)
+            for reaction in ("plus_one", "laugh", "heart", "hooray", "eyes", "rocket")
         )
 
-        ret.total_engagement_count = data.reactions.total_count + data.comments
-
-        return ret
+        self.total_engagement_count = reactions.get("total_count", 0) + (
+            self.comments or 0
+        )
 
 
 class IssueUpdate(IssueCreate):
@@ -337,6 +340,31 @@ class IssueReferenceRead(Schema):
         raise Exception("unable to convert IssueReference to IssueReferenceRead")
 
 
+class IssueReferenceCreate(Schema):
+    issue_id: UUID
+    reference_type: ReferenceType
+    external_id: str
+    pull_request_id: UUID | None = None
+    external_source: JSONAny = None
+
+    @classmethod
+    def from_model(cls, m: IssueReference) -> Self:
+        return cls(
+            issue_id=m.issue_id,
+            reference_type=m.reference_type,
+            external_id=m.external_id,
+            pull_request_id=m.pull_request_id,
+            external_source=m.external_source,
+        )
+
+
+class IssueDependencyCreate(Schema):
+    organization_id: UUID
+    repository_id: UUID
+    dependent_issue_id: UUID
+    dependency_issue_id: UUID
+
+
 class IssueDependencyRead(Schema):
     dependent_issue_id: UUID
     dependency_issue_id: UUID
@@ -15,17 +15,22 @@ from sqlalchemy import (
     nullslast,
     or_,
 )
-from sqlalchemy.orm import InstrumentedAttribute, contains_eager, joinedload
+from sqlalchemy.orm import (
+    InstrumentedAttribute,
+    contains_eager,
+    joinedload,
+    selectinload,
+)
+from sqlalchemy.sql import Select
 
 from polar.dashboard.schemas import IssueListType, IssueSortBy, IssueStatus
 from polar.enums import Platforms
 from polar.kit.services import ResourceService
 from polar.models.issue import Issue
-from polar.models.issue_dependency import IssueDependency
+from polar.models.issue_dependency_closure import IssueDependencyClosure
 from polar.models.issue_reference import IssueReference
 from polar.models.organization import Organization
 from polar.models.pledge import Pledge
-from polar.models.repository import Repository
 from polar.models.user import User
 from polar.postgres import AsyncSession, sql
 
@@ -108,36 +113,52 @@ class IssueService(ResourceService[Issue, IssueCreate, IssueUpdate]):
         limit: int | None = None,
         include_statuses: list[IssueStatus] | None = None,
         have_polar_badge: bool | None = None,  # If issue has the polar badge or not
+        # Narrows an issues list to one org, so that it can use the org indexes
+        organization_id: UUID | None = None,
     ) -> Tuple[Sequence[Issue], int]:  # (issues, total_issue_count)
-        statement = (
-            sql.select(
-                Issue,
-                sql.func.count().over().label("total_count"),
-            )
-            .join(
-                Issue.pledges,
-                isouter=True,
-            )
-            .join(
-                Pledge.by_organization,
-                isouter=True,
-            )
-            .join(
-                Pledge.user,
-                isouter=True,
-            )
-        )
+        """
+        Issue lists only read the issues table, relying on the columns that the
+        issue, pledge and reference hooks keep up to date (pledged_amount_sum,
+        issue_has_*_relationship, ...). Pledges and references of the page are
+        loaded separately.
+
+        Dependency lists are filtered and sorted on the pledges of the org or user,
+        and are still joined with them. They include the issues that issues of the
+        repositories depend on through other issues.
+        """
+        statement = sql.select(Issue)
 
         if issue_list_type == IssueListType.issues:
             statement = statement.where(Issue.repository_id.in_(repository_ids))
+            if organization_id:
+                statement = statement.where(Issue.organization_id == organization_id)
         elif issue_list_type == IssueListType.dependencies:
             if not pledged_by_org and not pledged_by_user:
                 raise ValueError("no pledge_by criteria specified")
 
-            statement = statement.join(
-                IssueDependency,
-                IssueDependency.dependency_issue_id == Issue.id,
-                isouter=True,
+            statement = (
+                statement.join(
+                    Issue.pledges,
+                    isouter=True,
+                )
+                .join(
+                    Pledge.by_organization,
+                    isouter=True,
+                )
+                .join(
+                    Pledge.user,
+                    isouter=True,
+                )
+            )
+
+            # Not joined, so that pledges aren't counted once per dependent issue
+            is_dependency = (
+                sql.select(IssueDependencyClosure.dependency_issue_id)
+                .where(
+                    IssueDependencyClosure.dependency_issue_id == Issue.id,
+                    IssueDependencyClosure.dependent_repository_id.in_(repository_ids),
+                )
+                .exists()
             )
 
             pledge_criterias: list[ColumnElement[bool]] = []
@@ -149,7 +170,7 @@ class IssueService(ResourceService[Issue, IssueCreate, IssueUpdate]):
 
             statement = statement.where(
                 or_(
-                    IssueDependency.repository_id.in_(repository_ids),
+                    is_dependency,
                     # Pledge.id.is_(None),
                     or_(*pledge_criterias),
                 ),
@@ -158,12 +179,17 @@ class IssueService(ResourceService[Issue, IssueCreate, IssueUpdate]):
         else:
             raise ValueError(f"Unknown issue list type: {issue_list_type}")
 
+        joined_pledges = issue_list_type == IssueListType.dependencies
+
         # pledge filter
         if have_pledge is not None:
-            if have_pledge:
-                statement = statement.where(Pledge.id.is_not(None))
+            if joined_pledges:
+                has_pledge: ColumnElement[bool] = Pledge.id.is_not(None)
             else:
-                statement = statement.where(Pledge.id.is_(None))
+                has_pledge = (
+                    sql.select(Pledge.id).where(Pledge.issue_id == Issue.id).exists()
+                )
+            statement = statement.where(has_pledge if have_pledge else ~has_pledge)
 
         if have_polar_badge is not None:
             statement = statement.where(
@@ -276,11 +302,16 @@ class IssueService(ResourceService[Issue, IssueCreate, IssueUpdate]):
                 desc(Issue.pledged_amount_sum),
                 desc(Issue.issue_modified_at),
             )
-        elif sort_by == IssueSortBy.dependencies_default:
+        elif sort_by == IssueSortBy.dependencies_default and joined_pledges:
             statement = statement.order_by(
                 nullslast(desc(sql.func.sum(Pledge.amount))),
                 desc(Issue.issue_modified_at),
             )
+        elif sort_by == IssueSortBy.dependencies_default:
+            statement = statement.order_by(
+                desc(Issue.pledged_amount_sum),
+                desc(Issue.issue_modified_at),
+            )
         elif sort_by == IssueSortBy.recently_updated:
             statement = statement.order_by(desc(Issue.issue_modified_at))
         elif sort_by == IssueSortBy.least_recently_updated:
@@ -298,6 +329,20 @@ class IssueService(ResourceService[Issue, IssueCreate, IssueUpdate]):
         else:
             raise Exception("unknown sort_by")
 
+        if not joined_pledges:
+            return await self._list_issues_page(
+                session,
+                statement,
+                load_references=load_references,
+                load_pledges=load_pledges,
+                offset=offset,
+                limit=limit,
+            )
+
+        statement = statement.add_columns(
+            sql.func.count().over().label("total_count"),
+        )
+
         if load_references:
             statement = statement.options(
                 joinedload(Issue.references).joinedload(IssueReference.pull_request)
@@ -332,6 +377,46 @@ class IssueService(ResourceService[Issue, IssueCreate, IssueUpdate]):
 
         return (issues, total_count)
 
+    async def _list_issues_page(
+        self,
+        session: AsyncSession,
+        statement: Select[Tuple[Issue]],
+        load_references: bool,
+        load_pledges: bool,
+        offset: int,
+        limit: int | None,
+    ) -> Tuple[Sequence[Issue], int]:
+        count_statement = statement.with_only_columns(
+            sql.func.count(Issue.id), maintain_column_froms=True
+        ).order_by(None)
+
+        if load_references:
+            statement = statement.options(
+                selectinload(Issue.references).joinedload(IssueReference.pull_request)
+            )
+
+        if load_pledges:
+            statement = statement.options(
+                selectinload(Issue.pledges).options(
+                    joinedload(Pledge.user),
+                    joinedload(Pledge.by_organization),
+                )
+            )
+
+        if limit:
+            statement = statement.limit(limit).offset(offset)
+
+        res = await session.execute(statement)
+        issues = res.scalars().unique().all()
+
+        # Skip counting when this is the last page, and it's not past the end
+        if not limit or 0 < len(issues) < limit or (offset == 0 and not issues):
+            total_count = offset + len(issues)
+        else:
+            total_count = (await session.execute(count_statement)).scalar_one()
+
+        return (issues, total_count)
+
     async def list_issue_references(
         self,
         session: AsyncSession,
@@ -362,28 +447,6 @@ class IssueService(ResourceService[Issue, IssueCreate, IssueUpdate]):
         refs = res.scalars().unique().all()
         return refs
 
-    async def list_issue_dependencies_for_repositories(
-        self,
-        session: AsyncSession,
-        repos: Sequence[Repository],
-    ) -> Sequence[IssueDependency]:
-        """
-        Returns a dict of issue_id -> list of issues dependent on that issue
-        """
-        stmt = (
-            sql.select(IssueDependency)
-            .where(
-                IssueDependency.repository_id.in_(list(set([r.id for r in repos]))),
-            )
-            .options(
-                joinedload(IssueDependency.dependent_issue),
-                joinedload(IssueDependency.dependency_issue),
-            )
-        )
-        res = await session.execute(stmt)
-        deps = res.scalars().unique().all()
-        return deps
-
     async def update_issue_reference_state(
         self,
         session: AsyncSession,
@@ -141,6 +141,10 @@ class ActiveRecordMixin:
         )
         res = await session.execute(orm_stmt)
         instances = res.scalars().all()
+        for instance in instances:
+            # xmax is 0 for rows that were inserted, and set for updated ones
+            instance.was_created = instance.xmax == 0
+            instance.was_updated = not instance.was_created
         if autocommit:
             await session.commit()
         return instances
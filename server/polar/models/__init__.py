@@ -11,6 +11,7 @@ from .user import OAuthAccount, User
 from .user_organization import UserOrganization
 from .issue_reference import IssueReference
 from .issue_dependency import IssueDependency
+from .issue_dependency_closure import IssueDependencyClosure
 from .notification import Notification
 from .user_organization_settings import UserOrganizationSettings
 from .user_notification import UserNotification
@@ -33,6 +34,7 @@ __all__ = [
     "PledgeTransaction",
     "IssueReference",
     "IssueDependency",
+    "IssueDependencyClosure",
     "Invite",
     "Notification",
 ]
@@ -178,6 +178,19 @@ class Issue(IssueFields, RecordModel):
             "idx_issues_positive_total_engagement_count",
             "total_engagement_count",
         ),
+        # Dashboard issue lists, in their default and newest sort orders
+        Index(
+            "idx_issues_organization_id_default_sort",
+            "organization_id",
+            "pledged_amount_sum",
+            "total_engagement_count",
+            "issue_modified_at",
+        ),
+        Index(
+            "idx_issues_organization_id_issue_created_at",
+            "organization_id",
+            "issue_created_at",
+        ),
     )
 
     pledge_badge_embedded_at: Mapped[datetime | None] = mapped_column(
@@ -209,6 +222,12 @@ class Issue(IssueFields, RecordModel):
     github_timeline_fetched_at: Mapped[datetime | None] = mapped_column(
         TIMESTAMP(timezone=True), nullable=True
     )
+    # Number of timeline events processed and the last of them, see
+    # sync_issue_references
+    github_timeline_offset: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    github_timeline_last_event_id: Mapped[str | None] = mapped_column(
+        String, nullable=True
+    )
 
     @declared_attr
     def references(cls) -> "Mapped[list[IssueReference]]":
@@ -0,0 +1,69 @@
+from uuid import UUID
+
+from sqlalchemy import ForeignKey, Index, Integer
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+
+from polar.kit.db.models import Model
+from polar.kit.extensions.sqlalchemy import PostgresUUID
+from polar.models.issue import Issue
+
+
+class IssueDependencyClosure(Model):
+    """
+    Every issue an issue depends on, directly or through other issues, with the
+    length of the shortest dependency chain between them.
+
+    Derived from issue_dependencies, see polar.issue.dependency_graph.
+    """
+
+    __tablename__ = "issue_dependency_closure"
+
+    dependent_issue_id: Mapped[UUID] = mapped_column(
+        PostgresUUID,
+        ForeignKey("issues.id"),
+        primary_key=True,
+        nullable=False,
+    )
+
+    dependency_issue_id: Mapped[UUID] = mapped_column(
+        PostgresUUID,
+        ForeignKey("issues.id"),
+        primary_key=True,
+        nullable=False,
+    )
+
+    # 1 for direct dependencies
+    depth: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    dependent_repository_id: Mapped[UUID] = mapped_column(
+        PostgresUUID, ForeignKey("repositories.id"), nullable=False
+    )
+
+    dependency_repository_id: Mapped[UUID] = mapped_column(
+        PostgresUUID, ForeignKey("repositories.id"), nullable=False
+    )
+
+    dependent_issue: "Mapped[Issue]" = relationship(
+        "Issue", uselist=False, lazy="raise", foreign_keys=[dependent_issue_id]
+    )
+
+    dependency_issue: "Mapped[Issue]" = relationship(
+        "Issue", uselist=False, lazy="raise", foreign_keys=[dependency_issue_id]
+    )
+
+    __table_args__ = (
+        Index(
+            "idx_issue_dependency_closure_dependency_issue_id",
+            "dependency_issue_id",
+        ),
+        Index(
+            "idx_issue_dependency_closure_dependent_repository_id_depth",
+            "dependent_repository_id",
+            "depth",
+        ),
+        Index(
+            "idx_issue_dependency_closure_dependency_repository_id_depth",
+            "dependency_repository_id",
+            "depth",
+        ),
+    )
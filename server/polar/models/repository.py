@@ -6,6 +6,7 @@ from citext import CIText
 
 from sqlalchemy import (
     TIMESTAMP,
+    BigInteger,
     Boolean,
     ForeignKey,
     Integer,
@@ -75,6 +76,10 @@ class Repository(RecordModel):
         TIMESTAMP(timezone=True), nullable=True
     )
 
+    # Cursor over the repository's issue events, see sync_repo_references
+    github_events_etag: Mapped[str | None] = mapped_column(String, nullable=True)
+    github_events_last_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+
     # Automatically badge all new issues
     pledge_badge_auto_embed: Mapped[bool] = mapped_column(
         Boolean, nullable=False, default=False
@@ -10,6 +10,7 @@ from sqlalchemy.orm import (
     contains_eager,
 )
 
+from polar.auth.cache import principal_cache
 from polar.enums import Platforms
 from polar.exceptions import ResourceNotFound
 from polar.issue.schemas import IssuePublicRead
@@ -258,6 +259,7 @@ class OrganizationService(
             session.add(relation)
             await nested.commit()
             await session.commit()
+            await principal_cache.invalidate_user(user.id)
             log.info(
                 "organization.add_user.created",
                 user_id=user.id,
@@ -287,6 +289,7 @@ class OrganizationService(
         )
         await session.execute(stmt)
         await session.commit()
+        await principal_cache.invalidate_user(user.id)
 
     async def get_badge_settings(
         self,
@@ -1,3 +1,5 @@
+from functools import partial
+
 import structlog
 from polar.issue.hooks import IssueHook, issue_upserted
 from polar.organization.hooks import OrganizationHook, organization_upserted
@@ -8,10 +10,14 @@ from polar.repository.hooks import (
     repository_issue_synced,
     repository_issues_sync_completed,
 )
-from polar.eventstream.service import publish, publish_members
+from polar.eventstream.service import Throttle, publish, publish_members
 
 log = structlog.get_logger()
 
+# A backfill syncs issues far faster than progress needs to be shown, send the
+# latest progress of a repository at most once per second.
+issue_synced_throttle = Throttle(interval=1.0)
+
 
 async def on_issue_synced(hook: SyncedHook) -> None:
     log.info(
@@ -20,18 +26,22 @@ async def on_issue_synced(hook: SyncedHook) -> None:
         title=hook.record.title,
         synced=hook.synced,
     )
-    await publish(
-        "issue.synced",
-        {
-            "issue": {
-                "id": hook.record.id,
-                "title": hook.record.title,
+    await issue_synced_throttle.send(
+        str(hook.repository.id),
+        partial(
+            publish,
+            "issue.synced",
+            {
+                "issue": {
+                    "id": hook.record.id,
+                    "title": hook.record.title,
+                },
+                "open_issues": hook.repository.open_issues or 0,
+                "synced_issues": hook.synced,
+                "repository_id": hook.repository.id,
             },
-            "open_issues": hook.repository.open_issues or 0,
-            "synced_issues": hook.synced,
-            "repository_id": hook.repository.id,
-        },
-        organization_id=hook.organization.id,
+            organization_id=hook.organization.id,
+        ),
     )
 
 
@@ -42,6 +52,7 @@ async def on_issue_sync_completed(
     hook: SyncCompletedHook,
 ) -> None:
     log.info("issue.sync.completed", repository=hook.repository.id, synced=hook.synced)
+    issue_synced_throttle.reset(str(hook.repository.id))
     await publish(
         "issue.sync.completed",
         {
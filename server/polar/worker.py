@@ -1,19 +1,33 @@
+import asyncio
 import types
 import functools
-from datetime import datetime
-from typing import Any, TypedDict, ParamSpec, TypeVar, Awaitable, Callable
+from datetime import datetime, timedelta
+from typing import (
+    Any,
+    Iterable,
+    Sequence,
+    TypedDict,
+    ParamSpec,
+    TypeVar,
+    Awaitable,
+    Callable,
+)
+from uuid import uuid4
 from pydantic import BaseModel
 
 import structlog
 from arq import func, cron
 from arq.connections import RedisSettings, ArqRedis, create_pool as arq_create_pool
-from arq.jobs import Job
+from arq.constants import job_key_prefix
+from arq.jobs import Job, serialize_job
+from arq.utils import timestamp_ms, to_ms
 from arq.worker import Function
 from arq.typing import SecondsTimedelta, OptionType
 from arq.cron import CronJob
 
 from polar.config import settings
 from polar.context import ExecutionContext
+from polar.integrations.github.pool import pool as github_pool
 
 log = structlog.get_logger()
 
@@ -38,8 +52,44 @@ class PolarWorkerContext(BaseModel):
         return ExecutionContext(is_during_installation=self.is_during_installation)
 
 
+class Coalescing:
+    """
+    Coalescing options of a task, see the coalesce_key and debounce arguments of
+    task().
+
+    While a job is pending for a given key, a marker holding its job ID is stored in
+    Redis. Further enqueues for the same key are absorbed by the pending job. The
+    marker is cleared as soon as the job starts, so requests made while it is
+    running queue a new job.
+    """
+
+    # Upper bound for how long a marker can outlive its job, e.g. if the queue is
+    # flushed. Past that, a duplicate job may be enqueued, which is harmless.
+    pending_ttl = timedelta(hours=1)
+
+    def __init__(
+        self,
+        name: str,
+        key: Callable[..., str],
+        debounce: SecondsTimedelta | None = None,
+    ) -> None:
+        self.name = name
+        self.key = key
+        self.debounce_ms: int = to_ms(debounce) or 0
+
+    @property
+    def ttl_ms(self) -> int:
+        return self.debounce_ms + to_ms(self.pending_ttl)
+
+    def redis_key(self, args: Sequence[Any], kwargs: dict[str, Any]) -> str:
+        return f"worker:coalesce:{self.name}:{self.key(*args, **kwargs)}"
+
+
+_coalescing: dict[str, Coalescing] = {}
+
+
 class WorkerSettings:
-    functions: list[Function | types.CoroutineType] = [] # type: ignore
+    functions: list[Function | types.CoroutineType] = []  # type: ignore
     cron_jobs: list[CronJob] = []
 
     redis_settings = RedisSettings().from_dsn(settings.redis_url)
@@ -50,6 +100,8 @@ class WorkerSettings:
 
     @staticmethod
     async def shutdown(ctx: WorkerContext) -> None:
+        await close_pool()
+        await github_pool.close()
         log.info("polar.worker.shutdown")
 
     @staticmethod
@@ -74,13 +126,146 @@ async def create_pool() -> ArqRedis:
     return await arq_create_pool(WorkerSettings.redis_settings)
 
 
-async def enqueue_job(name: str, *args: Any, **kwargs: Any) -> Job | None:
+_pool: ArqRedis | None = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_pool() -> ArqRedis:
+    """
+    Returns the process-wide ArqRedis pool, creating it on first use.
+
+    The pool is shared by every enqueue in the process (API and worker alike) and
+    is closed by close_pool() on shutdown.
+    """
+    global _pool
+    if _pool is not None:
+        return _pool
+
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await create_pool()
+            log.info("polar.worker.pool.created")
+    return _pool
+
+
+async def close_pool() -> None:
+    global _pool
+    if _pool is None:
+        return
+
+    pool, _pool = _pool, None
+    await pool.close(close_connection_pool=True)
+    log.info("polar.worker.pool.closed")
+
+
+def _polar_context() -> PolarWorkerContext:
     ctx = ExecutionContext.current()
-    kwargs["polar_context"] = PolarWorkerContext(
+    return PolarWorkerContext(
         is_during_installation=ctx.is_during_installation,
     )
-    redis = await create_pool()
-    return await redis.enqueue_job(name, *args, **kwargs)
+
+
+async def enqueue_job(name: str, *args: Any, **kwargs: Any) -> Job | None:
+    kwargs["polar_context"] = _polar_context()
+    redis = await get_pool()
+
+    coalescing = _coalescing.get(name)
+    if coalescing is None:
+        return await redis.enqueue_job(name, *args, **kwargs)
+
+    job_id = uuid4().hex
+    key = coalescing.redis_key(args, kwargs)
+    if not await redis.set(key, job_id, nx=True, px=coalescing.ttl_ms):
+        log.info("polar.worker.coalesced", name=name, key=key)
+        return None
+
+    return await redis.enqueue_job(
+        name,
+        *args,
+        _job_id=job_id,
+        _defer_by=coalescing.debounce_ms or None,
+        **kwargs,
+    )
+
+
+async def enqueue_many(
+    name: str, args_list: Iterable[Sequence[Any]], **kwargs: Any
+) -> list[Job]:
+    """
+    Enqueue one job per entry in args_list in a single Redis round trip.
+
+    kwargs are shared by all jobs. Unlike enqueue_job, no uniqueness check is made
+    since every job gets a freshly generated ID. Jobs of coalesced tasks that are
+    already pending are skipped, which costs one extra round trip.
+    """
+    kwargs["polar_context"] = _polar_context()
+    redis = await get_pool()
+
+    pending = [(tuple(args), uuid4().hex) for args in args_list]
+    if not pending:
+        return []
+
+    coalescing = _coalescing.get(name)
+    debounce_ms = 0
+    if coalescing is not None:
+        debounce_ms = coalescing.debounce_ms
+        async with redis.pipeline(transaction=False) as pipe:
+            for args, job_id in pending:
+                pipe.set(  # type: ignore[unused-coroutine]
+                    coalescing.redis_key(args, kwargs),
+                    job_id,
+                    nx=True,
+                    px=coalescing.ttl_ms,
+                )
+            acquired = await pipe.execute()
+
+        coalesced = len(pending) - sum(1 for ok in acquired if ok)
+        pending = [job for job, ok in zip(pending, acquired) if ok]
+        if coalesced:
+            log.info("polar.worker.coalesced", name=name, count=coalesced)
+        if not pending:
+            return []
+
+    jobs: list[Job] = []
+    async with redis.pipeline(transaction=False) as pipe:
+        enqueue_time_ms = timestamp_ms()
+        for args, job_id in pending:
+            job = serialize_job(
+                name,
+                args,
+                kwargs,
+                None,
+                enqueue_time_ms,
+                serializer=redis.job_serializer,
+            )
+            pipe.psetex(  # type: ignore[no-untyped-call]
+                job_key_prefix + job_id,
+                debounce_ms + redis.expires_extra_ms,
+                job,
+            )
+            pipe.zadd(  # type: ignore[unused-coroutine]
+                redis.default_queue_name, {job_id: enqueue_time_ms + debounce_ms}
+            )
+            jobs.append(
+                Job(
+                    job_id,
+                    redis=redis,
+                    _queue_name=redis.default_queue_name,
+                    _deserializer=redis.job_deserializer,
+                )
+            )
+
+        await pipe.execute()
+
+    log.info("polar.worker.enqueue_many", name=name, count=len(jobs))
+    return jobs
+
+
+def get_task(name: str) -> Callable[..., Awaitable[Any]] | None:
+    for f in WorkerSettings.functions:
+        if isinstance(f, Function) and f.name == name:
+            return f.coroutine
+    return None
 
 
 Params = ParamSpec("Params")
@@ -94,14 +279,44 @@ def task(
     timeout: SecondsTimedelta | None = None,
     keep_result_forever: bool | None = None,
     max_tries: int | None = None,
+    coalesce_key: Callable[..., str] | None = None,
+    debounce: SecondsTimedelta | None = None,
 ) -> Callable[
     [Callable[Params, Awaitable[ReturnValue]]], Callable[Params, Awaitable[ReturnValue]]
 ]:
+    """
+    Register a worker task.
+
+    If coalesce_key is set, it's called with the job arguments (without ctx) and
+    enqueues that produce the same key while a job is pending are absorbed by it.
+    debounce defers coalesced jobs, so that a burst of requests results in a single
+    run once the window has passed.
+    """
+    if debounce and not coalesce_key:
+        raise ValueError("debounce requires coalesce_key")
+
+    coalescing = Coalescing(name, coalesce_key, debounce) if coalesce_key else None
+    if coalescing:
+        _coalescing[name] = coalescing
+
     def decorator(
         f: Callable[Params, Awaitable[ReturnValue]]
     ) -> Callable[Params, Awaitable[ReturnValue]]:
+        coroutine: Callable[..., Awaitable[ReturnValue]] = f
+
+        if coalescing:
+
+            async def run_coalesced(
+                ctx: JobContext, *args: Any, **kwargs: Any
+            ) -> ReturnValue:
+                # The job is no longer pending, let new requests enqueue a new one
+                await ctx["redis"].delete(coalescing.redis_key(args, kwargs))
+                return await f(ctx, *args, **kwargs)  # type: ignore
+
+            coroutine = run_coalesced
+
         new_task = func(
-            f,  # type: ignore
+            coroutine,  # type: ignore
             name=name,
             keep_result=keep_result,
             timeout=timeout,
@@ -143,4 +358,14 @@ def interval(
     return decorator
 
 
-__all__ = ["WorkerSettings", "task", "create_pool", "enqueue_job", "JobContext"]
+__all__ = [
+    "WorkerSettings",
+    "task",
+    "create_pool",
+    "get_pool",
+    "close_pool",
+    "enqueue_job",
+    "enqueue_many",
+    "get_task",
+    "JobContext",
+]
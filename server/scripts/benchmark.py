@@ -0,0 +1,500 @@
+import copy
+import glob
+import hashlib
+import json
+import os
+import random
+import time
+import timeit
+import uuid
+from collections import Counter
+from typing import Any
+from unittest import mock
+
+import httpx
+import typer
+from githubkit.core import GitHubCore
+from sqlalchemy import event, text
+
+from polar.enums import Platforms
+from polar.integrations.github import client as github
+from polar.integrations.github.payload import WebhookPayload
+from polar.integrations.github.service.reference import github_reference
+from polar.issue.dependency_graph import issue_dependency_graph
+from polar.kit import utils
+from polar.models import (
+    Issue,
+    IssueDependency,
+    IssueDependencyClosure,
+    IssueReference,
+    Organization,
+    Repository,
+)
+from polar.postgres import AsyncEngineLocal, AsyncSessionLocal, sql
+from scripts.db import assert_dev_or_testing
+from scripts.github import typer_async
+
+cli = typer.Typer()
+
+CASSETTES = os.path.join(os.path.dirname(__file__), "../tests/fixtures/cassettes")
+
+
+def read_cassettes(pattern: str) -> dict[str, Any]:
+    cassettes = {}
+    for filename in sorted(glob.glob(os.path.join(CASSETTES, pattern))):
+        name = os.path.splitext(os.path.basename(filename))[0]
+        with open(filename, "r") as fp:
+            cassettes[name] = json.loads(fp.read())
+    return cassettes
+
+
+def report(name: str, baseline: float, candidate: float, number: int) -> None:
+    typer.echo(
+        f"{name:<50} "
+        f"{baseline / number * 1e6:>10.1f}µs "
+        f"{candidate / number * 1e6:>10.1f}µs "
+        f"{baseline / candidate:>7.1f}x"
+    )
+
+
+###############################################################################
+# Webhooks
+###############################################################################
+
+
+def webhook_model(scope: str, action: str | None) -> Any:
+    if not action:
+        return getattr(github.webhooks, f"{scope.title()}Event", None)
+    name = "".join(part.title() for part in f"{scope}_{action}".split("_"))
+    return getattr(github.webhooks, name, None)
+
+
+@cli.command()
+def webhook_payload(
+    number: int = typer.Option(200, help="Iterations per payload"),
+) -> None:
+    """
+    Compare github.webhooks.parse_obj with WebhookPayload on recorded webhooks.
+    """
+    typer.echo(f"{'payload':<50} {'parse_obj':>12} {'payload':>12} {'speedup':>8}")
+
+    for name, cassette in read_cassettes("github/webhooks/*.json").items():
+        scope = cassette["headers"]["X-GitHub-Event"]
+        body = cassette["body"]
+
+        def full_parse() -> None:
+            github.webhooks.parse_obj(scope, body)
+
+        model = webhook_model(scope, body.get("action"))
+        if model is None:
+            continue
+
+        def typed_parse() -> None:
+            WebhookPayload(scope, body).event(model)
+
+        report(
+            f"{name} (event)",
+            timeit.timeit(full_parse, number=number),
+            timeit.timeit(typed_parse, number=number),
+            number,
+        )
+
+        if "issue" not in body:
+            continue
+
+        def lazy_fields() -> None:
+            payload = WebhookPayload(scope, body)
+            payload.issue_id
+            payload.issue_labels
+            payload.issue_assignees
+            payload.repository_id
+
+        report(
+            f"{name} (issue fields)",
+            timeit.timeit(full_parse, number=number),
+            timeit.timeit(lazy_fields, number=number),
+            number,
+        )
+
+
+###############################################################################
+# Issue timelines
+###############################################################################
+
+
+class TimelineReplay:
+    """
+    Serves a synthetic issue timeline, built by repeating the recorded one, in place
+    of the GitHub API, and counts the requests made.
+    """
+
+    def __init__(self, recorded: list[dict[str, Any]]) -> None:
+        self.recorded = recorded
+        self.events: list[dict[str, Any]] = []
+        self.grown = 0
+        self.requests: Counter[str] = Counter()
+
+    def grow(self, count: int) -> None:
+        for _ in range(count):
+            i = self.grown
+            self.grown += 1
+            e = copy.deepcopy(self.recorded[i % len(self.recorded)])
+            if e.get("commit_id"):
+                e["commit_id"] = f"{e['commit_id'][:-8]}{i:08d}"
+            if e.get("node_id"):
+                e["node_id"] += f"-{i}"
+            if e.get("source", {}).get("issue", {}).get("pull_request"):
+                e["source"]["issue"]["pull_request"]["html_url"] += f"#{i}"
+            self.events.append(e)
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        params: Any = None,
+        headers: Any = None,
+        **_: Any,
+    ) -> httpx.Response:
+        request = httpx.Request(method, str(url))
+        if not str(url).endswith("/timeline"):
+            # Lookups made while annotating commit references
+            self.requests["other"] += 1
+            content = "[]" if str(url).endswith("/branches-where-head") else "{}"
+            return httpx.Response(200, request=request, content=content)
+
+        self.requests["timeline"] += 1
+        page, per_page = int(params["page"]), int(params["per_page"])
+        content = json.dumps(self.events[(page - 1) * per_page : page * per_page])
+        etag = f'"{hashlib.sha1(content.encode()).hexdigest()}"'
+        if headers and headers.get("If-None-Match") == etag:
+            return httpx.Response(304, request=request, headers={"ETag": etag})
+        return httpx.Response(
+            200, request=request, headers={"ETag": etag}, content=content
+        )
+
+
+@cli.command()
+@typer_async
+async def timeline(
+    events: int = typer.Option(1000, help="Events on the timeline"),
+    new_events: int = typer.Option(10, help="Events added between crawls"),
+) -> None:
+    """
+    Crawl a synthetic timeline built from the recorded one, counting API calls and
+    database round trips per crawl.
+    """
+    assert_dev_or_testing()
+
+    replay = TimelineReplay(
+        read_cassettes("github/references/*.json")["issue_timeline"]
+    )
+    replay.grow(events)
+
+    round_trips = 0
+
+    def count_round_trip(*args: Any, **kwargs: Any) -> None:
+        nonlocal round_trips
+        round_trips += 1
+
+    event.listen(
+        AsyncEngineLocal.sync_engine, "before_cursor_execute", count_round_trip
+    )
+
+    async with AsyncSessionLocal() as session:
+        org = Organization(
+            name=f"benchmark{uuid.uuid4().hex[:8]}",
+            platform=Platforms.github,
+            external_id=-1,
+            is_personal=False,
+            installation_id=-1,
+            installation_created_at=utils.utc_now(),
+        )
+        await org.save(session)
+        repo = Repository(
+            name="timeline",
+            organization_id=org.id,
+            platform=Platforms.github,
+            external_id=-1,
+            is_private=False,
+        )
+        await repo.save(session)
+        issue = Issue(
+            organization_id=org.id,
+            repository_id=repo.id,
+            title="timeline",
+            number=1,
+            platform=Platforms.github,
+            external_id=-1,
+            state="open",
+            issue_created_at=utils.utc_now(),
+        )
+        await issue.save(session)
+
+        async def crawl(name: str) -> None:
+            nonlocal round_trips
+            replay.requests.clear()
+            round_trips = 0
+            start = time.perf_counter()
+            await github_reference.sync_issue_references(session, org, repo, issue)
+            typer.echo(
+                f"{name:<40} "
+                f"{replay.requests['timeline']:>10} "
+                f"{replay.requests['other']:>10} "
+                f"{round_trips:>10} "
+                f"{(time.perf_counter() - start) * 1000:>10.0f}ms"
+            )
+
+        typer.echo(
+            f"{'crawl':<40} {'timeline':>10} {'other':>10} {'db':>10} {'time':>12}"
+        )
+        try:
+            with mock.patch.object(GitHubCore, "_arequest", new=replay.request):
+                await crawl(f"first crawl, {events} events")
+                await crawl("unchanged")
+                replay.grow(new_events)
+                await crawl(f"{new_events} new events")
+                del replay.events[:new_events]
+                replay.grow(new_events)
+                await crawl(f"{new_events} deleted and {new_events} new events")
+                replay.grow(new_events)
+                issue.github_timeline_offset = None
+                await issue.save(session)
+                await crawl(f"{new_events} new events, without checkpoint")
+        finally:
+            await session.execute(
+                sql.delete(IssueReference).where(IssueReference.issue_id == issue.id)
+            )
+            await session.delete(issue)
+            await session.delete(repo)
+            await session.delete(org)
+            await session.commit()
+
+
+###############################################################################
+# Issue dependency graph
+###############################################################################
+
+RECURSIVE_DEPENDENCIES = text(
+    """
+    WITH RECURSIVE paths(dependent_issue_id, dependency_issue_id, depth) AS (
+        SELECT d.dependent_issue_id, d.dependency_issue_id, 1
+        FROM issue_dependencies d
+        WHERE d.repository_id = ANY(:repository_ids)
+        UNION
+        SELECT p.dependent_issue_id, d.dependency_issue_id, p.depth + 1
+        FROM paths p
+        JOIN issue_dependencies d ON d.dependent_issue_id = p.dependency_issue_id
+        WHERE p.depth < :max_depth
+    )
+    SELECT dependent_issue_id, dependency_issue_id, min(depth)
+    FROM paths
+    WHERE dependent_issue_id != dependency_issue_id
+    GROUP BY dependent_issue_id, dependency_issue_id
+    """
+)
+
+
+def synthetic_dependencies(
+    issues: list[uuid.UUID], edges: int, levels: int, cycles: int
+) -> set[tuple[uuid.UUID, uuid.UUID]]:
+    """
+    Random dependencies of issues of every level on issues of the next one, so
+    that chains are at most levels long, and a few from the last level back to the
+    first, closing cycles.
+    """
+    size = len(issues) // levels
+    layers = [issues[i * size : (i + 1) * size] for i in range(levels)]
+
+    ret: set[tuple[uuid.UUID, uuid.UUID]] = set()
+    while len(ret) < edges - cycles:
+        level = random.randrange(levels - 1)
+        ret.add((random.choice(layers[level]), random.choice(layers[level + 1])))
+    while len(ret) < edges:
+        ret.add((random.choice(layers[-1]), random.choice(layers[0])))
+    return ret
+
+
+@cli.command()
+@typer_async
+async def dependency_graph(
+    edges: int = typer.Option(100_000, help="Dependencies in the graph"),
+    issues: int = typer.Option(50_000, help="Issues in the graph"),
+    repositories: int = typer.Option(50, help="Repositories issues are spread over"),
+    levels: int = typer.Option(5, help="Issues in the longest dependency chain"),
+    cycles: int = typer.Option(100, help="Dependencies closing a cycle"),
+    added: int = typer.Option(1000, help="Dependencies added incrementally"),
+    queried: int = typer.Option(5, help="Repositories to list dependencies of"),
+    number: int = typer.Option(10, help="Iterations per query"),
+    seed: int = typer.Option(0, help="Random seed"),
+) -> None:
+    """
+    Build the dependency closure of a synthetic graph, add dependencies to it, and
+    compare listing the transitive dependencies of repositories from it with a
+    recursive query over issue_dependencies.
+    """
+    assert_dev_or_testing()
+    random.seed(seed)
+
+    async with AsyncSessionLocal() as session:
+        org = Organization(
+            name=f"benchmark{uuid.uuid4().hex[:8]}",
+            platform=Platforms.github,
+            external_id=-1,
+            is_personal=False,
+            installation_id=-1,
+            installation_created_at=utils.utc_now(),
+        )
+        await org.save(session)
+
+        repository_ids = [uuid.uuid4() for _ in range(repositories)]
+        await session.execute(
+            sql.insert(Repository),
+            [
+                dict(
+                    id=id,
+                    name=f"graph{i}",
+                    organization_id=org.id,
+                    platform=Platforms.github,
+                    external_id=-1 - i,
+                    is_private=False,
+                )
+                for i, id in enumerate(repository_ids)
+            ],
+        )
+
+        issue_ids = [uuid.uuid4() for _ in range(issues)]
+        issue_repositories = {id: random.choice(repository_ids) for id in issue_ids}
+        for offset in range(0, issues, 5000):
+            await session.execute(
+                sql.insert(Issue),
+                [
+                    dict(
+                        id=id,
+                        organization_id=org.id,
+                        repository_id=issue_repositories[id],
+                        title="graph",
+                        number=offset + i,
+                        platform=Platforms.github,
+                        external_id=-1 - offset - i,
+                        state="open",
+                        issue_created_at=utils.utc_now(),
+                    )
+                    for i, id in enumerate(issue_ids[offset : offset + 5000])
+                ],
+            )
+
+        dependencies = list(
+            synthetic_dependencies(issue_ids, edges + added, levels, cycles)
+        )
+        random.shuffle(dependencies)
+        initial, incremental = dependencies[:edges], dependencies[edges:]
+
+        def rows(pairs: list[tuple[uuid.UUID, uuid.UUID]]) -> list[dict[str, Any]]:
+            return [
+                dict(
+                    organization_id=org.id,
+                    repository_id=issue_repositories[dependent],
+                    dependent_issue_id=dependent,
+                    dependency_issue_id=dependency,
+                )
+                for dependent, dependency in pairs
+            ]
+
+        for offset in range(0, len(initial), 5000):
+            await session.execute(
+                sql.insert(IssueDependency), rows(initial[offset : offset + 5000])
+            )
+        await session.commit()
+
+        try:
+            start = time.perf_counter()
+            closure_rows = await issue_dependency_graph.rebuild(session)
+            typer.echo(
+                f"rebuild, {edges} dependencies, {closure_rows} closure rows: "
+                f"{(time.perf_counter() - start) * 1000:.0f}ms"
+            )
+
+            records = []
+            for pair in rows(incremental):
+                record = IssueDependency(**pair)
+                session.add(record)
+                records.append(record)
+            await session.commit()
+
+            start = time.perf_counter()
+            await issue_dependency_graph.add_dependencies(session, records)
+            elapsed = time.perf_counter() - start
+            typer.echo(
+                f"add {added} dependencies: {elapsed * 1000:.0f}ms, "
+                f"{elapsed / max(added, 1) * 1e6:.0f}µs per dependency"
+            )
+
+            queried_ids = repository_ids[:queried]
+            # Cycles make paths endless, stop at the longest shortest chain
+            max_depth = (
+                await session.execute(
+                    sql.select(sql.func.max(IssueDependencyClosure.depth))
+                )
+            ).scalar_one()
+
+            async def recursive() -> set[tuple[Any, ...]]:
+                res = await session.execute(
+                    RECURSIVE_DEPENDENCIES,
+                    {"repository_ids": queried_ids, "max_depth": max_depth},
+                )
+                return {tuple(r) for r in res}
+
+            async def closure() -> set[tuple[Any, ...]]:
+                c = IssueDependencyClosure
+                res = await session.execute(
+                    sql.select(
+                        c.dependent_issue_id, c.dependency_issue_id, c.depth
+                    ).where(c.dependent_repository_id.in_(queried_ids))
+                )
+                return {tuple(r) for r in res}
+
+            async def timed(query: Any) -> tuple[float, set[tuple[Any, ...]]]:
+                start = time.perf_counter()
+                for _ in range(number):
+                    result = await query()
+                return (time.perf_counter() - start, result)
+
+            recursive_time, recursive_result = await timed(recursive)
+            closure_time, closure_result = await timed(closure)
+            assert recursive_result == closure_result
+
+            typer.echo(
+                f"{'query':<50} {'recursive':>12} {'closure':>12} {'speedup':>8}"
+            )
+            report(
+                f"dependencies of {queried} repos, {len(closure_result)} rows",
+                recursive_time,
+                closure_time,
+                number,
+            )
+        finally:
+            c = IssueDependencyClosure
+            await session.execute(
+                sql.delete(c).where(
+                    c.dependent_repository_id.in_(repository_ids)
+                    | c.dependency_repository_id.in_(repository_ids)
+                )
+            )
+            await session.execute(
+                sql.delete(IssueDependency).where(
+                    IssueDependency.organization_id == org.id
+                )
+            )
+            await session.execute(
+                sql.delete(Issue).where(Issue.organization_id == org.id)
+            )
+            await session.execute(
+                sql.delete(Repository).where(Repository.organization_id == org.id)
+            )
+            await session.delete(org)
+            await session.commit()
+
+
+if __name__ == "__main__":
+    cli()
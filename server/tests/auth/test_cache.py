@@ -0,0 +1,99 @@
+import time
+import uuid
+
+import pytest
+from pytest_mock import MockerFixture
+
+from polar.auth.cache import Grant, PrincipalCache
+from polar.auth.service import AuthService
+from polar.enums import Platforms
+from polar.models import Organization, User, UserOrganization
+from polar.postgres import AsyncSession
+from polar.redis import redis
+
+
+@pytest.mark.asyncio
+async def test_grant() -> None:
+    cache = PrincipalCache()
+    user_id = uuid.uuid4()
+    grant = Grant(organization_id=uuid.uuid4(), repository_id=uuid.uuid4())
+
+    await cache.set_grant(user_id, Platforms.github, "polarsource", "polar", grant)
+
+    assert (
+        await cache.get_grant(user_id, Platforms.github, "polarsource", "polar")
+        == grant
+    )
+    assert await cache.get_grant(user_id, Platforms.github, "polarsource") is None
+
+    # From Redis, in another process
+    other = PrincipalCache()
+    assert (
+        await other.get_grant(user_id, Platforms.github, "polarsource", "polar")
+        == grant
+    )
+
+    await cache.invalidate_user(user_id)
+    assert await cache.get_grant(user_id, Platforms.github, "polarsource") is None
+    assert await redis.exists(cache.grants_key(user_id)) == 0
+
+
+@pytest.mark.asyncio
+async def test_grant_expired(mocker: MockerFixture) -> None:
+    # Skip the in-process layer
+    cache = PrincipalCache(local_ttl=-1, ttl=60)
+    user_id = uuid.uuid4()
+    grant = Grant(organization_id=uuid.uuid4())
+
+    await cache.set_grant(user_id, Platforms.github, "polarsource", None, grant)
+    assert await cache.get_grant(user_id, Platforms.github, "polarsource") == grant
+
+    now = time.time()
+    mocker.patch("polar.auth.cache.time.time", return_value=now + 61)
+    assert await cache.get_grant(user_id, Platforms.github, "polarsource") is None
+
+
+def test_user_id(mocker: MockerFixture) -> None:
+    monotonic = mocker.patch("polar.auth.cache.time.monotonic")
+    monotonic.return_value = 100.0
+
+    cache = PrincipalCache(local_ttl=5)
+    user_id = uuid.uuid4()
+    cache.set_user_id("token", user_id)
+    assert cache.get_user_id("token") == user_id
+    assert cache.get_user_id("other") is None
+
+    monotonic.return_value = 106.0
+    assert cache.get_user_id("token") is None
+
+
+@pytest.mark.asyncio
+async def test_granted_requires_membership(
+    session: AsyncSession,
+    user: User,
+    organization: Organization,
+    user_organization: UserOrganization,
+) -> None:
+    await AuthService.set_granted(
+        user=user, platform=Platforms.github, organization=organization
+    )
+
+    granted = await AuthService.get_granted(
+        session, user_id=user.id, platform=Platforms.github, org_name=organization.name
+    )
+    assert granted is not None
+    assert granted[1].id == organization.id
+
+    # Removed outside of the service, the grant is still cached
+    await session.delete(user_organization)
+    await session.commit()
+
+    assert (
+        await AuthService.get_granted(
+            session,
+            user_id=user.id,
+            platform=Platforms.github,
+            org_name=organization.name,
+        )
+        is None
+    )
@@ -0,0 +1,89 @@
+import asyncio
+from collections.abc import AsyncIterator
+
+import pytest
+import pytest_asyncio
+from pytest_mock import MockerFixture
+
+from polar.eventstream.hub import PubSubHub
+from polar.redis import redis
+
+
+@pytest_asyncio.fixture
+async def hub() -> AsyncIterator[PubSubHub]:
+    hub = PubSubHub(redis)
+    yield hub
+    await hub.close()
+
+
+async def subscribers(channel: str) -> int:
+    [(_, count)] = await redis.pubsub_numsub(channel)
+    return int(count)
+
+
+async def wait_for_subscribers(channel: str, count: int) -> None:
+    for _ in range(50):
+        if await subscribers(channel) == count:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"expected {count} subscribers on {channel}")
+
+
+@pytest.mark.asyncio
+async def test_shared_subscription(hub: PubSubHub) -> None:
+    async with hub.subscribe(["user:a", "org:a"]) as user_queue:
+        async with hub.subscribe(["org:a"]) as org_queue:
+            # Both streams share the hub connection
+            await wait_for_subscribers("org:a", 1)
+
+            await redis.publish("org:a", "hello")
+            assert await asyncio.wait_for(user_queue.get(), 1) == ("org:a", "hello")
+            assert await asyncio.wait_for(org_queue.get(), 1) == ("org:a", "hello")
+
+            await redis.publish("user:a", "only user")
+            assert await asyncio.wait_for(user_queue.get(), 1) == (
+                "user:a",
+                "only user",
+            )
+            assert org_queue.empty()
+
+        # Still used by the first stream
+        assert sorted(hub.channels) == ["org:a", "user:a"]
+        await wait_for_subscribers("org:a", 1)
+
+    assert hub.channels == []
+    await wait_for_subscribers("org:a", 0)
+    await wait_for_subscribers("user:a", 0)
+
+
+@pytest.mark.asyncio
+async def test_full_queue_drops_messages(hub: PubSubHub) -> None:
+    hub.max_queue_size = 1
+    async with hub.subscribe(["repo:a"]) as queue:
+        await wait_for_subscribers("repo:a", 1)
+
+        await redis.publish("repo:a", "first")
+        await redis.publish("repo:a", "second")
+        await asyncio.sleep(0.1)
+
+        assert queue.get_nowait() == ("repo:a", "first")
+        assert queue.empty()
+
+
+@pytest.mark.asyncio
+async def test_read_survives_errors(hub: PubSubHub, mocker: MockerFixture) -> None:
+    hub.retry_delay = 0
+    dispatch = hub._dispatch
+
+    def failing_dispatch(channel: str, data: str) -> None:
+        if data == "invalid":
+            raise ValueError(data)
+        dispatch(channel, data)
+
+    mocker.patch.object(hub, "_dispatch", side_effect=failing_dispatch)
+    async with hub.subscribe(["repo:a"]) as queue:
+        await wait_for_subscribers("repo:a", 1)
+
+        await redis.publish("repo:a", "invalid")
+        await redis.publish("repo:a", "valid")
+        assert await asyncio.wait_for(queue.get(), 1) == ("repo:a", "valid")
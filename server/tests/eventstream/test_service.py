@@ -0,0 +1,127 @@
+import asyncio
+import uuid
+from functools import partial
+
+import pytest
+from pytest_mock import MockerFixture
+
+from polar.config import settings
+from polar.eventstream.service import (
+    Event,
+    Throttle,
+    format_last_event_id,
+    get_stream_tips,
+    parse_last_event_id,
+    replay,
+    send,
+    send_many,
+    stream_key,
+)
+from polar.redis import redis
+
+
+def test_parse_last_event_id() -> None:
+    channels = ["user:a", "org:a"]
+    cursors = {"user:a": "1688400000000-0", "org:a": "1688400000001-3"}
+
+    last_event_id = format_last_event_id(cursors, channels)
+    assert parse_last_event_id(last_event_id, channels) == cursors
+
+    assert parse_last_event_id(None, channels) is None
+    # Another stream, or a legacy event ID
+    assert parse_last_event_id(last_event_id, ["user:a"]) is None
+    assert parse_last_event_id(str(uuid.uuid4()), ["user:a"]) is None
+
+
+@pytest.mark.asyncio
+async def test_replay(mocker: MockerFixture) -> None:
+    mocker.patch.object(settings, "EVENTSTREAM_DURABLE", True)
+
+    channels = [f"user:{uuid.uuid4()}", f"org:{uuid.uuid4()}"]
+    await redis.delete(*[stream_key(c) for c in channels])
+
+    def event(key: str) -> Event:
+        return Event(id=uuid.uuid4(), key=key, payload={})
+
+    await send(event("before"), channels)
+    cursors = await get_stream_tips(channels)
+
+    await send(event("first"), [channels[1]])
+    await send(event("second"), channels)
+
+    events = await replay(cursors)
+    replayed = [(channel, Event.parse_raw(data).key) for channel, _, data in events]
+    assert sorted(replayed) == sorted(
+        [(channels[1], "first"), (channels[0], "second"), (channels[1], "second")]
+    )
+
+    # Nothing new past the last replayed events
+    cursors = {channel: entry_id for channel, entry_id, _ in events}
+    assert await replay(cursors) == []
+
+
+@pytest.mark.asyncio
+async def test_send_many() -> None:
+    channels = [f"user:{uuid.uuid4()}", f"user:{uuid.uuid4()}"]
+    first = Event(id=uuid.uuid4(), key="first", payload={})
+    second = Event(id=uuid.uuid4(), key="second", payload={})
+
+    async with redis.pubsub() as pubsub:
+        await pubsub.subscribe(*channels)
+        await send_many([(first, channels), (second, channels[1:])])
+
+        received = []
+        while len(received) < 3:
+            message = await asyncio.wait_for(
+                pubsub.get_message(ignore_subscribe_messages=True, timeout=1), 2
+            )
+            if message is not None:
+                received.append((message["channel"], Event.parse_raw(message["data"])))
+
+    assert received == [
+        (channels[0], first),
+        (channels[1], first),
+        (channels[1], second),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_throttle() -> None:
+    throttle = Throttle(interval=0.05)
+    sent: list[str] = []
+
+    async def send(value: str) -> None:
+        sent.append(value)
+
+    await throttle.send("a", partial(send, "a1"))
+    await throttle.send("b", partial(send, "b1"))
+    await throttle.send("a", partial(send, "a2"))
+    await throttle.send("a", partial(send, "a3"))
+    assert sent == ["a1", "b1"]
+
+    # The latest event of the interval is sent at its end
+    await asyncio.sleep(0.1)
+    assert sent == ["a1", "b1", "a3"]
+
+    # Keys expire with their interval
+    await asyncio.sleep(0.05)
+    await throttle.send("c", partial(send, "c1"))
+    assert list(throttle._sent_at.keys()) == ["c"]
+
+
+@pytest.mark.asyncio
+async def test_throttle_reset() -> None:
+    throttle = Throttle(interval=0.05)
+    sent: list[str] = []
+
+    async def send(value: str) -> None:
+        sent.append(value)
+
+    await throttle.send("a", partial(send, "a1"))
+    await throttle.send("a", partial(send, "a2"))
+
+    # Superseded by the event of the reset, held events are dropped
+    throttle.reset("a")
+    await throttle.send("a", partial(send, "done"))
+    await asyncio.sleep(0.1)
+    assert sent == ["a1", "done"]
@@ -0,0 +1,114 @@
+from datetime import datetime, timezone
+from typing import Any
+
+import pytest
+from pytest_mock import MockerFixture
+
+from polar.integrations.github.service.issue import github_issue
+from polar.issue.hooks import issue_upserted
+from polar.models.issue import Issue
+from polar.models.organization import Organization
+from polar.models.repository import Repository
+from polar.postgres import AsyncSession
+from tests.fixtures.random_objects import (
+    create_issue,
+    create_organization,
+    create_repository,
+)
+
+
+@pytest.mark.asyncio
+async def test_list_issues_to_crawl_issue_per_organization(
+    session: AsyncSession,
+    organization: Organization,
+    repository: Repository,
+    issue: Issue,
+) -> None:
+    await create_issue(session, organization, repository)
+    await create_issue(session, organization, repository)
+
+    other_organization = await create_organization(session)
+    other_repository = await create_repository(session, other_organization)
+    other_issue = await create_issue(session, other_organization, other_repository)
+
+    issues = await github_issue.list_issues_to_crawl_issue(session, per_organization=2)
+
+    organization_ids = [i.organization_id for i in issues]
+    assert organization_ids.count(organization.id) == 2
+    assert organization_ids.count(other_organization.id) == 1
+    assert other_issue.id in [i.id for i in issues]
+
+
+def issue_node(issue: Issue, updated_at: str) -> dict[str, Any]:
+    return {
+        "databaseId": issue.external_id,
+        "number": issue.number,
+        "title": issue.title,
+        "body": "",
+        "state": "OPEN",
+        "stateReason": None,
+        "authorAssociation": "NONE",
+        "createdAt": "2023-06-01T10:00:00Z",
+        "updatedAt": updated_at,
+        "closedAt": None,
+        "author": None,
+        "assignees": {"nodes": []},
+        "labels": {"nodes": []},
+        "milestone": None,
+        "comments": {"totalCount": 0},
+        "reactionGroups": [],
+        "timelineItems": {"nodes": []},
+    }
+
+
+@pytest.mark.asyncio
+async def test_sync_issues_changed_only(
+    session: AsyncSession,
+    organization: Organization,
+    repository: Repository,
+    mocker: MockerFixture,
+) -> None:
+    unchanged = await create_issue(session, organization, repository)
+    changed = await create_issue(session, organization, repository)
+    failed = await create_issue(session, organization, repository)
+    not_found = await create_issue(session, organization, repository)
+    for issue in (unchanged, changed, failed, not_found):
+        issue.issue_modified_at = datetime(2023, 6, 1, 10, tzinfo=timezone.utc)
+        session.add(issue)
+    await session.commit()
+
+    def key(issue: Issue) -> tuple[str, str, int]:
+        return (organization.name, repository.name, issue.number)
+
+    mocker.patch(
+        "polar.integrations.github.service.issue.github.get_app_installation_client"
+    )
+    mocker.patch.object(
+        github_issue,
+        "_query_issues",
+        return_value=(
+            {
+                key(unchanged): issue_node(unchanged, "2023-06-01T10:00:00Z"),
+                key(changed): issue_node(changed, "2023-06-02T10:00:00Z"),
+            },
+            {key(failed)},
+        ),
+    )
+    hook = mocker.patch.object(issue_upserted, "call")
+
+    issues = await github_issue.list_with_organization_and_repository(
+        session, [unchanged.id, changed.id, failed.id, not_found.id]
+    )
+    await github_issue.sync_issues(session, issues, installation_id=123)
+
+    # Only the changed issue goes through the hooks
+    hook.assert_called_once()
+    assert hook.call_args.args[0].issue.id == changed.id
+
+    for issue in (unchanged, changed, failed, not_found):
+        await session.refresh(issue)
+    assert unchanged.github_issue_fetched_at is not None
+    assert changed.github_issue_fetched_at is not None
+    assert not_found.github_issue_fetched_at is not None
+    # Retried on the next tick
+    assert failed.github_issue_fetched_at is None
@@ -1,7 +1,12 @@
+from unittest.mock import AsyncMock, MagicMock
+
 import pytest
+from githubkit.exception import RequestFailed
+
 from polar.integrations.github.client import get_client
 from polar.integrations.github.service.organization import github_organization
 from polar.postgres import AsyncSession
+from polar.redis import redis
 
 
 @pytest.mark.asyncio
@@ -49,3 +54,30 @@ async def test_sync_external_org_with_repo_and_issue(
 
     assert org.name == "polarsource"
     assert repo.name == "open-testing"
+
+
+@pytest.mark.asyncio
+async def test_fetch_external_repositories_not_found() -> None:
+    await redis.delete(github_organization._not_found_key("polarsource", "nope"))
+
+    found = MagicMock()
+
+    async def get(owner: str, repo: str) -> MagicMock:
+        if repo == "nope":
+            raise RequestFailed(MagicMock(status_code=404))
+        return MagicMock(parsed_data=found)
+
+    client = MagicMock()
+    client.rest.repos.async_get = AsyncMock(side_effect=get)
+    names = [("polarsource", "polar"), ("polarsource", "nope")]
+
+    assert await github_organization.fetch_external_repositories(client, names) == {
+        ("polarsource", "polar"): found
+    }
+    assert client.rest.repos.async_get.await_count == 2
+
+    # Repositories that weren't found aren't fetched again
+    assert await github_organization.fetch_external_repositories(client, names) == {
+        ("polarsource", "polar"): found
+    }
+    assert client.rest.repos.async_get.await_count == 3
@@ -1,12 +1,16 @@
-from typing import List
+from typing import Any, List
+from unittest.mock import MagicMock
+import json
 import uuid
+import httpx
 from pydantic import parse_obj_as
+from pytest_mock import MockerFixture
 
 import pytest
 from polar.enums import Platforms
 from polar.kit import utils
 from polar.models.issue import Issue
-from polar.models.issue_reference import ReferenceType
+from polar.models.issue_reference import IssueReference, ReferenceType
 from polar.models.organization import Organization
 from polar.models.pull_request import PullRequest
 from polar.models.repository import Repository
@@ -16,7 +20,9 @@ from polar.integrations.github.service.reference import (
     github_reference,
 )
 import polar.integrations.github.client as github
+from polar.integrations.github.commit_cache import CommitMetadata, commit_cache
 from polar.postgres import AsyncSession
+from tests.fixtures.random_objects import create_issue
 
 
 @pytest.mark.asyncio
@@ -114,3 +120,346 @@ async def test_parse_issue_timeline(
 
     assert parsed[3].external_id == "471f58636e9b66228141d5e2c76be24f20f1553f"
     assert parsed[3].reference_type == ReferenceType.EXTERNAL_GITHUB_COMMIT
+
+
+@pytest.mark.asyncio
+async def test_sync_repo_references_stops_at_cursor(
+    session: AsyncSession,
+    organization: Organization,
+    repository: Repository,
+    mocker: MockerFixture,
+) -> None:
+    raw = read_cassette("github/references/repo_issue_events.json")
+    mocker.patch("polar.integrations.github.service.reference.crawl_scheduler.require")
+    enqueue_many = mocker.patch(
+        "polar.integrations.github.service.reference.enqueue_many"
+    )
+    arequest = mocker.patch(
+        "githubkit.core.GitHubCore._arequest",
+        side_effect=[
+            httpx.Response(
+                200,
+                request=httpx.Request("GET", ""),
+                headers={"ETag": '"new-etag"'},
+                content=json.dumps(raw),
+            ),
+        ],
+    )
+
+    issue = await create_issue(session, organization, repository)
+    issue.external_id = raw[0]["issue"]["id"]
+    await issue.save(session)
+
+    repository.github_events_etag = '"old-etag"'
+    repository.github_events_last_id = raw[1]["id"]
+    await repository.save(session)
+
+    await github_reference.sync_repo_references(session, organization, repository)
+
+    # A single page, fetched conditionally, with only the newest event being new
+    assert arequest.call_count == 1
+    assert arequest.call_args.kwargs["headers"]["If-None-Match"] == '"old-etag"'
+    enqueue_many.assert_called_once_with(
+        "github.issue.sync.issue_references",
+        [(issue.id,)],
+        crawl_with_installation_id=organization.installation_id,
+    )
+
+    await session.refresh(repository)
+    assert repository.github_events_etag == '"new-etag"'
+    assert repository.github_events_last_id == raw[0]["id"]
+
+
+@pytest.mark.asyncio
+async def test_sync_repo_references_not_modified(
+    session: AsyncSession,
+    organization: Organization,
+    repository: Repository,
+    mocker: MockerFixture,
+) -> None:
+    mocker.patch("polar.integrations.github.service.reference.crawl_scheduler.require")
+    enqueue_many = mocker.patch(
+        "polar.integrations.github.service.reference.enqueue_many"
+    )
+    mocker.patch(
+        "githubkit.core.GitHubCore._arequest",
+        side_effect=[httpx.Response(304, request=httpx.Request("GET", ""))],
+    )
+
+    repository.github_events_etag = '"etag"'
+    repository.github_events_last_id = 1
+    await repository.save(session)
+
+    await github_reference.sync_repo_references(session, organization, repository)
+
+    enqueue_many.assert_not_called()
+    await session.refresh(repository)
+    assert repository.github_events_last_id == 1
+
+
+def timeline_event_id(raw: dict[str, Any]) -> str | None:
+    return github_reference.timeline_event_id(parse_obj_as(TimelineEventType, raw))
+
+
+@pytest.mark.asyncio
+async def test_sync_issue_references_resumes_from_checkpoint(
+    session: AsyncSession,
+    organization: Organization,
+    repository: Repository,
+    mocker: MockerFixture,
+) -> None:
+    raw = read_cassette("github/references/issue_timeline.json")
+    mocker.patch("polar.integrations.github.service.reference.crawl_scheduler.require")
+    parse = mocker.patch.object(
+        github_reference, "parse_issue_timeline_event", return_value=None
+    )
+    arequest = mocker.patch(
+        "githubkit.core.GitHubCore._arequest",
+        side_effect=[
+            httpx.Response(
+                200,
+                request=httpx.Request("GET", ""),
+                headers={"ETag": '"new-etag"'},
+                content=json.dumps(raw),
+            ),
+        ],
+    )
+
+    issue = await create_issue(session, organization, repository)
+    issue.github_timeline_offset = 2
+    issue.github_timeline_last_event_id = timeline_event_id(raw[1])
+    issue.github_timeline_etag = '"old-etag"'
+    await issue.save(session)
+
+    await github_reference.sync_issue_references(
+        session, organization, repository, issue
+    )
+
+    # Only the events after the checkpoint are processed
+    assert arequest.call_count == 1
+    assert arequest.call_args.kwargs["params"]["page"] == 1
+    assert arequest.call_args.kwargs["headers"]["If-None-Match"] == '"old-etag"'
+    assert parse.call_count == len(raw) - 2
+
+    await session.refresh(issue)
+    assert issue.github_timeline_offset == len(raw)
+    assert issue.github_timeline_etag == '"new-etag"'
+    assert issue.github_timeline_last_event_id == timeline_event_id(raw[-1])
+
+
+@pytest.mark.asyncio
+async def test_sync_issue_references_timeline_changed(
+    session: AsyncSession,
+    organization: Organization,
+    repository: Repository,
+    mocker: MockerFixture,
+) -> None:
+    raw = read_cassette("github/references/issue_timeline.json")
+    # The first event was deleted since the last crawl
+    timeline = raw[1:]
+
+    mocker.patch("polar.integrations.github.service.reference.crawl_scheduler.require")
+    parse = mocker.patch.object(
+        github_reference, "parse_issue_timeline_event", return_value=None
+    )
+    arequest = mocker.patch(
+        "githubkit.core.GitHubCore._arequest",
+        side_effect=[
+            httpx.Response(
+                200,
+                request=httpx.Request("GET", ""),
+                headers={"ETag": '"new-etag"'},
+                content=json.dumps(timeline),
+            )
+            for _ in range(2)
+        ],
+    )
+
+    issue = await create_issue(session, organization, repository)
+    issue.github_timeline_offset = 2
+    issue.github_timeline_last_event_id = timeline_event_id(raw[1])
+    issue.github_timeline_etag = '"old-etag"'
+    await issue.save(session)
+
+    await github_reference.sync_issue_references(
+        session, organization, repository, issue
+    )
+
+    # The checkpoint doesn't match, the timeline is crawled in full
+    assert arequest.call_count == 2
+    assert "If-None-Match" not in arequest.call_args.kwargs["headers"]
+    assert parse.call_count == len(timeline)
+
+    await session.refresh(issue)
+    assert issue.github_timeline_offset == len(timeline)
+    assert issue.github_timeline_last_event_id == timeline_event_id(raw[-1])
+
+
+@pytest.mark.asyncio
+async def test_sync_issue_references_refreshes_external_pull_requests(
+    session: AsyncSession,
+    organization: Organization,
+    repository: Repository,
+    mocker: MockerFixture,
+) -> None:
+    mocker.patch("polar.integrations.github.service.reference.crawl_scheduler.require")
+    mocker.patch(
+        "githubkit.core.GitHubCore._arequest",
+        side_effect=[httpx.Response(304, request=httpx.Request("GET", ""))],
+    )
+    async_get = mocker.patch(
+        "githubkit.rest.pulls.PullsClient.async_get",
+        return_value=MagicMock(
+            parsed_data=MagicMock(
+                title="Fix the crash",
+                state="closed",
+                draft=False,
+                merged_at="2023-07-01T10:00:00Z",
+            )
+        ),
+    )
+
+    issue = await create_issue(session, organization, repository)
+    issue.github_timeline_offset = 2
+    issue.github_timeline_last_event_id = "IE_2"
+    issue.github_timeline_etag = '"etag"'
+    await issue.save(session)
+
+    def pull_request_ref(number: int, state: str) -> IssueReference:
+        return IssueReference(
+            issue_id=issue.id,
+            reference_type=ReferenceType.EXTERNAL_GITHUB_PULL_REQUEST,
+            external_id=f"https://github.com/other/repo/pull/{number}",
+            external_source={
+                "organization_name": "other",
+                "repository_name": "repo",
+                "title": "Fix the crash",
+                "number": number,
+                "user_login": "other",
+                "user_avatar": "https://avatars.githubusercontent.com/u/1",
+                "state": state,
+                "is_merged": state == "closed",
+                "is_draft": False,
+            },
+        )
+
+    await github_reference.upsert_references(
+        session, [pull_request_ref(1, "open"), pull_request_ref(2, "closed")]
+    )
+
+    await github_reference.sync_issue_references(
+        session, organization, repository, issue
+    )
+
+    # The timeline didn't change, but the open pull request was merged since
+    async_get.assert_called_once()
+    assert async_get.call_args.kwargs["pull_number"] == 1
+    refs = await github_reference.list_existing(
+        session, [pull_request_ref(1, "open")]
+    )
+    (ref,) = refs.values()
+    assert ref.external_source["state"] == "closed"
+    assert ref.external_source["is_merged"] is True
+
+
+@pytest.mark.asyncio
+async def test_upsert_references(
+    session: AsyncSession,
+    organization: Organization,
+    repository: Repository,
+) -> None:
+    issue = await create_issue(session, organization, repository)
+
+    def commit_ref(sha: str, message: str) -> IssueReference:
+        return IssueReference(
+            issue_id=issue.id,
+            reference_type=ReferenceType.EXTERNAL_GITHUB_COMMIT,
+            external_id=sha,
+            external_source={"commit_id": sha, "message": message},
+        )
+
+    created = await github_reference.upsert_references(
+        session, [commit_ref("aaa", "first"), commit_ref("bbb", "first")]
+    )
+    assert [r.was_created for r in created] == [True, True]
+
+    upserted = await github_reference.upsert_references(
+        session,
+        [
+            commit_ref("bbb", "ignored, superseded below"),
+            commit_ref("bbb", "second"),
+            commit_ref("ccc", "first"),
+        ],
+    )
+    by_id = {r.external_id: r for r in upserted}
+    assert len(upserted) == 2
+    assert by_id["bbb"].was_updated
+    assert by_id["bbb"].external_source["message"] == "second"
+    assert by_id["ccc"].was_created
+
+    assert await github_reference.upsert_references(session, []) == []
+
+
+@pytest.mark.asyncio
+async def test_annotate_many(
+    session: AsyncSession,
+    organization: Organization,
+    repository: Repository,
+    mocker: MockerFixture,
+) -> None:
+    issue = await create_issue(session, organization, repository)
+    other_issue = await create_issue(session, organization, repository)
+    unseen, stored = uuid.uuid4().hex, uuid.uuid4().hex
+
+    def commit_ref(
+        issue: Issue, sha: str, message: str | None = None
+    ) -> IssueReference:
+        return IssueReference(
+            issue_id=issue.id,
+            reference_type=ReferenceType.EXTERNAL_GITHUB_COMMIT,
+            external_id=sha,
+            external_source={
+                "organization_name": organization.name,
+                "repository_name": repository.name,
+                "user_login": "octocat",
+                "user_avatar": "https://avatars.githubusercontent.com/u/583231",
+                "commit_id": sha,
+                "branch_name": "main" if message else None,
+                "message": message,
+            },
+        )
+
+    await github_reference.upsert_references(
+        session, [commit_ref(issue, stored, "Stored")]
+    )
+
+    fetch_commit_metadata = mocker.patch.object(
+        github_reference,
+        "fetch_commit_metadata",
+        return_value=CommitMetadata(message="Fetched", branch_name="main"),
+    )
+    annotated = await github_reference.annotate_many(
+        session,
+        [
+            commit_ref(issue, unseen),
+            commit_ref(other_issue, unseen),
+            commit_ref(issue, stored),
+        ],
+        client=MagicMock(),
+    )
+
+    # The commit referenced twice is fetched once, the stored one isn't
+    fetch_commit_metadata.assert_called_once()
+    assert fetch_commit_metadata.call_args.args[1] == (
+        organization.name,
+        repository.name,
+        unseen,
+    )
+    assert [r.external_source["message"] for r in annotated] == [
+        "Fetched",
+        "Fetched",
+        "Stored",
+    ]
+    assert (organization.name, repository.name, unseen) in (
+        await commit_cache.get_many([(organization.name, repository.name, unseen)])
+    )
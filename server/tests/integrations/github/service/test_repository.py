@@ -0,0 +1,60 @@
+from typing import Any, AsyncIterator
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from polar.integrations.github.service import github_repository
+from polar.kit.hook import Hook
+from polar.models.organization import Organization
+from polar.models.repository import Repository
+from polar.postgres import AsyncSession
+from polar.repository.hooks import SyncedHook
+
+
+async def items(count: int) -> AsyncIterator[MagicMock]:
+    for i in range(count):
+        yield MagicMock(number=i, pull_request=i % 10 == 0)
+
+
+@pytest.mark.asyncio
+async def test_store_paginated_resource_by_page(
+    session: AsyncSession,
+    organization: Organization,
+    repository: Repository,
+) -> None:
+    async def store_many(
+        session: AsyncSession, *, data: list[Any], **kwargs: Any
+    ) -> list[Any]:
+        return [MagicMock(id=item.number) for item in data]
+
+    store_many_method = AsyncMock(side_effect=store_many)
+    synced_hooks: list[SyncedHook] = []
+
+    async def on_synced(hook: SyncedHook) -> None:
+        synced_hooks.append(hook)
+
+    on_sync_signal: Hook[SyncedHook] = Hook()
+    on_sync_signal.add(on_synced)
+
+    synced, errors = await github_repository.store_paginated_resource(
+        session,
+        paginator=items(250),
+        store_many_method=store_many_method,
+        organization=organization,
+        repository=repository,
+        resource_type="issue",
+        per_page=100,
+        skip_condition=lambda data: data.pull_request,
+        on_sync_signal=on_sync_signal,
+    )
+
+    assert (synced, errors) == (250, 0)
+    # One statement per page, without the skipped items
+    assert [len(c.kwargs["data"]) for c in store_many_method.call_args_list] == [
+        90,
+        90,
+        45,
+    ]
+    # One hook per page
+    assert [hook.synced for hook in synced_hooks] == [100, 200, 250]
+    assert synced_hooks[-1].record.id == 249
@@ -153,3 +153,22 @@ def test_other_domains() -> None:
         )
         == []
     )
+
+
+def test_parse_mixed_urls() -> None:
+    assert github_url.parse_urls(
+        "Fixes #1, see org/repo#2 and https://github.com/other/repo/issues/3 "
+        "and http://github.com/org/repo#2"
+    ) == [
+        GitHubIssue(raw="#1", number=1),
+        GitHubIssue(raw="org/repo#2", owner="org", repo="repo", number=2),
+        GitHubIssue(
+            raw="https://github.com/other/repo/issues/3",
+            owner="other",
+            repo="repo",
+            number=3,
+        ),
+    ]
+
+    # "/issues/" only follows a GitHub URL
+    assert github_url.parse_urls("org/repo/issues/4") == []
@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+from uuid import uuid4
+
+import pytest
+import pytest_asyncio
+from pytest_mock import MockerFixture
+
+from polar.integrations.github.backfill import (
+    BackfillResource,
+    RepositoryBackfill,
+    repository_backfill_value,
+)
+from polar.redis import redis
+
+INSTALLATION_ID = 42
+
+
+def repository(open_issues: int, pushed_days_ago: float) -> MagicMock:
+    return MagicMock(
+        id=uuid4(),
+        is_archived=False,
+        open_issues=open_issues,
+        repository_pushed_at=datetime.now(timezone.utc)
+        - timedelta(days=pushed_days_ago),
+    )
+
+
+@pytest_asyncio.fixture
+async def backfill() -> RepositoryBackfill:
+    backfill = RepositoryBackfill(concurrency=2)
+    await redis.delete(
+        backfill.state_key(INSTALLATION_ID),
+        backfill.queue_key(INSTALLATION_ID),
+        backfill.running_key(INSTALLATION_ID),
+    )
+    return backfill
+
+
+def test_repository_backfill_value() -> None:
+    active = repository(open_issues=10, pushed_days_ago=0)
+    popular = repository(open_issues=5000, pushed_days_ago=365)
+    stale = repository(open_issues=10, pushed_days_ago=365)
+    archived = repository(open_issues=5000, pushed_days_ago=0)
+    archived.is_archived = True
+
+    values = [repository_backfill_value(r) for r in (active, popular, stale, archived)]
+    assert values == sorted(values, reverse=True)
+
+
+@pytest.mark.asyncio
+async def test_backfill_concurrency(
+    backfill: RepositoryBackfill, mocker: MockerFixture
+) -> None:
+    enqueue_many = mocker.patch("polar.integrations.github.backfill.enqueue_many")
+    organization_id = uuid4()
+
+    low = repository(open_issues=0, pushed_days_ago=365)
+    high = repository(open_issues=100, pushed_days_ago=1)
+    highest = repository(open_issues=100, pushed_days_ago=0)
+    await backfill.start(INSTALLATION_ID, organization_id, [low, high, highest])
+
+    # The two most active repositories are started
+    enqueue_many.assert_called_once_with(
+        "github.repo.backfill",
+        [
+            (INSTALLATION_ID, organization_id, highest.id),
+            (INSTALLATION_ID, organization_id, high.id),
+        ],
+    )
+    progress = await backfill.progress(INSTALLATION_ID)
+    assert (progress.status, progress.queued, progress.running) == (
+        "in_progress",
+        1,
+        2,
+    )
+
+    # Completing one starts the next one
+    await backfill.complete(INSTALLATION_ID, highest.id)
+    enqueue_many.assert_called_with(
+        "github.repo.backfill", [(INSTALLATION_ID, organization_id, low.id)]
+    )
+
+    await backfill.complete(INSTALLATION_ID, high.id)
+    await backfill.complete(INSTALLATION_ID, low.id)
+    progress = await backfill.progress(INSTALLATION_ID)
+    assert progress.status == "done"
+    assert INSTALLATION_ID not in await backfill.installations()
+
+
+@pytest.mark.asyncio
+async def test_backfill_resume(
+    backfill: RepositoryBackfill, mocker: MockerFixture
+) -> None:
+    enqueue_many = mocker.patch("polar.integrations.github.backfill.enqueue_many")
+    organization_id = uuid4()
+
+    repo = repository(open_issues=100, pushed_days_ago=0)
+    await backfill.start(INSTALLATION_ID, organization_id, [repo])
+    assert await backfill.get_cursor(repo.id) == (BackfillResource.issues, 1)
+
+    await backfill.checkpoint(
+        INSTALLATION_ID, repo.id, BackfillResource.pull_requests, 3
+    )
+    assert await backfill.get_cursor(repo.id) == (BackfillResource.pull_requests, 3)
+
+    # Still running, nothing to start
+    assert await backfill.fill(INSTALLATION_ID) == []
+
+    # Its job died, the lease expires and it's started again, from its cursor
+    await redis.zadd(backfill.running_key(INSTALLATION_ID), {str(repo.id): 0})
+    assert await backfill.fill(INSTALLATION_ID) == [repo.id]
+    assert await backfill.get_cursor(repo.id) == (BackfillResource.pull_requests, 3)
+    assert enqueue_many.call_count == 2
+
+    # Starting the backfill again doesn't start it over
+    await backfill.start(INSTALLATION_ID, organization_id, [repo])
+    assert await backfill.get_cursor(repo.id) == (BackfillResource.pull_requests, 3)
+    assert enqueue_many.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_backfill_gives_up(
+    backfill: RepositoryBackfill, mocker: MockerFixture
+) -> None:
+    mocker.patch("polar.integrations.github.backfill.enqueue_many")
+    backfill.max_attempts = 2
+    organization_id = uuid4()
+
+    repo = repository(open_issues=100, pushed_days_ago=0)
+    await backfill.start(INSTALLATION_ID, organization_id, [repo])
+
+    # Storing a page resets its attempts
+    await redis.zadd(backfill.running_key(INSTALLATION_ID), {str(repo.id): 0})
+    assert await backfill.fill(INSTALLATION_ID) == [repo.id]
+    await backfill.checkpoint(INSTALLATION_ID, repo.id, BackfillResource.issues, 2)
+
+    # Its job keeps dying without storing a page
+    for _ in range(2):
+        await redis.zadd(backfill.running_key(INSTALLATION_ID), {str(repo.id): 0})
+        assert await backfill.fill(INSTALLATION_ID) == [repo.id]
+
+    await redis.zadd(backfill.running_key(INSTALLATION_ID), {str(repo.id): 0})
+    assert await backfill.fill(INSTALLATION_ID) == []
+    status = await redis.hget(backfill.repository_key(repo.id), "status")
+    assert status == "failed"
+    progress = await backfill.progress(INSTALLATION_ID)
+    assert progress.status == "done"
@@ -0,0 +1,61 @@
+import uuid
+from datetime import timedelta
+
+import pytest
+
+from polar.integrations.github.cache import RedisCache
+
+
+@pytest.mark.asyncio
+async def test_two_tiers() -> None:
+    key = f"test:{uuid.uuid4()}"
+    cache = RedisCache()
+
+    assert await cache.aget(key) is None
+    assert cache.stats.misses == 1
+
+    await cache.aset(key, "token", timedelta(minutes=1))
+    assert await cache.aget(key) == "token"
+    assert cache.stats.local_hits == 1
+
+    # Another process only has it in Redis, and keeps it once fetched
+    other = RedisCache()
+    assert await other.aget(key) == "token"
+    assert await other.aget(key) == "token"
+    assert other.stats.redis_hits == 1
+    assert other.stats.local_hits == 1
+
+    # The sync client shares both tiers
+    assert other.get(key) == "token"
+
+
+@pytest.mark.asyncio
+async def test_aget_many() -> None:
+    keys = [f"test:{uuid.uuid4()}" for _ in range(3)]
+    cache = RedisCache()
+    await cache.aset_many({keys[0]: "a", keys[1]: "b"}, timedelta(minutes=1))
+
+    assert await RedisCache().aget_many(keys) == {
+        keys[0]: "a",
+        keys[1]: "b",
+        keys[2]: None,
+    }
+
+
+def test_lru_eviction() -> None:
+    cache = RedisCache(max_size=2)
+    ex = timedelta(minutes=1)
+    cache._set_local("a", "1", ex)
+    cache._set_local("b", "2", ex)
+    assert cache._get_local("a") == "1"
+
+    cache._set_local("c", "3", ex)
+    assert cache._get_local("b") is None
+    assert cache._get_local("a") == "1"
+    assert cache._get_local("c") == "3"
+
+
+def test_expired() -> None:
+    cache = RedisCache()
+    cache._set_local("a", "1", timedelta(seconds=-1))
+    assert cache._get_local("a") is None
@@ -0,0 +1,54 @@
+import pytest
+import pytest_asyncio
+
+from polar.integrations.github.commit_cache import CommitCache, CommitMetadata
+from polar.redis import redis
+
+
+@pytest_asyncio.fixture
+async def commit_cache() -> CommitCache:
+    cache = CommitCache()
+    keys = await redis.keys(f"{cache.prefix}*")
+    if keys:
+        await redis.delete(*keys)
+    return cache
+
+
+@pytest.mark.asyncio
+async def test_get_many(commit_cache: CommitCache) -> None:
+    cached = ("polarsource", "polar", "a" * 40)
+    uncached = ("polarsource", "polar", "b" * 40)
+
+    await commit_cache.set_many(
+        {cached: CommitMetadata(message="Fix crash", branch_name="main")}
+    )
+
+    assert await commit_cache.get_many([cached, uncached, cached]) == {
+        cached: CommitMetadata(message="Fix crash", branch_name="main")
+    }
+    # Owner and repository names are case insensitive
+    assert ("PolarSource", "Polar", "a" * 40) in await commit_cache.get_many(
+        [("PolarSource", "Polar", "a" * 40)]
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_many_empty(commit_cache: CommitCache) -> None:
+    assert await commit_cache.get_many([]) == {}
+
+
+@pytest.mark.asyncio
+async def test_set_many_incomplete(commit_cache: CommitCache) -> None:
+    complete = ("polarsource", "polar", "a" * 40)
+    no_branch = ("polarsource", "polar", "b" * 40)
+
+    await commit_cache.set_many(
+        {
+            complete: CommitMetadata(message="Fix crash", branch_name="main"),
+            no_branch: CommitMetadata(message="Fix crash"),
+        }
+    )
+
+    incomplete_ttl = commit_cache.incomplete_ttl.total_seconds()
+    assert await redis.ttl(commit_cache.key(complete)) > incomplete_ttl
+    assert 0 < await redis.ttl(commit_cache.key(no_branch)) <= incomplete_ttl
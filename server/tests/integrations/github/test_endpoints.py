@@ -0,0 +1,167 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from httpx import AsyncClient
+from pytest_mock import MockerFixture
+
+from polar.integrations.github.badge_cache import badge_amount_cache
+from polar.integrations.github.ingestion import queue_depth, webhook_overflow
+from polar.models.issue import Issue
+from polar.models.organization import Organization
+from polar.models.repository import Repository
+from polar.postgres import AsyncSession
+from polar.worker import get_pool
+from tests.fixtures.webhook import TestWebhookFactory
+
+
+@pytest.mark.asyncio
+async def test_webhook_enqueues_raw_payload(
+    mocker: MockerFixture,
+    github_webhook: TestWebhookFactory,
+) -> None:
+    mocker.patch.object(queue_depth, "is_overloaded", AsyncMock(return_value=False))
+    enqueue_job_mock = mocker.patch(
+        "arq.connections.ArqRedis.enqueue_job",
+        return_value=MagicMock(job_id="job_id"),
+    )
+
+    hook = github_webhook.create("issues.opened")
+    response = await hook.send()
+
+    assert response.status_code == 202
+    assert response.json()["job_id"] == "job_id"
+
+    enqueue_job_mock.assert_called_once()
+    name, scope, delivery_id, payload = enqueue_job_mock.call_args.args
+    assert name == "github.webhook.dispatch"
+    assert scope == "issues"
+    assert delivery_id == hook.headers["X-GitHub-Delivery"]
+    assert payload == hook.data
+
+
+@pytest.mark.asyncio
+async def test_webhook_invalid_signature(
+    mocker: MockerFixture,
+    github_webhook: TestWebhookFactory,
+) -> None:
+    enqueue_job_mock = mocker.patch("arq.connections.ArqRedis.enqueue_job")
+
+    hook = github_webhook.create("issues.opened")
+    hook.headers["X-Hub-Signature-256"] = "sha256=invalid"
+    response = await hook.send()
+
+    assert response.status_code == 404
+    enqueue_job_mock.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_webhook_buffers_when_overloaded(
+    mocker: MockerFixture,
+    github_webhook: TestWebhookFactory,
+) -> None:
+    mocker.patch.object(queue_depth, "is_overloaded", AsyncMock(return_value=True))
+    push_mock = mocker.patch.object(
+        webhook_overflow, "push", AsyncMock(return_value=True)
+    )
+    enqueue_job_mock = mocker.patch("arq.connections.ArqRedis.enqueue_job")
+
+    hook = github_webhook.create("issues.opened")
+    response = await hook.send()
+
+    assert response.status_code == 202
+    enqueue_job_mock.assert_not_called()
+    push_mock.assert_awaited_once_with(
+        "issues", hook.headers["X-GitHub-Delivery"], hook.data, if_not_empty=False
+    )
+
+
+@pytest.mark.asyncio
+async def test_webhook_overflow_keeps_order(mocker: MockerFixture) -> None:
+    mocker.patch("polar.integrations.github.ingestion.enqueue_many", AsyncMock())
+    redis = await get_pool()
+    await redis.delete(webhook_overflow.key)
+
+    # Nothing buffered, delivered directly
+    assert not await webhook_overflow.push(
+        "issues", "delivery0", b'{"action": "opened"}', if_not_empty=True
+    )
+    assert await webhook_overflow.size() == 0
+
+    # Behind buffered deliveries until they're drained
+    assert await webhook_overflow.push("issues", "delivery1", b'{"action": "opened"}')
+    assert await webhook_overflow.push(
+        "issues", "delivery2", b'{"action": "closed"}', if_not_empty=True
+    )
+    assert await webhook_overflow.size() == 2
+
+    assert await webhook_overflow.drain(10) == 2
+    assert not await webhook_overflow.push(
+        "issues", "delivery3", b'{"action": "edited"}', if_not_empty=True
+    )
+
+
+@pytest.mark.asyncio
+async def test_webhook_overflow_drain(mocker: MockerFixture) -> None:
+    enqueue_many_mock = mocker.patch(
+        "polar.integrations.github.ingestion.enqueue_many", AsyncMock()
+    )
+    redis = await get_pool()
+    await redis.delete(webhook_overflow.key)
+
+    for i in range(3):
+        await webhook_overflow.push("issues", f"delivery{i}", b'{"action": "opened"}')
+
+    assert await webhook_overflow.drain(2) == 2
+    name, args_list = enqueue_many_mock.call_args.args
+    assert name == "github.webhook.dispatch"
+    assert args_list == [
+        ("issues", "delivery0", b'{"action": "opened"}'),
+        ("issues", "delivery1", b'{"action": "opened"}'),
+    ]
+    assert await webhook_overflow.size() == 1
+
+    assert await webhook_overflow.drain(0) == 0
+    assert await webhook_overflow.drain(10) == 1
+    assert await webhook_overflow.size() == 0
+
+
+@pytest.mark.asyncio
+async def test_badge_etag(
+    session: AsyncSession,
+    client: AsyncClient,
+    organization: Organization,
+    repository: Repository,
+    issue: Issue,
+) -> None:
+    issue.pledged_amount_sum = 4000
+    await issue.save(session)
+
+    url = (
+        f"/api/v1/integrations/github/{organization.name}/{repository.name}"
+        f"/issues/{issue.number}/badges/pledge"
+    )
+    response = await client.get(url)
+    assert response.status_code == 200
+    assert response.json() == {"badge_type": "pledge", "amount": 4000}
+    assert response.headers["Cache-Control"].startswith("public, max-age=")
+    etag = response.headers["ETag"]
+
+    response = await client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+    # The pledge hooks push new amounts to the cache
+    badge = (organization.name, repository.name, issue.number)
+    await badge_amount_cache.set(badge, 6000)
+    response = await client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["amount"] == 6000
+    assert response.headers["ETag"] != etag
+
+
+@pytest.mark.asyncio
+async def test_badge_not_found(client: AsyncClient) -> None:
+    response = await client.get(
+        "/api/v1/integrations/github/nope/nope/issues/1/badges/pledge"
+    )
+    assert response.status_code == 404
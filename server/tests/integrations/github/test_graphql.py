@@ -0,0 +1,110 @@
+from uuid import uuid4
+
+from polar.integrations.github.graphql import (
+    build_issues_query,
+    failed_issues,
+    issue_from_graphql,
+)
+from polar.models import Issue
+
+
+def actor(login: str, id: int) -> dict[str, object]:
+    return {
+        "__typename": "User",
+        "login": login,
+        "databaseId": id,
+        "avatarUrl": f"https://avatars.githubusercontent.com/u/{id}",
+        "url": f"https://github.com/{login}",
+    }
+
+
+def test_build_issues_query() -> None:
+    query, variables, aliases = build_issues_query(
+        [("polarsource", "polar", 1), ("polarsource", "polar", 2), ("a", "b", 3)]
+    )
+
+    assert variables == {
+        "owner0": "polarsource",
+        "name0": "polar",
+        "owner1": "a",
+        "name1": "b",
+    }
+    assert aliases == {
+        ("polarsource", "polar", 1): ("r0", "i0"),
+        ("polarsource", "polar", 2): ("r0", "i1"),
+        ("a", "b", 3): ("r1", "i0"),
+    }
+    assert "r0: repository(owner: $owner0, name: $name0)" in query
+    assert "i1: issue(number: 2) { ...IssueFields }" in query
+    assert "fragment IssueFields on Issue" in query
+
+
+def test_issue_from_graphql() -> None:
+    organization_id, repository_id = uuid4(), uuid4()
+    node = {
+        "databaseId": 1234,
+        "number": 7,
+        "title": "Crash on start",
+        "body": "It crashes",
+        "state": "CLOSED",
+        "stateReason": "NOT_PLANNED",
+        "authorAssociation": "CONTRIBUTOR",
+        "createdAt": "2023-06-01T10:00:00Z",
+        "updatedAt": "2023-06-02T10:00:00Z",
+        "closedAt": "2023-06-02T10:00:00Z",
+        "author": actor("alice", 1),
+        "assignees": {"nodes": [actor("bob", 2)]},
+        "labels": {
+            "nodes": [
+                {
+                    "id": "LA_1",
+                    "name": "polar",
+                    "color": "ffffff",
+                    "description": None,
+                    "isDefault": False,
+                    "url": "https://github.com/a/b/labels/polar",
+                }
+            ]
+        },
+        "milestone": None,
+        "comments": {"totalCount": 3},
+        "reactionGroups": [
+            {"content": "THUMBS_UP", "reactors": {"totalCount": 4}},
+            {"content": "CONFUSED", "reactors": {"totalCount": 1}},
+        ],
+        "timelineItems": {"nodes": [{"actor": actor("bob", 2)}]},
+    }
+
+    issue = issue_from_graphql(node, organization_id, repository_id)
+
+    assert issue.external_id == 1234
+    assert issue.state == Issue.State.CLOSED
+    assert issue.state_reason == "not_planned"
+    assert issue.author["login"] == "alice"
+    assert issue.assignee["id"] == 2
+    assert issue.closed_by["login"] == "bob"
+    assert issue.labels[0]["name"] == "polar"
+    assert issue.reactions["plus_one"] == 4
+    assert issue.reactions["total_count"] == 5
+    assert issue.has_pledge_badge_label is True
+    assert issue.positive_reactions_count == 4
+    assert issue.total_engagement_count == 8
+
+
+def test_failed_issues() -> None:
+    _, _, aliases = build_issues_query(
+        [("polarsource", "polar", 1), ("polarsource", "polar", 2), ("a", "b", 3)]
+    )
+
+    assert failed_issues(
+        [
+            {"type": "NOT_FOUND", "path": ["r0", "i0"], "message": "Not found"},
+            {"type": "RATE_LIMITED", "path": ["r0", "i1"], "message": "Limited"},
+        ],
+        aliases,
+    ) == {("polarsource", "polar", 2)}
+    # Failing a repository fails its issues
+    assert failed_issues([{"path": ["r1"], "message": "Timeout"}], aliases) == {
+        ("a", "b", 3)
+    }
+    assert failed_issues([{"message": "Something went wrong"}], aliases) == set(aliases)
@@ -0,0 +1,40 @@
+import pytest
+
+from polar.integrations.github import client as github
+from polar.integrations.github.payload import WebhookPayload
+from tests.fixtures.vcr import read_cassette
+
+
+def test_lazy_issue_fields() -> None:
+    cassette = read_cassette("github/webhooks/issues.labeled.json")
+    payload = WebhookPayload("issues", cassette["body"])
+    event = github.webhooks.parse_obj("issues", cassette["body"])
+    assert isinstance(event, github.webhooks.IssuesLabeled)
+
+    assert payload.action == "labeled"
+    assert payload.issue_id == event.issue.id
+    assert payload.repository_id == event.repository.id
+    assert payload.owner_id == event.repository.owner.id
+    assert payload.label_name == event.label.name
+    assert payload.issue_labels == event.issue.labels
+    assert payload.issue_assignees == event.issue.assignees
+    assert payload.issue_updated_at == event.issue.updated_at
+
+
+def test_event_is_parsed_once() -> None:
+    cassette = read_cassette("github/webhooks/issues.opened.json")
+    payload = WebhookPayload("issues", cassette["body"])
+
+    event = payload.event(github.webhooks.IssuesOpened)
+    assert event.issue.id == payload.issue_id
+    assert payload.event(github.webhooks.IssuesOpened) is event
+
+    assert WebhookPayload.of("issues", payload) is payload
+
+
+def test_event_unexpected_type() -> None:
+    cassette = read_cassette("github/webhooks/issues.opened.json")
+    payload = WebhookPayload("issues", cassette["body"])
+
+    with pytest.raises(Exception, match="unexpected webhook payload"):
+        payload.event(github.webhooks.IssuesClosed)
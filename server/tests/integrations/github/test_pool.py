@@ -0,0 +1,59 @@
+import pytest
+from pytest_mock import MockerFixture
+
+from polar.integrations.github.client import TokenAuthStrategy
+from polar.integrations.github.pool import ClientPool, PooledGitHub
+
+
+def factory(token: str) -> PooledGitHub[TokenAuthStrategy]:
+    return PooledGitHub(TokenAuthStrategy(token))
+
+
+def test_registry() -> None:
+    pool = ClientPool(max_clients=2)
+
+    a = pool.get("a", lambda: factory("a"))
+    assert pool.get("a", lambda: factory("other")) is a
+    b = pool.get("b", lambda: factory("b"))
+    assert b is not a
+
+    # a was used least recently
+    pool.get("b", lambda: factory("b"))
+    pool.get("c", lambda: factory("c"))
+    assert pool.get("b", lambda: factory("b")) is b
+    assert pool.get("a", lambda: factory("a")) is not a
+
+
+def test_idle_eviction(mocker: MockerFixture) -> None:
+    monotonic = mocker.patch("polar.integrations.github.pool.time.monotonic")
+    monotonic.return_value = 1000.0
+    pool = ClientPool(idle_timeout=60)
+
+    a = pool.get("a", lambda: factory("a"))
+    b = pool.get("b", lambda: factory("b"))
+
+    monotonic.return_value = 1050.0
+    assert pool.get("b", lambda: factory("b")) is b
+
+    monotonic.return_value = 1100.0
+    assert pool.get("b", lambda: factory("b")) is b
+    assert pool.get("a", lambda: factory("a")) is not a
+
+
+@pytest.mark.asyncio
+async def test_persistent_http_client(mocker: MockerFixture) -> None:
+    pool = ClientPool()
+    mocker.patch("polar.integrations.github.pool.pool", pool)
+    github = factory("a")
+
+    async with github.get_async_client() as first:
+        pass
+    async with github.get_async_client() as second:
+        pass
+
+    assert first is second
+    assert not first.is_closed
+    # Sharing the connections of the pool
+    assert first._transport is pool.transport
+
+    await pool.close()
@@ -0,0 +1,137 @@
+import time
+from uuid import uuid4
+
+import pytest
+import pytest_asyncio
+from arq.worker import Retry
+from pytest_mock import MockerFixture
+
+from polar.integrations.github.scheduler import BudgetExhausted, CrawlScheduler
+from polar.integrations.github.tasks.utils import retry_when_budget_exhausted
+from polar.redis import redis
+
+
+def rate_limit_headers(remaining: int, reset: int) -> dict[str, str]:
+    return {
+        "X-RateLimit-Limit": "5000",
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(reset),
+    }
+
+
+@pytest_asyncio.fixture
+async def scheduler() -> CrawlScheduler:
+    scheduler = CrawlScheduler(reserve=10)
+    installation_id = 42
+    await redis.delete(
+        scheduler.budget_key(installation_id), scheduler.queue_key(installation_id)
+    )
+    return scheduler
+
+
+@pytest.mark.asyncio
+async def test_take_within_budget(scheduler: CrawlScheduler) -> None:
+    reset = int(time.time()) + 600
+    await scheduler.record(42, rate_limit_headers(remaining=15, reset=reset))
+
+    assert await scheduler.take(42, 3) == 3
+    # Only 2 left above the reserve
+    assert await scheduler.take(42, 3) == 2
+    assert await scheduler.take(42, 1) == 0
+
+    # Headers from a response that raced with our takes don't hand back budget
+    await scheduler.record(42, rate_limit_headers(remaining=14, reset=reset))
+    assert await scheduler.take(42, 1) == 0
+
+
+@pytest.mark.asyncio
+async def test_take_unknown_budget(scheduler: CrawlScheduler) -> None:
+    assert await scheduler.take(42, 100) == 100
+
+
+@pytest.mark.asyncio
+async def test_require_exhausted(scheduler: CrawlScheduler) -> None:
+    reset = int(time.time()) + 600
+    await scheduler.record(42, rate_limit_headers(remaining=5, reset=reset))
+
+    with pytest.raises(BudgetExhausted) as e:
+        await scheduler.require(42)
+    assert 0 < e.value.defer <= 601
+
+
+@pytest.mark.asyncio
+async def test_retry_when_budget_exhausted() -> None:
+    @retry_when_budget_exhausted
+    async def crawl() -> None:
+        raise BudgetExhausted(42, 60)
+
+    with pytest.raises(Retry) as e:
+        await crawl()
+    assert e.value.defer_score == 60_000
+
+
+@pytest.mark.asyncio
+async def test_drain_most_valuable_first(
+    scheduler: CrawlScheduler, mocker: MockerFixture
+) -> None:
+    enqueue_many = mocker.patch("polar.integrations.github.scheduler.enqueue_many")
+
+    reset = int(time.time()) + 600
+    await scheduler.record(42, rate_limit_headers(remaining=12, reset=reset))
+
+    low, high, highest = uuid4(), uuid4(), uuid4()
+    await scheduler.schedule(
+        42, "github.issue.sync", {low: 1.0, high: 100.0, highest: 10_000.0}
+    )
+
+    assert await scheduler.drain(42) == 2
+    enqueue_many.assert_called_once_with("github.issue.sync", [(highest,), (high,)])
+
+    stats = await scheduler.stats(42)
+    assert stats.queue_depth == 1
+    assert stats.remaining == 10
+    assert stats.limit == 5000
+
+
+@pytest.mark.asyncio
+async def test_record_ignores_other_resources(scheduler: CrawlScheduler) -> None:
+    reset = int(time.time()) + 600
+    await scheduler.record(42, rate_limit_headers(remaining=15, reset=reset))
+    await scheduler.record(
+        42,
+        {
+            **rate_limit_headers(remaining=4999, reset=reset),
+            "X-RateLimit-Resource": "graphql",
+        },
+    )
+
+    assert await scheduler.take(42, 100) == 5
+
+
+@pytest.mark.asyncio
+async def test_drain_batches(scheduler: CrawlScheduler, mocker: MockerFixture) -> None:
+    enqueue_many = mocker.patch("polar.integrations.github.scheduler.enqueue_many")
+    scheduler.batch("github.issue.sync.batch", 2)
+
+    reset = int(time.time()) + 600
+    await scheduler.record(42, rate_limit_headers(remaining=12, reset=reset))
+
+    ids = [uuid4() for _ in range(5)]
+    await scheduler.schedule(
+        42,
+        "github.issue.sync.batch",
+        {id: float(value) for value, id in enumerate(reversed(ids))},
+    )
+    single = uuid4()
+    await scheduler.schedule(42, "github.issue.sync.issue_references", {single: 2.5})
+
+    # A request for each batch of 2, and one for the single job, fit in the budget
+    assert await scheduler.drain(42) == 2
+    assert enqueue_many.call_args_list == [
+        mocker.call("github.issue.sync.batch", [(ids[0:2],)]),
+        mocker.call("github.issue.sync.issue_references", [(single,)]),
+    ]
+
+    stats = await scheduler.stats(42)
+    assert stats.queue_depth == 3
+    assert stats.remaining == 10
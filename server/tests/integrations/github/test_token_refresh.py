@@ -0,0 +1,134 @@
+import asyncio
+import time
+from unittest.mock import MagicMock
+from uuid import uuid4
+
+import pytest
+from pytest_mock import MockerFixture
+
+from polar.enums import Platforms
+from polar.integrations.github.token_refresh import TokenRefresher, Tokens
+from polar.models.user import OAuthAccount, User
+from polar.postgres import AsyncSession
+
+
+def oauth_account(expires_in: int) -> OAuthAccount:
+    return OAuthAccount(
+        id=uuid4(),
+        access_token="old",
+        refresh_token="refresh",
+        expires_at=int(time.time()) + expires_in,
+    )
+
+
+def test_expires_within() -> None:
+    refresher = TokenRefresher(refresh_before=300, background_refresh_before=7200)
+
+    assert refresher.expires_within(oauth_account(60), refresher.refresh_before)
+    assert not refresher.expires_within(oauth_account(3600), refresher.refresh_before)
+    assert refresher.expires_within(
+        oauth_account(3600), refresher.background_refresh_before
+    )
+
+    # Tokens that don't expire, or can't be refreshed
+    oauth = oauth_account(60)
+    oauth.refresh_token = None
+    assert not refresher.expires_within(oauth, refresher.refresh_before)
+
+
+@pytest.mark.asyncio
+async def test_refresh_single_flight(mocker: MockerFixture) -> None:
+    refresher = TokenRefresher()
+    tokens = Tokens(access_token="new", expires_at=None, refresh_token="rotated")
+
+    async def refresh_locked(*args: object) -> Tokens:
+        await asyncio.sleep(0.05)
+        return tokens
+
+    refresh_locked_mock = mocker.patch.object(
+        refresher, "_refresh_locked", side_effect=refresh_locked
+    )
+
+    oauth = oauth_account(60)
+    # Another request for the same account, holding its own instance
+    other = oauth_account(60)
+    other.id = oauth.id
+    await asyncio.gather(
+        refresher.refresh(MagicMock(), oauth),
+        refresher.refresh(MagicMock(), other),
+    )
+
+    refresh_locked_mock.assert_called_once()
+    assert oauth.access_token == other.access_token == "new"
+    assert oauth.refresh_token == other.refresh_token == "rotated"
+
+    # Nothing left in flight, the next refresh refreshes again
+    await refresher.refresh(MagicMock(), oauth)
+    assert refresh_locked_mock.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_refresh_single_flight_error(mocker: MockerFixture) -> None:
+    refresher = TokenRefresher()
+
+    async def refresh_locked(*args: object) -> Tokens:
+        await asyncio.sleep(0.05)
+        raise RuntimeError("bad_refresh_token")
+
+    mocker.patch.object(refresher, "_refresh_locked", side_effect=refresh_locked)
+
+    oauth = oauth_account(60)
+    results = await asyncio.gather(
+        refresher.refresh(MagicMock(), oauth),
+        refresher.refresh(MagicMock(), oauth),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert oauth.access_token == "old"
+
+
+@pytest.mark.asyncio
+async def test_schedule_once_per_lease(mocker: MockerFixture) -> None:
+    refresher = TokenRefresher()
+    enqueue_many_mock = mocker.patch(
+        "polar.integrations.github.token_refresh.enqueue_many"
+    )
+
+    first, second = uuid4(), uuid4()
+    assert await refresher.schedule([first]) == 1
+    enqueue_many_mock.assert_called_once_with("github.user.refresh_token", [(first,)])
+
+    # Every request of an active user finds the lease taken
+    assert await refresher.schedule([first]) == 0
+    assert await refresher.schedule([first, second]) == 1
+    assert enqueue_many_mock.call_args.args[1] == [(second,)]
+
+
+@pytest.mark.asyncio
+async def test_list_expiring(session: AsyncSession, user: User) -> None:
+    refresher = TokenRefresher(background_refresh_before=7200)
+
+    accounts = {}
+    for name, expires_in, refresh_token in [
+        ("expiring", 3600, "refresh"),
+        ("later", 8 * 3600, "refresh"),
+        ("expired", -60, "refresh"),
+        ("not_refreshable", 3600, None),
+    ]:
+        accounts[name] = await OAuthAccount.create(
+            session=session,
+            platform=Platforms.github,
+            access_token="token",
+            refresh_token=refresh_token,
+            expires_at=int(time.time()) + expires_in,
+            account_id=str(uuid4()),
+            account_email=f"{name}@example.com",
+            user_id=user.id,
+        )
+
+    expiring = await refresher.list_expiring(session)
+    assert accounts["expiring"].id in expiring
+    assert not {
+        accounts[name].id for name in ("later", "expired", "not_refreshable")
+    } & set(expiring)
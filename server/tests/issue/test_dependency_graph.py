@@ -0,0 +1,113 @@
+import pytest
+
+from polar.issue.dependency_graph import issue_dependency_graph
+from polar.models.issue import Issue
+from polar.models.issue_dependency import IssueDependency
+from polar.models.organization import Organization
+from polar.models.repository import Repository
+from polar.postgres import AsyncSession
+from tests.fixtures.random_objects import create_issue, create_repository
+
+
+async def depend(
+    session: AsyncSession, dependent: Issue, dependency: Issue
+) -> IssueDependency:
+    dep = await IssueDependency.create(
+        session=session,
+        organization_id=dependent.organization_id,
+        repository_id=dependent.repository_id,
+        dependent_issue_id=dependent.id,
+        dependency_issue_id=dependency.id,
+    )
+    await issue_dependency_graph.add_dependencies(session, [dep])
+    return dep
+
+
+async def closure(
+    session: AsyncSession, repository: Repository
+) -> dict[tuple[str, str], int]:
+    rows = await issue_dependency_graph.list_dependencies_for_repositories(
+        session, [repository.id]
+    )
+    return {(r.dependent_issue.title, r.dependency_issue.title): r.depth for r in rows}
+
+
+@pytest.mark.asyncio
+async def test_add_dependencies(
+    session: AsyncSession, organization: Organization, repository: Repository
+) -> None:
+    other = await create_repository(session, organization)
+    a, b, c, d = [await create_issue(session, organization, repository) for _ in "abcd"]
+    for issue, title in zip((a, b, c, d), "abcd"):
+        issue.title = title
+        await issue.save(session)
+
+    await depend(session, a, b)
+    await depend(session, b, c)
+    # Depending on a, d depends on everything a depends on
+    await depend(session, d, a)
+
+    assert await closure(session, repository) == {
+        ("a", "b"): 1,
+        ("a", "c"): 2,
+        ("b", "c"): 1,
+        ("d", "a"): 1,
+        ("d", "b"): 2,
+        ("d", "c"): 3,
+    }
+
+    # A shortcut shortens the chain
+    await depend(session, d, c)
+    assert (await closure(session, repository))[("d", "c")] == 1
+
+    assert (
+        await issue_dependency_graph.list_dependencies_for_repositories(
+            session, [other.id]
+        )
+        == []
+    )
+    dependents = await issue_dependency_graph.list_dependents_for_repositories(
+        session, [repository.id], max_depth=1
+    )
+    assert {(r.dependent_issue_id, r.dependency_issue_id) for r in dependents} == {
+        (a.id, b.id),
+        (b.id, c.id),
+        (d.id, a.id),
+        (d.id, c.id),
+    }
+
+
+@pytest.mark.asyncio
+async def test_cycles(
+    session: AsyncSession, organization: Organization, repository: Repository
+) -> None:
+    a, b, c = [await create_issue(session, organization, repository) for _ in "abc"]
+
+    await depend(session, a, b)
+    await depend(session, b, c)
+    assert not await issue_dependency_graph.creates_cycle(session, a.id, c.id)
+    assert await issue_dependency_graph.creates_cycle(session, c.id, a.id)
+    assert (
+        await issue_dependency_graph.list_cyclic_issues(session, [repository.id]) == []
+    )
+
+    await depend(session, c, a)
+    assert set(
+        await issue_dependency_graph.list_cyclic_issues(session, [repository.id])
+    ) == {a.id, b.id, c.id}
+
+    rows = await issue_dependency_graph.list_dependencies_for_repositories(
+        session, [repository.id]
+    )
+    # Everything depends on everything else, but not on itself
+    assert len(rows) == 6
+    assert all(r.dependent_issue_id != r.dependency_issue_id for r in rows)
+
+    before = {(r.dependent_issue_id, r.dependency_issue_id): r.depth for r in rows}
+    await issue_dependency_graph.rebuild(session)
+    rows = await issue_dependency_graph.list_dependencies_for_repositories(
+        session, [repository.id]
+    )
+    assert {(r.dependent_issue_id, r.dependency_issue_id): r.depth for r in rows} == (
+        before
+    )
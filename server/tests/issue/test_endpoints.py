@@ -0,0 +1,62 @@
+from datetime import timedelta
+
+import pytest
+from httpx import AsyncClient
+from pytest_mock import MockerFixture
+
+from polar.app import app
+from polar.kit.utils import utc_now
+from polar.models.issue import Issue
+from polar.models.organization import Organization
+from polar.models.repository import Repository
+from polar.postgres import AsyncSession
+from polar.redis import redis
+
+
+@pytest.mark.asyncio
+async def test_get_or_sync_external_stored(
+    organization: Organization,
+    repository: Repository,
+    issue: Issue,
+    mocker: MockerFixture,
+) -> None:
+    sync = mocker.patch(
+        "polar.issue.endpoints.github_organization_service.sync_external_org_with_repo_and_issue"
+    )
+    enqueue_job = mocker.patch("polar.issue.endpoints.enqueue_job")
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get(
+            f"/api/v1/github/{organization.name}/{repository.name}/issues/{issue.number}"
+        )
+
+    assert response.status_code == 200
+    assert response.json()["issue"]["id"] == str(issue.id)
+    sync.assert_not_called()
+    enqueue_job.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_get_or_sync_external_stale(
+    session: AsyncSession,
+    organization: Organization,
+    repository: Repository,
+    issue: Issue,
+    mocker: MockerFixture,
+) -> None:
+    enqueue_job = mocker.patch("polar.issue.endpoints.enqueue_job")
+    await redis.delete(f"issue:external_refresh:{issue.id}")
+
+    issue.github_issue_fetched_at = utc_now() - timedelta(hours=1)
+    await issue.save(session)
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        for _ in range(3):
+            response = await ac.get(
+                f"/api/v1/github/{organization.name}/{repository.name}"
+                f"/issues/{issue.number}"
+            )
+            assert response.status_code == 200
+
+    # Stale copies are served, and a single refresh is enqueued
+    enqueue_job.assert_called_once_with("github.issue.sync.external", issue.id)
@@ -7,6 +7,7 @@ import pytest
 from polar.dashboard.schemas import IssueListType, IssueSortBy, IssueStatus
 from polar.enums import Platforms
 from polar.integrations.github import client as github
+from polar.issue.dependency_graph import issue_dependency_graph
 from polar.issue.service import issue as issue_service
 from polar.models.issue import Issue
 from polar.models.issue_dependency import IssueDependency
@@ -596,14 +597,31 @@ async def test_list_by_repository_type_and_status_dependencies_dependency(
     third_party_issue.title = "is_a_dependency"
     await third_party_issue.save(session)
 
-    # Create dependency
-    dep = await IssueDependency.create(
-        session=session,
-        organization_id=organization.id,
-        repository_id=repository.id,
-        dependent_issue_id=issue.id,
-        dependency_issue_id=third_party_issue.id,
+    # And an issue it depends on
+    transitive_issue = await random_objects.create_issue(
+        session, third_party_org, third_party_repo
     )
+    transitive_issue.title = "is_a_transitive_dependency"
+    await transitive_issue.save(session)
+
+    # Create dependencies
+    deps = [
+        await IssueDependency.create(
+            session=session,
+            organization_id=organization.id,
+            repository_id=repository.id,
+            dependent_issue_id=issue.id,
+            dependency_issue_id=third_party_issue.id,
+        ),
+        await IssueDependency.create(
+            session=session,
+            organization_id=third_party_org.id,
+            repository_id=third_party_repo.id,
+            dependent_issue_id=third_party_issue.id,
+            dependency_issue_id=transitive_issue.id,
+        ),
+    ]
+    await issue_dependency_graph.add_dependencies(session, deps)
 
     (issues, count) = await issue_service.list_by_repository_type_and_status(
         session,
@@ -615,9 +633,126 @@ async def test_list_by_repository_type_and_status_dependencies_dependency(
         load_pledges=True,
     )
 
-    # assert count == 1
     names = [i.title for i in issues]
-    assert names == ["is_a_dependency"]
+    assert names == ["is_a_transitive_dependency", "is_a_dependency"]
 
     # only the pledges by pledged_by_org/pledged_by_user should be included
     # assert len(issues[0].issue.pledges_zegl) == 1
+
+
+@pytest.mark.asyncio
+async def test_list_by_repository_type_and_status_issues_pages(
+    session: AsyncSession,
+    repository: Repository,
+    organization: Organization,
+) -> None:
+    pledged = await random_objects.create_issue(session, organization, repository)
+    for amount in [1000, 2000, 3000]:
+        await Pledge.create(
+            session=session,
+            id=uuid.uuid4(),
+            issue_id=pledged.id,
+            repository_id=repository.id,
+            organization_id=organization.id,
+            amount=amount,
+            fee=0,
+            state=PledgeState.created,
+        )
+    for _ in range(2):
+        await random_objects.create_issue(session, organization, repository)
+
+    await session.commit()
+
+    # A page that isn't the last one, the total is counted
+    (issues, count) = await issue_service.list_by_repository_type_and_status(
+        session,
+        repository_ids=[repository.id],
+        issue_list_type=IssueListType.issues,
+        sort_by=IssueSortBy.newest,
+        organization_id=organization.id,
+        have_pledge=True,
+        load_pledges=True,
+        limit=1,
+    )
+
+    # Pledges are loaded alongside, not joined into the page
+    assert count == 1
+    assert [i.id for i in issues] == [pledged.id]
+    assert sorted(p.amount for p in issues[0].pledges) == [1000, 2000, 3000]
+
+    (issues, count) = await issue_service.list_by_repository_type_and_status(
+        session,
+        repository_ids=[repository.id],
+        issue_list_type=IssueListType.issues,
+        sort_by=IssueSortBy.newest,
+        organization_id=organization.id,
+        load_pledges=True,
+        offset=2,
+        limit=2,
+    )
+
+    # The last page
+    assert count == 3
+    assert len(issues) == 1
+
+
+@pytest.mark.asyncio
+async def test_list_by_repository_type_and_status_dependencies_default_sort(
+    session: AsyncSession,
+    repository: Repository,
+    organization: Organization,
+    user: User,
+) -> None:
+    third_party_org = await random_objects.create_organization(session)
+    third_party_repo = await random_objects.create_repository(session, third_party_org)
+
+    async def dependency(title: str, amount: int, dependents: int) -> None:
+        dependency_issue = await random_objects.create_issue(
+            session, third_party_org, third_party_repo
+        )
+        dependency_issue.title = title
+        await dependency_issue.save(session)
+
+        await Pledge.create(
+            session=session,
+            id=uuid.uuid4(),
+            issue_id=dependency_issue.id,
+            repository_id=third_party_repo.id,
+            organization_id=third_party_org.id,
+            amount=amount,
+            fee=0,
+            state=PledgeState.created,
+        )
+
+        deps = []
+        for _ in range(dependents):
+            dependent_issue = await random_objects.create_issue(
+                session, organization, repository
+            )
+            deps.append(
+                await IssueDependency.create(
+                    session=session,
+                    organization_id=organization.id,
+                    repository_id=repository.id,
+                    dependent_issue_id=dependent_issue.id,
+                    dependency_issue_id=dependency_issue.id,
+                )
+            )
+        await issue_dependency_graph.add_dependencies(session, deps)
+
+    await dependency("depended_on_by_many", amount=1000, dependents=3)
+    await dependency("pledged_the_most", amount=2000, dependents=1)
+
+    (issues, count) = await issue_service.list_by_repository_type_and_status(
+        session,
+        repository_ids=[repository.id],
+        issue_list_type=IssueListType.dependencies,
+        sort_by=IssueSortBy.dependencies_default,
+        pledged_by_org=organization.id,
+        pledged_by_user=user.id,
+    )
+
+    # Pledges are summed once, whatever the number of dependents
+    names = [i.title for i in issues]
+    assert names == ["pledged_the_most", "depended_on_by_many"]
+    assert count == 2
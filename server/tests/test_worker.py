@@ -0,0 +1,108 @@
+import subprocess
+import sys
+from uuid import uuid4
+
+import pytest
+from arq.constants import default_queue_name, job_key_prefix
+
+from polar.worker import JobContext, enqueue_job, enqueue_many, get_pool, task
+
+
+@pytest.mark.asyncio
+async def test_get_pool_is_shared() -> None:
+    first = await get_pool()
+    second = await get_pool()
+    assert first is second
+
+
+@pytest.mark.asyncio
+async def test_enqueue_many() -> None:
+    jobs = await enqueue_many(
+        "test.enqueue_many", [(1,), (2,), (3,)], shared_kwarg="shared"
+    )
+    assert len(jobs) == 3
+    assert len({job.job_id for job in jobs}) == 3
+
+    for i, job in enumerate(jobs, start=1):
+        info = await job.info()
+        assert info is not None
+        assert info.function == "test.enqueue_many"
+        assert info.args == (i,)
+        assert info.kwargs["shared_kwarg"] == "shared"
+        assert "polar_context" in info.kwargs
+
+    pool = await get_pool()
+    await pool.delete(*[job_key_prefix + job.job_id for job in jobs])
+    await pool.zrem(default_queue_name, *[job.job_id for job in jobs])
+
+
+@pytest.mark.asyncio
+async def test_enqueue_many_empty() -> None:
+    assert await enqueue_many("test.enqueue_many", []) == []
+
+
+@task("test.coalesced", coalesce_key=lambda key, **kw: key)
+async def coalesced_task(ctx: JobContext, key: str) -> None:
+    ...
+
+
+@pytest.mark.asyncio
+async def test_enqueue_job_coalesced() -> None:
+    key = uuid4().hex
+
+    first = await enqueue_job("test.coalesced", key)
+    assert first is not None
+
+    # Absorbed by the pending job
+    assert await enqueue_job("test.coalesced", key) is None
+    assert await enqueue_many("test.coalesced", [(key,)]) == []
+
+    # Other keys are not affected
+    others = await enqueue_many("test.coalesced", [(uuid4().hex,), (uuid4().hex,)])
+    assert len(others) == 2
+
+    pool = await get_pool()
+    jobs = [first, *others]
+    await pool.delete(*[job_key_prefix + job.job_id for job in jobs])
+    await pool.zrem(default_queue_name, *[job.job_id for job in jobs])
+
+
+def test_debounce_requires_coalesce_key() -> None:
+    with pytest.raises(ValueError):
+        task("test.debounced", debounce=10)
+
+
+# Run in a fresh interpreter: tests import task modules, which would hide a task
+# that the API itself doesn't register.
+_enqueue_from_app = """
+import asyncio
+from uuid import uuid4
+
+from arq.constants import default_queue_name, job_key_prefix
+
+from polar.app import app  # noqa
+from polar.worker import close_pool, enqueue_job, get_pool
+
+
+async def main():
+    oauth_account_id = uuid4()
+    first = await enqueue_job("github.user.refresh_token", oauth_account_id)
+    second = await enqueue_job("github.user.refresh_token", oauth_account_id)
+
+    pool = await get_pool()
+    await pool.delete(job_key_prefix + first.job_id)
+    await pool.zrem(default_queue_name, first.job_id)
+    await close_pool()
+
+    assert second is None, "not coalesced"
+
+
+asyncio.run(main())
+"""
+
+
+def test_enqueue_job_coalesced_from_app() -> None:
+    result = subprocess.run(
+        [sys.executable, "-c", _enqueue_from_app], capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr